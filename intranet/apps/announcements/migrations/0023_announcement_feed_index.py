@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('announcements', '0022_auto_20151118_1037'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='announcement',
+            index_together=set([('pinned', 'added')]),
+        ),
+    ]
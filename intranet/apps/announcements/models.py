@@ -29,6 +29,18 @@ class AnnouncementManager(Manager):
                                            Q(announcementrequest__user=user) |
                                            Q(user=user)).distinct()
 
+    def visible_to_groups(self, groups):
+        """Get the announcements that are public or in one of the groups with the given ids.
+
+        Unlike visible_to_user, this doesn't join the groups, so it
+        returns no duplicates and can be ordered and sliced by the
+        database.
+
+        """
+        in_groups = Announcement.groups.through.objects.filter(group_id__in=groups).values("announcement_id")
+        with_groups = Announcement.groups.through.objects.values("announcement_id")
+        return Announcement.objects.filter(Q(id__in=in_groups) | ~Q(id__in=with_groups))
+
     def hidden_announcements(self, user):
         """Get a list of announcements marked as hidden for a given user (usually request.user).
 
@@ -151,6 +163,7 @@ class Announcement(models.Model):
 
     class Meta:
         ordering = ["-pinned", "-added"]
+        index_together = [("pinned", "added")]
 
 
 class AnnouncementRequest(models.Model):
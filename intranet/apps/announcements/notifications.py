@@ -13,7 +13,9 @@ import requests
 
 from requests_oauthlib import OAuth1
 
-from ..notifications.emails import email_send, email_send_bcc
+from .models import Announcement
+from ..notifications.emails import EMAIL_ERRORS, email_send, email_send_bcc
+from ..notifications.jobs import JobError, enqueue, job
 from ..users.models import User
 
 logger = logging.getLogger(__name__)
@@ -105,56 +107,79 @@ def announcement_approved_email(request, obj, req):
         messages.success(request, "Sent teacher approved email to {} users".format(len(submitter_emails)))
 
 
+def announcement_recipients(obj, send_all=False):
+    """Return the users who should be emailed a posted announcement."""
+    if send_all:
+        users = User.objects.all()
+    else:
+        users = User.objects.filter(receive_news_emails=True)
+
+    send_groups = obj.groups.all()
+    if send_groups.exists():
+        # specific to a group
+        users = users.filter(groups__in=send_groups).distinct()
+    return users
+
+
 def announcement_posted_email(request, obj, send_all=False):
-    """Send a notification posted email.
+    """Queue a notification posted email.
 
     obj: The announcement object
 
     """
 
     if settings.EMAIL_ANNOUNCEMENTS:
-        subject = "Announcement: {}".format(obj.title)
-        if send_all:
-            users = User.objects.all()
-        else:
-            users = User.objects.filter(receive_news_emails=True)
-
-        send_groups = obj.groups.all()
-        emails = []
-        users_send = []
-        for u in users:
-            if len(send_groups) == 0:
-                # no groups, public.
-                em = u.emails[0] if u.emails and len(u.emails) >= 1 else u.tj_email
-                if em:
-                    emails.append(em)
-                users_send.append(u)
-            else:
-                # specific to a group
-                user_groups = u.groups.all()
-                if any(i in send_groups for i in user_groups):
-                    # group intersection exists
-                    em = u.emails[0] if u.emails and len(u.emails) >= 1 else u.tj_email
-                    if em:
-                        emails.append(em)
-                    users_send.append(u)
-
-        logger.debug(users_send)
-        logger.debug(emails)
-
-        if not settings.PRODUCTION and len(emails) > 3:
+        if not settings.PRODUCTION and announcement_recipients(obj, send_all).count() > 3:
             raise exceptions.PermissionDenied("You're about to email a lot of people, and you aren't in production!")
-            return
 
         base_url = request.build_absolute_uri(reverse('index'))
         url = request.build_absolute_uri(reverse('view_announcement', args=[obj.id]))
-        data = {"announcement": obj, "info_link": url, "base_url": base_url}
-        email_send_bcc("announcements/emails/announcement_posted.txt", "announcements/emails/announcement_posted.html", data, subject, emails)
-        messages.success(request, "Sent email to {} users".format(len(users_send)))
+        enqueue(send_announcement_posted_email, obj.id, send_all, base_url, url, idempotency_key="announcement-email-{}".format(obj.id),
+                user=request.user)
+        messages.success(request, "Queued announcement email")
     else:
         logger.debug("Emailing announcements disabled")
 
 
+@job
+def send_announcement_posted_email(announcement_id, send_all, base_url, info_link):
+    """Job that looks up the addresses of the users who should receive a posted announcement, and
+    queues a job to email each batch of settings.EMAIL_BCC_BATCH_SIZE of them.
+
+    Each batch has its own idempotency key, so a batch that fails is
+    retried on its own, and is never sent twice. This is why the batches
+    are sent over separate SMTP connections rather than one.
+
+    """
+    obj = Announcement.objects.get(id=announcement_id)
+    users = User.objects.prefetch_ldap(announcement_recipients(obj, send_all).order_by("id"), ["emails", "user_type"])
+    emails = []
+    for u in users:
+        em = u.emails[0] if u.emails and len(u.emails) >= 1 else u.tj_email
+        if em:
+            emails.append(em)
+
+    logger.debug(emails)
+
+    batch_size = settings.EMAIL_BCC_BATCH_SIZE
+    batches = [emails[i:i + batch_size] for i in range(0, len(emails), batch_size)]
+    for num, batch in enumerate(batches, 1):
+        enqueue(send_announcement_email_batch, announcement_id, batch, base_url, info_link, num, len(batches),
+                idempotency_key="announcement-email-{}-{}".format(announcement_id, num))
+    logger.info("Queued announcement {} to {} users in {} batches".format(obj.id, len(emails), len(batches)))
+
+
+@job(retry_on=EMAIL_ERRORS)
+def send_announcement_email_batch(announcement_id, emails, base_url, info_link, num, total):
+    """Job that emails a posted announcement to batch ``num`` of ``total`` batches of addresses
+    in BCC."""
+    obj = Announcement.objects.get(id=announcement_id)
+    subject = "Announcement: {}".format(obj.title)
+    data = {"announcement": obj, "info_link": info_link, "base_url": base_url}
+    email_send_bcc("announcements/emails/announcement_posted.txt", "announcements/emails/announcement_posted.html", data, subject, emails)
+    logger.info("Emailed announcement {} batch {}/{}: {} addresses".format(announcement_id, num, total, len(emails)))
+
+
 def announcement_posted_twitter(request, obj):
     if obj.groups.count() == 0 and settings.TWITTER_KEYS:
         logger.debug("Publicly available")
@@ -170,20 +195,23 @@ def announcement_posted_twitter(request, obj):
             text = "{}... - {}".format(title[:110], url)
         logger.debug("Posting tweet: %s", text)
 
-        resp = notify_twitter(text)
-        respobj = json.loads(resp)
-
-        if respobj and "id" in respobj:
-            messages.success(request, "Posted tweet: {}".format(text))
-            messages.success(request, "https://twitter.com/tjintranet/status/{}".format(respobj["id"]))
-        else:
-            messages.error(request, resp)
-            logger.debug(resp)
-            logger.debug(respobj)
+        enqueue(post_tweet, text, idempotency_key="announcement-twitter-{}".format(obj.id), user=request.user)
+        messages.success(request, "Queued tweet: {}".format(text))
     else:
         logger.debug("Not posting to Twitter")
 
 
+@job
+def post_tweet(status):
+    """Job that posts a tweet, failing (and so retrying) if Twitter doesn't accept it."""
+    resp = notify_twitter(status)
+    respobj = json.loads(resp) if resp else None
+
+    if not respobj or "id" not in respobj:
+        raise JobError(resp)
+    logger.info("Posted tweet: https://twitter.com/tjintranet/status/{}".format(respobj["id"]))
+
+
 def notify_twitter(status):
     url = 'https://api.twitter.com/1.1/statuses/update.json'
 
@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
 
+from unittest.mock import patch
+
+from django.core import mail
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
+from .models import Announcement
+from .notifications import send_announcement_posted_email
+from ..notifications.models import Job
 from ..users.models import Group, User
 
 from ...test.ion_test import IonTestCase
@@ -41,3 +49,21 @@ class AnnouncementTest(IonTestCase):
         self.assertEqual(response.status_code, 200)
         response = self.client.post(reverse('show_announcement'))
         self.assertEqual(response.status_code, 404)
+
+    @override_settings(JOB_QUEUE_ASYNC=False, EMAIL_BCC_BATCH_SIZE=2)
+    def test_announcement_posted_email(self):
+        User.objects.update(receive_news_emails=False)
+        for i in range(5):
+            User.objects.create(username="2016user{}".format(i), receive_news_emails=True)
+        announcement = Announcement.objects.create(title="Test", content="Test")
+
+        with patch.object(User, "emails", property(lambda user: ["{}@tjhsst.edu".format(user.username)]), create=True):
+            with self.assertLogs("intranet.apps.announcements.notifications", "INFO") as logs:
+                send_announcement_posted_email(announcement.id, False, "https://ion.tjhsst.edu/", "https://ion.tjhsst.edu/announcements/1")
+            self.assertEqual([len(msg.bcc) for msg in mail.outbox], [2, 2, 1])
+            self.assertIn("batch 3/3: 1 addresses", logs.output[2])
+            self.assertEqual(Job.objects.filter(idempotency_key__startswith="announcement-email-{}-".format(announcement.id)).count(), 3)
+
+            # Batches that were already sent are not sent again
+            send_announcement_posted_email(announcement.id, False, "https://ion.tjhsst.edu/", "https://ion.tjhsst.edu/announcements/1")
+            self.assertEqual(len(mail.outbox), 3)
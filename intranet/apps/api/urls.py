@@ -27,6 +27,8 @@ urlpatterns = [
     url(r"^/signups/user/(?P<user_id>[0-9]+)$", eighth_api.EighthUserSignupListAdd.as_view(), name="api_eighth_user_signup_list"),
     url(r"^/signups/scheduled_activity/(?P<scheduled_activity_id>[0-9]+)$", eighth_api.EighthScheduledActivitySignupList.as_view(),
         name="api_eighth_scheduled_activity_signup_list"),
+    url(r"^/attendance/scheduled_activity/(?P<scheduled_activity_id>[0-9]+)$", eighth_api.EighthScheduledActivityAttendance.as_view(),
+        name="api_eighth_scheduled_activity_attendance"),
     url(r"^/schedule$", schedule_api.DayList.as_view(), name="api_schedule_day_list"),
     url(r"^/schedule/(?P<date>.*)$", schedule_api.DayDetail.as_view(), name="api_schedule_day_detail"),
     url(r"^/emerg$", emerg_api.emerg_status, name="api_emerg_status"),
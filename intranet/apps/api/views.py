@@ -63,5 +63,9 @@ def api_root(request, format=None):
                                                                                                                                           8889})],
         "/signups/scheduled_activity/<scheduled_activity_id>": ["Get eighth signups for a specific scheduled activity", perma_reverse(
             request, "api_eighth_scheduled_activity_signup_list", kwargs={"scheduled_activity_id": 889})]
+    }), ("Attendance", {
+        "/attendance/scheduled_activity/<scheduled_activity_id>": ["Take attendance for a scheduled activity by POSTing the ids of present members",
+                                                                   perma_reverse(request, "api_eighth_scheduled_activity_attendance",
+                                                                                 kwargs={"scheduled_activity_id": 889})]
     })))
     return Response(views)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from django.apps import AppConfig
+
+
+class DashboardConfig(AppConfig):
+    name = "intranet.apps.dashboard"
+
+    def ready(self):
+        from .feed import connect_signals
+        connect_signals()
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import operator
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+
+from ..announcements.models import Announcement, AnnouncementRequest
+from ..events.models import Event
+from ...utils import cache as cache_version
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 10
+
+VERSION_CACHE_KEY = "dashboard:feed_version"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# An entry in the feed. Entries sort in feed order, oldest first (the
+# feed is shown newest first); ``expires`` is only used to tell when a
+# cached entry should no longer be shown.
+FeedItem = namedtuple("FeedItem", ["pinned", "added", "type", "id", "expires"])
+
+LOOKUPS = {"gt": operator.gt, "gte": operator.ge}
+
+
+class FeedSource(object):
+    """The announcements or events shown in a feed.
+
+    Attributes:
+        feed_type
+            "announcement" or "event", the dashboard_type of the items.
+        shared
+            A queryset of the items that are visible because of the user's
+            groups (or that are public), which is the same for every user
+            with the same groups.
+        personal
+            A queryset of the other items visible to the user (e.g. ones
+            they submitted), or None.
+        expires
+            A (field, lookup, value) tuple that items must match to be
+            shown, e.g. ("expiration_date", "gt", now), or None.
+        variant
+            A name for the kind of items shown (e.g. "all" for admins),
+            used in cache keys.
+
+    """
+
+    def __init__(self, model, shared, personal=None, expires=None, variant="visible"):
+        self.model = model
+        self.feed_type = model._meta.model_name
+        self.shared = shared
+        self.personal = personal
+        self.expires = expires
+        self.variant = variant
+        # Events can't be pinned yet
+        self.has_pinned = self.feed_type == "announcement"
+
+    def is_current(self, item):
+        if self.expires is None:
+            return True
+        _, lookup, value = self.expires
+        return LOOKUPS[lookup](item.expires, value)
+
+    def items(self, queryset, cursor=None, older=True, limit=PAGE_SIZE + 1):
+        """Return the first ``limit`` FeedItems of ``queryset`` older (or newer) than ``cursor``,
+        in that order."""
+        if self.expires is not None:
+            field, lookup, value = self.expires
+            queryset = queryset.filter(**{"{}__{}".format(field, lookup): value})
+        if cursor is not None:
+            queryset = self.keyset_filter(queryset, cursor, older)
+            if queryset is None:
+                return []
+
+        fields = ["added", "id"]
+        if self.has_pinned:
+            fields.insert(0, "pinned")
+        ordering = ["-" + field if older else field for field in fields]
+
+        expires_field = self.expires[0] if self.expires else "id"
+        items = []
+        for row in queryset.order_by(*ordering).values_list(*(fields + [expires_field]))[:limit]:
+            if not self.has_pinned:
+                row = (False,) + row
+            items.append(FeedItem(row[0], row[1], self.feed_type, row[2], row[3]))
+        return items
+
+    def keyset_filter(self, queryset, cursor, older):
+        """Filter ``queryset`` to the items after ``cursor`` in feed order (or before it, if
+        ``older`` is False), or return None if there are none."""
+        lt = "lt" if older else "gt"
+
+        if self.feed_type == cursor.type:
+            same_added = Q(added=cursor.added, **{"id__" + lt: cursor.id})
+        elif (self.feed_type < cursor.type) == older:
+            # Every item added at the same time as the cursor sorts on this side of it
+            same_added = Q(added=cursor.added)
+        else:
+            same_added = None
+
+        q = Q(**{"added__" + lt: cursor.added})
+        if same_added is not None:
+            q |= same_added
+
+        if not self.has_pinned:
+            if cursor.pinned:
+                return queryset if older else None
+            return queryset.filter(q)
+
+        q = Q(pinned=cursor.pinned) & q
+        if cursor.pinned and older:
+            q |= Q(pinned=False)
+        elif not cursor.pinned and not older:
+            q |= Q(pinned=True)
+        return queryset.filter(q)
+
+
+def encode_cursor(item):
+    delta = item.added - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return "{}_{}_{}_{}".format(int(item.pinned), microseconds, item.type, item.id)
+
+
+def decode_cursor(value):
+    """Parse a cursor from encode_cursor, returning None if it is invalid."""
+    try:
+        pinned, microseconds, feed_type, item_id = value.split("_")
+        if feed_type not in ("announcement", "event"):
+            return None
+        return FeedItem(pinned == "1", EPOCH + timedelta(microseconds=int(microseconds)), feed_type, int(item_id), None)
+    except (ValueError, OverflowError):
+        return None
+
+
+def merge_items(item_lists, older=True, limit=PAGE_SIZE + 1):
+    """Merge lists of FeedItems, dropping duplicates, and return the first ``limit``."""
+    unique = {(item.type, item.id): item for items in item_lists for item in items}
+    return sorted(unique.values(), reverse=older)[:limit]
+
+
+def mark_changed(*args, **kwargs):
+    """Invalidate every cached first page, e.g. after an announcement is posted."""
+    cache_version.mark_changed(VERSION_CACHE_KEY)
+
+
+def connect_signals():
+    for model in (Announcement, Event):
+        name = model.__name__
+        post_save.connect(mark_changed, sender=model, dispatch_uid="dashboard_feed_save_{}".format(name))
+        post_delete.connect(mark_changed, sender=model, dispatch_uid="dashboard_feed_delete_{}".format(name))
+        m2m_changed.connect(mark_changed, sender=model.groups.through, dispatch_uid="dashboard_feed_groups_{}".format(name))
+
+
+def shared_cache_key(sources, group_key):
+    parts = ["{}-{}-{}".format(source.feed_type, source.variant, "current" if source.expires else "expired") for source in sources]
+    return "dashboard:feed:{}:{}:{}".format(cache_version.get_version(VERSION_CACHE_KEY), ",".join(parts), group_key)
+
+
+def get_shared_first_page(sources, group_key):
+    """Return the first FeedItems of the shared parts of ``sources``, cached for each group
+    set."""
+    key = shared_cache_key(sources, group_key)
+    cached = cache.get(key)
+    if cached is not None:
+        by_type = {source.feed_type: source for source in sources}
+        if all(by_type[item.type].is_current(item) for item in cached):
+            return cached
+
+    items = merge_items([source.items(source.shared) for source in sources])
+    cache.set(key, items, timeout=settings.CACHE_AGE["dashboard_feed"])
+    return items
+
+
+def load_items(items):
+    """Return the Announcement and Event objects for a list of FeedItems, in the same order."""
+    objects = {}
+    for model in (Announcement, Event):
+        ids = [item.id for item in items if item.type == model._meta.model_name]
+        if ids:
+            for obj in model.objects.in_bulk(ids).values():
+                objects[(obj.dashboard_type, obj.id)] = obj
+    return [objects[(item.type, item.id)] for item in items if (item.type, item.id) in objects]
+
+
+def get_feed_sources(user, groups, show_all_announcements=False, show_all_events=False, show_expired=False):
+    """Return the FeedSources of the dashboard of ``user``, who is in the groups with the ids
+    ``groups``.
+
+    An announcement is shown if it is public, in one of the user's
+    groups, or was submitted, requested or approved by the user. An
+    event is shown if it is approved and public, in one of the user's
+    groups, or was submitted by the user.
+
+    """
+    now = timezone.now()
+
+    if show_all_announcements:
+        announcements = FeedSource(Announcement, Announcement.objects.all(), variant="all")
+    else:
+        submitted = AnnouncementRequest.objects.filter(Q(user=user) | Q(teachers_requested=user)).values("posted")
+        announcements = FeedSource(Announcement, Announcement.objects.visible_to_groups(groups),
+                                   Announcement.objects.filter(Q(user=user) | Q(id__in=submitted)),
+                                   None if show_expired else ("expiration_date", "gt", now))
+
+    if show_all_events:
+        events = FeedSource(Event, Event.objects.all(), variant="all")
+    else:
+        # Unlike announcements, show events for the rest of the day after they occur.
+        midnight = timezone.make_aware(datetime.combine(timezone.localtime(now).date(), datetime.min.time()), timezone.get_current_timezone())
+        events = FeedSource(Event, Event.objects.visible_to_groups(groups), Event.objects.filter(approved=True, user=user),
+                            None if show_expired else ("time", "gte", midnight))
+        if not show_expired:
+            events.shared = events.shared.filter(show_on_dashboard=True)
+            events.personal = events.personal.filter(show_on_dashboard=True)
+
+    return [announcements, events]
+
+
+def get_feed_page(sources, group_key, cursor=None, older=True):
+    """Return a page of the merged feed of ``sources``, newest first.
+
+    Each page is found with keyset pagination on (pinned, added), so it
+    only reads the rows it shows, however long the archive is. The
+    shared part of the first page is cached for each group set.
+
+    Args:
+        group_key: A string identifying the groups the shared querysets
+            were filtered to.
+        cursor: A FeedItem (from decode_cursor) to page from, or None for
+            the first page.
+        older: Whether to show the items older than ``cursor`` (the next
+            page) or newer than it (the previous page).
+
+    Returns:
+        A tuple of the list of Announcement and Event objects, the cursor
+        of the previous page and the cursor of the next page (or None if
+        there is no such page).
+
+    """
+    if cursor is None:
+        shared = get_shared_first_page(sources, group_key)
+    else:
+        shared = merge_items([source.items(source.shared, cursor, older) for source in sources], older)
+
+    personal = [source.items(source.personal, cursor, older) for source in sources if source.personal is not None]
+    items = merge_items([shared] + personal, older)
+
+    if cursor is not None and not older:
+        if len(items) <= PAGE_SIZE:
+            # Reached the newest items, so show the first page as it is normally shown
+            return get_feed_page(sources, group_key)
+        page = list(reversed(items[:PAGE_SIZE]))
+        return load_items(page), encode_cursor(page[0]), encode_cursor(page[-1])
+
+    page = items[:PAGE_SIZE]
+    if not page:
+        return [], None, None
+    prev_cursor = encode_cursor(page[0]) if cursor is not None else None
+    next_cursor = encode_cursor(page[-1]) if len(items) > PAGE_SIZE else None
+    return load_items(page), prev_cursor, next_cursor
+
+
+def group_cache_key(groups):
+    return hashlib.sha1(",".join(str(group) for group in sorted(groups)).encode()).hexdigest()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .feed import PAGE_SIZE, decode_cursor, get_feed_page, get_feed_sources, shared_cache_key
+from ..announcements.models import Announcement
+from ..events.models import Event
+from ..users.models import User
+from ...test.ion_test import IonTestCase
+
+
+class DashboardFeedTest(IonTestCase):
+    """Tests for paging through the merged announcement and event feed."""
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_feed_pages(self):
+        cache.clear()
+        user = User.objects.get_or_create(username="awilliam")[0]
+        other = User.objects.get_or_create(username="2016jwilliam")[0]
+        group = Group.objects.create(name="feed_test_group")
+        hidden_group = Group.objects.create(name="feed_test_hidden_group")
+        user.groups.add(group)
+
+        expected = []
+        for i in range(12):
+            expected.append(Announcement.objects.create(title="Public {}".format(i), content=""))
+            if i % 3 == 0:
+                expected.append(Event.objects.create(title="Event {}".format(i), description="", time=timezone.now(), location="",
+                                                     approved=True))
+        in_group = Announcement.objects.create(title="Group", content="")
+        in_group.groups.add(group)
+        expected.append(in_group)
+        own = Announcement.objects.create(title="Own", content="", user=user)
+        own.groups.add(hidden_group)
+        expected.append(own)
+        expected.insert(0, Announcement.objects.create(title="Pinned", content="", pinned=True))
+
+        hidden = Announcement.objects.create(title="Hidden", content="", user=other)
+        hidden.groups.add(hidden_group)
+        Event.objects.create(title="Unapproved", description="", time=timezone.now(), location="")
+        Announcement.objects.create(title="Expired", content="", expiration_date=timezone.now())
+
+        expected = expected[:1] + sorted(expected[1:], key=lambda item: (item.added, item.dashboard_type, item.id), reverse=True)
+        groups = [group.id]
+        sources = get_feed_sources(user, groups)
+
+        pages = []
+        cursor = None
+        while True:
+            items, prev_cursor, next_cursor = get_feed_page(sources, "test", decode_cursor(cursor) if cursor else None)
+            self.assertLessEqual(len(items), PAGE_SIZE)
+            self.assertEqual(prev_cursor is None, cursor is None)
+            pages.append((items, prev_cursor))
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+
+        self.assertEqual([item for items, _ in pages for item in items], expected)
+        self.assertEqual(len(pages), 2)
+
+        # Paging back from the second page shows the first
+        self.assertEqual(get_feed_page(sources, "test", decode_cursor(pages[1][1]), older=False)[0], pages[0][0])
+
+        # The cached first page is still used, with the user's own posts merged in
+        self.assertIsNotNone(cache.get(shared_cache_key(sources, "test")))
+        with self.assertNumQueries(4):
+            self.assertEqual(get_feed_page(get_feed_sources(user, groups), "test")[0], pages[0][0])
+
+        # Posting an announcement invalidates the cached first page
+        new = Announcement.objects.create(title="New", content="")
+        self.assertIsNone(cache.get(shared_cache_key(sources, "test")))
+        self.assertEqual(get_feed_page(get_feed_sources(user, groups), "test")[0][:2], [expected[0], new])
@@ -1,16 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from datetime import date, time, datetime, timedelta
-from itertools import chain
+from datetime import date, datetime, timedelta
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.shortcuts import render
-from django.utils import timezone
 
+from .feed import decode_cursor, get_feed_page, get_feed_sources, group_cache_key
 from ..announcements.models import Announcement, AnnouncementRequest
 from ..eighth.models import EighthBlock, EighthScheduledActivity, EighthSignup
 from ..emerg.views import get_emerg
@@ -296,68 +295,45 @@ def get_announcements_list(request, context):
       * There are no groups
       * The groups are in union
 
+    Returns:
+        A tuple of the FeedSources of the announcements and events, and
+        the cache key of the user's groups.
+
     """
     user = context["user"]
+    show_all_announcements = context["announcements_admin"] and context["show_all"]
+    show_all_events = context["events_admin"] and context["show_all"]
 
-    if context["announcements_admin"] and context["show_all"]:
-        # Show all announcements if user has admin permissions and the
-        # show_all GET argument is given.
-        announcements = (Announcement.objects.all())
-    else:
-        # Only show announcements for groups that the user is enrolled in.
-        if context["show_expired"]:
-            announcements = (Announcement.objects.visible_to_user(user))
-        else:
-            announcements = (Announcement.objects.visible_to_user(user).filter(expiration_date__gt=timezone.now()))
-
-    if context["events_admin"] and context["show_all"]:
-        events = (Event.objects.all())
-    else:
-        if context["show_expired"]:
-            events = (Event.objects.visible_to_user(user))
-        else:
-            # Unlike announcements, show events for the rest of the day after they occur.
-            midnight = timezone.datetime.combine(timezone.make_aware(datetime.now(), timezone.get_current_timezone()).date(), time(0, 0))
-            events = (Event.objects.visible_to_user(user).filter(time__gte=midnight, show_on_dashboard=True))
+    groups = list(user.groups.values_list("id", flat=True))
+    sources = get_feed_sources(user, groups, show_all_announcements=show_all_announcements, show_all_events=show_all_events,
+                               show_expired=context["show_expired"])
+    group_key = "all" if show_all_announcements and show_all_events else group_cache_key(groups)
 
-    items = sorted(chain(announcements, events), key=lambda item: (item.pinned, item.added))
-    items.reverse()
+    return sources, group_key
 
-    return items
 
+def paginate_announcements_list(request, context, sources, group_key):
+    """Get one page of the announcements and events.
 
-def paginate_announcements_list(request, context, items):
-    """
-    ***TODO*** Migrate to django Paginator (see lostitems)
+    Pages are selected with ?before=<cursor> (older posts) or
+    ?after=<cursor> (newer posts), using the cursors of the first and
+    last items shown.
 
     """
+    cursor = None
+    older = True
+    if "before" in request.GET:
+        cursor = decode_cursor(request.GET["before"])
+    elif "after" in request.GET:
+        cursor = decode_cursor(request.GET["after"])
+        older = False
 
-    # pagination
-    if "start" in request.GET:
-        try:
-            start_num = int(request.GET.get("start"))
-        except ValueError:
-            start_num = 0
-    else:
-        start_num = 0
-
-    display_num = 10
-    end_num = start_num + display_num
-    prev_page = start_num - display_num
-    more_items = ((len(items) - start_num) > display_num)
-    try:
-        items_sorted = items[start_num:end_num]
-    except (ValueError, AssertionError):
-        items_sorted = items[:display_num]
-    else:
-        items = items_sorted
+    items, prev_cursor, next_cursor = get_feed_page(sources, group_key, cursor, older)
 
     context.update({
         "items": items,
-        "start_num": start_num,
-        "end_num": end_num,
-        "prev_page": prev_page,
-        "more_items": more_items,
+        "prev_cursor": prev_cursor,
+        "next_cursor": next_cursor
     })
 
     return context, items
@@ -455,11 +431,11 @@ def dashboard_view(request, show_widgets=True, show_expired=False, ignore_dashbo
         "show_expired": show_expired
     }
 
-    # Get list of announcements
-    items = get_announcements_list(request, context)
+    # Get the announcements and events visible to the user
+    sources, group_key = get_announcements_list(request, context)
 
     # Paginate announcements list
-    context, items = paginate_announcements_list(request, context, items)
+    context, items = paginate_announcements_list(request, context, sources, group_key)
 
     user_hidden_announcements = (Announcement.objects.hidden_announcements(user).values_list("id", flat=True))
     user_hidden_events = (Event.objects.hidden_events(user).values_list("id", flat=True))
@@ -33,6 +33,7 @@ class EighthScheduledActivityAdmin(SimpleHistoryAdmin):
     list_display = ('activity', 'block', 'comments', 'admin_comments', 'cancelled')
     list_filter = ('block', 'cancelled',)
     ordering = ('block', 'activity')
+    readonly_fields = ('member_count',)
 
 
 class EighthSignupAdmin(SimpleHistoryAdmin):
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from django.apps import AppConfig
+
+
+class EighthConfig(AppConfig):
+    name = "intranet.apps.eighth"
+
+    def ready(self):
+        from .history import connect_signals
+        connect_signals()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""The eighth period signups of a user in the locked blocks of this year."""
+
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+
+from .models import EighthActivity, EighthBlock, EighthSignup
+from ...utils.cache import get_version, mark_changed
+
+logger = logging.getLogger(__name__)
+
+# Changed whenever a block changes (e.g. is locked), which can change every
+# user's summary
+VERSION_CACHE_KEY = "eighth:signup_summary_version"
+
+
+def history_blocks():
+    return EighthBlock.objects.get_blocks_this_year().filter(locked=True)
+
+
+def get_history_signups(user):
+    """Return a dict mapping the ids of this year's locked blocks to the user's signups for
+    them.
+
+    The signups, and their activities, blocks, sponsors and rooms, are
+    loaded with one query and four batched prefetches.
+
+    """
+    signups = (EighthSignup.objects.filter(user=user, scheduled_activity__block__in=history_blocks())
+               .select_related("scheduled_activity__activity", "scheduled_activity__block")
+               .prefetch_related("scheduled_activity__sponsors", "scheduled_activity__rooms", "scheduled_activity__activity__sponsors",
+                                 "scheduled_activity__activity__rooms"))
+    return {signup.scheduled_activity.block_id: signup for signup in signups}
+
+
+def summary_cache_key(user_id, version):
+    return "eighth:signup_summary:{}:{}".format(version, user_id)
+
+
+def get_signup_summary(user):
+    """Return a list of (activity id, signups) pairs for the activities the user signed up for
+    in this year's locked blocks, most signups first.
+
+    The summary is counted with one grouped query and cached until one of
+    the user's signups, or a block, changes.
+
+    """
+    key = summary_cache_key(user.id, get_version(VERSION_CACHE_KEY))
+    summary = cache.get(key)
+    if summary is None:
+        summary = list(EighthSignup.objects.filter(user=user, scheduled_activity__block__in=history_blocks())
+                       .values_list("scheduled_activity__activity").annotate(signups=Count("id")).order_by("-signups", "scheduled_activity__activity"))
+        cache.set(key, summary, timeout=settings.CACHE_AGE["eighth_signup_summary"])
+    return summary
+
+
+def get_often_activities(user):
+    """Return a list of dicts with each "activity" the user signed up for this year and its
+    "count", most signups first."""
+    summary = get_signup_summary(user)
+    activities = EighthActivity.objects.prefetch_related("sponsors").in_bulk([activity_id for activity_id, _ in summary])
+    return [{"count": count, "activity": activities[activity_id]} for activity_id, count in summary if activity_id in activities]
+
+
+def invalidate_signup_summaries(user_ids):
+    """Forget the cached summaries of some users, e.g. after their signups are changed in
+    bulk."""
+    version = get_version(VERSION_CACHE_KEY)
+    cache.delete_many([summary_cache_key(user_id, version) for user_id in set(user_ids)])
+
+
+def signup_changed(sender, instance, **kwargs):
+    invalidate_signup_summaries([instance.user_id])
+
+
+def block_changed(*args, **kwargs):
+    mark_changed(VERSION_CACHE_KEY)
+
+
+def connect_signals():
+    post_save.connect(signup_changed, sender=EighthSignup, dispatch_uid="eighth_signup_summary_signup_save")
+    post_delete.connect(signup_changed, sender=EighthSignup, dispatch_uid="eighth_signup_summary_signup_delete")
+    post_save.connect(block_changed, sender=EighthBlock, dispatch_uid="eighth_signup_summary_block_save")
+    post_delete.connect(block_changed, sender=EighthBlock, dispatch_uid="eighth_signup_summary_block_delete")
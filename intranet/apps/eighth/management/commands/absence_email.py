@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import json
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
 from intranet.apps.eighth.models import EighthSignup
-from intranet.apps.eighth.notifications import absence_email
+from intranet.apps.eighth.notifications import send_absence_emails
+from intranet.apps.notifications.jobs import enqueue, task_name
+from intranet.apps.notifications.models import Job
 
 
 class Command(BaseCommand):
@@ -14,19 +19,40 @@ class Command(BaseCommand):
 
         parser.add_argument('--pretend', action='store_true', dest='pretend', default=False, help="Pretend, and don't actually do anything.")
 
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=None,
+                            help="The number of absences emailed over each SMTP connection (defaults to EMAIL_SEND_BATCH_SIZE).")
+
+    def queued_signup_ids(self):
+        """Return the ids of the signups whose absence emails are waiting to be sent by a job
+        that was already queued (e.g. by an earlier run of this command)."""
+        signup_ids = set()
+        for arguments in (Job.objects.filter(task=task_name(send_absence_emails), status__in=[Job.QUEUED, Job.RUNNING])
+                          .values_list("arguments", flat=True)):
+            signup_ids.update(json.loads(arguments)["args"][0])
+        return signup_ids
+
     def handle(self, *args, **options):
 
         log = not options["silent"]
 
-        absences = EighthSignup.objects.get_absences().filter(absence_emailed=False)
+        absences = (EighthSignup.objects.get_absences().filter(absence_emailed=False).order_by("id")
+                    .select_related("user", "scheduled_activity__activity", "scheduled_activity__block"))
 
+        signup_ids = []
         for signup in absences:
             if log:
                 self.stdout.write("{}".format(signup))
-            if not options["pretend"]:
-                absence_email(signup)
-                signup.absence_emailed = True
-                signup.save()
+            signup_ids.append(signup.id)
+
+        if not options["pretend"]:
+            # The job skips signups that were already emailed and marks the others once they have been sent.
+            # Jobs that died while running (e.g. with the process that ran them inline) no longer hold their signups.
+            Job.objects.requeue_stale()
+            queued = self.queued_signup_ids()
+            signup_ids = [signup_id for signup_id in signup_ids if signup_id not in queued]
+            batch_size = options["batch_size"] or settings.EMAIL_SEND_BATCH_SIZE
+            for i in range(0, len(signup_ids), batch_size):
+                enqueue(send_absence_emails, signup_ids[i:i + batch_size])
 
         if log:
             self.stdout.write("Done.")
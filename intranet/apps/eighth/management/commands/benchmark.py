@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from cacheops import invalidate_all
+
+from intranet.test import benchmark
+
+
+class Command(BaseCommand):
+    help = ("Seed a test database and an in-memory LDAP server with a school's worth of students, activities and blocks, run "
+            "the signup rush scenarios with concurrent clients, and report latency percentiles and queries per request as JSON.")
+
+    def add_arguments(self, parser):
+        names = [scenario.name for scenario in benchmark.SCENARIOS]
+        parser.add_argument('--clients', type=int, default=10, help="The number of concurrent clients.")
+        parser.add_argument('--requests', type=int, default=20, help="The number of requests made by each client.")
+        parser.add_argument('--warmup', type=int, default=2, help="The number of unmeasured requests each client makes first.")
+        parser.add_argument('--students', type=int, default=2000, help="The number of students to create.")
+        parser.add_argument('--activities', type=int, default=200, help="The number of activities to create.")
+        parser.add_argument('--days', type=int, default=5, help="The number of days of A and B blocks to create.")
+        parser.add_argument('--scenarios', default=",".join(names), help="The scenarios to run, from {}.".format(", ".join(names)))
+        parser.add_argument('--seed', type=int, default=0, help="The random seed, so that runs can be compared.")
+        parser.add_argument('--output', help="Write the report to this file instead of stdout.")
+        parser.add_argument('--baseline', help="Compare the results with those in this report.")
+        parser.add_argument('--max-regression', type=float, dest='max_regression', default=None,
+                            help="Fail if any metric is worse than the baseline by more than this fraction (e.g. 0.2).")
+
+    def handle(self, *args, **options):
+        if settings.PRODUCTION:
+            raise CommandError("Refusing to benchmark in production.")
+
+        scenarios = {scenario.name: scenario for scenario in benchmark.SCENARIOS}
+        names = [name.strip() for name in options["scenarios"].split(",") if name.strip()]
+        unknown = [name for name in names if name not in scenarios]
+        if unknown:
+            raise CommandError("Unknown scenarios: {}".format(", ".join(unknown)))
+        if options["clients"] > options["students"]:
+            raise CommandError("There must be at least as many students as clients.")
+
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        school = benchmark.School(options["students"], options["activities"], options["days"], options["seed"])
+        school.generate_users()
+        ldif_path = school.write_ldif()
+        try:
+            server = benchmark.start_ldap_server(ldif_path)
+        except ImportError:
+            raise CommandError("The benchmark needs the python-ldap-test package.")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(**benchmark.benchmark_settings(server.config["port"])):
+                # Cacheops always uses CACHEOPS_REDIS, so clear it rather than mixing benchmark data into it
+                invalidate_all()
+                try:
+                    report = self.run(school, [scenarios[name] for name in names], options)
+                finally:
+                    invalidate_all()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            server.stop()
+            os.remove(ldif_path)
+
+        if baseline is not None:
+            report["comparison"] = benchmark.compare_reports(report, baseline)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None and options["max_regression"] is not None:
+            regressions = ["{} {}: {:+.0%}".format(name, metric, change)
+                           for name, changes in sorted(report["comparison"].items()) for metric, change in sorted(changes.items())
+                           if change is not None and change > options["max_regression"]]
+            if regressions:
+                raise CommandError("Regressions from the baseline: {}".format("; ".join(regressions)))
+
+    def run(self, school, scenarios, options):
+        start = time.time()
+        school.seed_database()
+        if settings.LDAP_DIRECTORY_MIRROR:
+            call_command("sync_ldap_directory", "--full", stdout=open(os.devnull, "w"))
+        self.stderr.write("Seeded {} students and {} activities in {} blocks in {:.1f}s".format(
+            len(school.students), school.num_activities, len(school.blocks), time.time() - start))
+
+        report = {
+            "config": {key: options[key] for key in ("clients", "requests", "warmup", "students", "activities", "days", "seed")},
+            "scenarios": {}
+        }
+        for scenario in scenarios:
+            self.stderr.write("Running {}...".format(scenario.name))
+            report["scenarios"][scenario.name] = benchmark.run_scenario(scenario, school, options["clients"], options["requests"],
+                                                                        options["warmup"], options["seed"])
+        return report
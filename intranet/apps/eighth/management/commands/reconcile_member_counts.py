@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from intranet.apps.eighth.models import EighthScheduledActivity
+
+
+class Command(BaseCommand):
+    help = "Recount the signups of every scheduled activity and repair member counts that have drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pretend', action='store_true', dest='pretend', default=False, help="Pretend, and don't actually do anything.")
+
+    def handle(self, *args, **options):
+        drifted = EighthScheduledActivity.objects.reconcile_member_counts(pretend=options["pretend"])
+
+        for sched_act_id, member_count, actual in drifted:
+            self.stdout.write("{}: {} -> {}".format(sched_act_id, member_count, actual))
+
+        if options["pretend"]:
+            self.stdout.write("Done. {} counts would have been repaired.".format(len(drifted)))
+        else:
+            self.stdout.write("Done. {} counts repaired.".format(len(drifted)))
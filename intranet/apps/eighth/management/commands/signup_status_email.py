@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connection
 
-from intranet.apps.eighth.models import EighthBlock, EighthSignup
-from intranet.apps.eighth.notifications import signup_status_email
+from intranet.apps.eighth.models import EighthBlock
+from intranet.apps.eighth.notifications import send_signup_status_emails, signup_status_recipients
+from intranet.apps.notifications.jobs import enqueue
+from intranet.apps.notifications.models import Job
 from intranet.apps.users.models import User
 
 
@@ -25,6 +33,34 @@ class Command(BaseCommand):
         parser.add_argument('--everyone', action='store_true', dest='everyone', default=False,
                             help="Send to everyone, even those who have no eighth emails set.")
 
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=None,
+                            help="The number of users emailed over each SMTP connection (defaults to EMAIL_SEND_BATCH_SIZE).")
+
+        parser.add_argument('--threads', type=int, dest='threads', default=None,
+                            help="The number of batches sent at once when jobs run inline (defaults to EMAIL_SEND_THREADS).")
+
+    def key_prefix(self, today, block_ids):
+        return "signup-status-emails-{}-{}-".format(today, ",".join(map(str, block_ids)))
+
+    def queued_user_ids(self, today, block_ids):
+        """Return the ids of the users who were already queued a reminder for these blocks today
+        (e.g. by an earlier run of this command), unless it failed."""
+        user_ids = set()
+        for arguments in (Job.objects.filter(idempotency_key__startswith=self.key_prefix(today, block_ids),
+                                             status__in=[Job.QUEUED, Job.RUNNING, Job.SUCCEEDED]).values_list("arguments", flat=True)):
+            user_ids.update(json.loads(arguments)["args"][0])
+        return user_ids
+
+    def enqueue_batch(self, user_ids, today, block_ids, run):
+        # ``run`` tells apart the keys of a batch that failed and the same batch sent again by a later run
+        batch_hash = hashlib.sha1(",".join(map(str, user_ids)).encode()).hexdigest()
+        try:
+            return enqueue(send_signup_status_emails, user_ids, block_ids,
+                           idempotency_key="{}{}-{}".format(self.key_prefix(today, block_ids), run, batch_hash))
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
     def handle(self, *args, **options):
 
         log = not options["silent"]
@@ -58,28 +94,47 @@ class Command(BaseCommand):
         if log:
             self.stdout.write("{}".format(next_blocks))
             self.stdout.write("{}".format(options))
-            self.stdout.write("{}".format(users))
-
-        for user in users:
-            user_signups = EighthSignup.objects.filter(user=user, scheduled_activity__block__in=next_blocks)
-            if user_signups.count() < next_blocks.count():
-                """User hasn't signed up for a block."""
-                if log:
-                    self.stdout.write("User {} hasn't signed up for a block".format(user))
-                if not options["pretend"]:
-                    try:
-                        signup_status_email(user, next_blocks)
-                    except Exception as e:
-                        print(e)
-            elif user_signups.filter(scheduled_activity__cancelled=True).count() > 0:
-                """User is in a cancelled activity."""
-                if log:
-                    self.stdout.write("User {} is in a cancelled activity.".format(user))
-                if not options["pretend"]:
-                    try:
-                        signup_status_email(user, next_blocks)
-                    except Exception as e:
-                        print(e)
 
+        block_ids = [blk.id for blk in next_blocks]
+        recipients = list(signup_status_recipients(users, next_blocks).order_by("id").values_list("id", "username", "num_signups", "num_cancelled"))
+        missing = [r for r in recipients if r[2] < len(block_ids)]
+        cancelled = [r for r in recipients if r[3] > 0]
         if log:
-            self.stdout.write("Done.")
+            for user_id, username, num_signups, num_cancelled in recipients:
+                if num_signups < len(block_ids):
+                    self.stdout.write("User {} hasn't signed up for a block".format(username))
+                if num_cancelled > 0:
+                    self.stdout.write("User {} is in a cancelled activity.".format(username))
+
+        if options["pretend"]:
+            self.stdout.write("Would email {} users: {} have not signed up for a block and {} are in a cancelled activity.".format(
+                len(recipients), len(missing), len(cancelled)))
+            return
+
+        # Only one reminder per user for these blocks each day, even if the command is run again
+        queued = self.queued_user_ids(today, block_ids)
+        user_ids = [r[0] for r in recipients if r[0] not in queued]
+        if log and queued:
+            self.stdout.write("Skipping {} users who were already emailed today.".format(len(recipients) - len(user_ids)))
+
+        batch_size = options["batch_size"] or settings.EMAIL_SEND_BATCH_SIZE
+        batches = [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=options["threads"] or settings.EMAIL_SEND_THREADS) as executor:
+            jobs = list(executor.map(lambda batch: self.enqueue_batch(batch, today, block_ids, int(start)), batches))
+        elapsed = time.time() - start
+
+        if not log:
+            return
+
+        if settings.JOB_QUEUE_ASYNC:
+            self.stdout.write("Queued {} users in {} batches in {:.1f}s.".format(len(user_ids), len(batches), elapsed))
+        else:
+            statuses = dict(Job.objects.filter(id__in=[j.id for j in jobs]).values_list("id", "status"))
+            emailed = sum(len(batch) for batch, j in zip(batches, jobs) if statuses.get(j.id) == Job.SUCCEEDED)
+            failed = sum(1 for j in jobs if statuses.get(j.id) != Job.SUCCEEDED)
+            self.stdout.write("Emailed {} of {} users in {} batches in {:.1f}s ({:.1f} users/s); {} batches did not finish (see the job queue).".format(
+                emailed, len(user_ids), len(batches), elapsed, emailed / elapsed if elapsed else 0, failed))
+
+        self.stdout.write("Done.")
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_members(apps, schema_editor):
+    EighthScheduledActivity = apps.get_model("eighth", "EighthScheduledActivity")
+    EighthSignup = apps.get_model("eighth", "EighthSignup")
+
+    counts = EighthSignup.objects.order_by().values_list("scheduled_activity_id").annotate(Count("id"))
+    for sched_act_id, count in counts:
+        EighthScheduledActivity.objects.filter(id=sched_act_id).update(member_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eighth', '0039_auto_20160322_1013'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eighthscheduledactivity',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='historicaleighthscheduledactivity',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_members, migrations.RunPython.noop),
+    ]
@@ -2,14 +2,16 @@
 
 import datetime
 import logging
+from collections import OrderedDict, defaultdict
 from itertools import chain
 
 from django.conf import settings
 from django.contrib.auth.models import Group as DjangoGroup
 from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
 from simple_history.models import HistoricalRecords
+from cacheops import invalidate_model
 from django.db import models, transaction
-from django.db.models import Manager, Q
+from django.db.models import Case, Count, F, Manager, Q, Value, When
 from django.utils import formats
 
 from . import exceptions as eighth_exceptions
@@ -271,6 +273,30 @@ class EighthActivity(AbstractBaseEighthModel):
         name += " (Deleted)" if self.deleted else ""
         return name
 
+    def users_allowed_if_restricted(self, users):
+        """Find which of the given users may sign up for this activity if it is restricted.
+
+        This is the set-based counterpart of
+        :meth:`restricted_activities_available_to_user`.
+
+        Returns:
+            Set of user IDs
+
+        """
+        user_ids = [user.id for user in users]
+        allowed = set(self.users_allowed.filter(id__in=user_ids).values_list("id", flat=True))
+        allowed |= set(User.objects.filter(id__in=user_ids, groups__restricted_activity_set=self).values_list("id", flat=True))
+
+        grades = [grade for grade, grade_allowed in ((9, self.freshmen_allowed), (10, self.sophomores_allowed), (11, self.juniors_allowed),
+                                                     (12, self.seniors_allowed)) if grade_allowed]
+        if grades:
+            remaining = User.objects.prefetch_ldap([user for user in users if user.id not in allowed], ["graduation_year"])
+            for user in remaining:
+                if user.grade and user.grade.number in grades:
+                    allowed.add(user.id)
+
+        return allowed
+
     @classmethod
     def restricted_activities_available_to_user(cls, user):
         """Find the restricted activities available to the given user."""
@@ -290,8 +316,7 @@ class EighthActivity(AbstractBaseEighthModel):
         elif grade == 12:
             activities |= set(EighthActivity.objects.filter(seniors_allowed=True).values_list("id", flat=True))
 
-        for group in user.groups.all():
-            activities |= set(group.restricted_activity_set.values_list("id", flat=True))
+        activities |= set(EighthActivity.objects.filter(groups_allowed__in=user.groups.all()).values_list("id", flat=True))
 
         return list(activities)
 
@@ -598,6 +623,45 @@ class EighthScheduledActivityManager(Manager):
 
         return sched_acts
 
+    def change_member_count(self, scheduled_activity_id, delta, capacity=None):
+        """Atomically add ``delta`` to the member_count of a scheduled activity.
+
+        If a ``capacity`` other than -1 is given, the count is only changed
+        if it stays within the capacity. This is done with a single
+        conditional UPDATE, so two concurrent signups can never both take
+        the last seat.
+
+        Returns:
+            Whether the count was changed.
+
+        """
+        sched_acts = self.filter(id=scheduled_activity_id)
+        if capacity is not None and capacity != -1:
+            sched_acts = sched_acts.filter(member_count__lte=capacity - delta)
+        return sched_acts.update(member_count=F("member_count") + delta) > 0
+
+    def reconcile_member_counts(self, pretend=False):
+        """Recount the signups of every scheduled activity and repair member counts that have
+        drifted (e.g. because signups were deleted along with their user).
+
+        Returns:
+            A list of (scheduled activity ID, stored count, actual count)
+            tuples for each count that was wrong.
+
+        """
+        actual_counts = dict(EighthSignup.objects.order_by().values_list("scheduled_activity_id").annotate(Count("id")))
+
+        drifted = []
+        for sched_act_id, member_count in self.order_by("id").values_list("id", "member_count"):
+            actual = actual_counts.get(sched_act_id, 0)
+            if member_count != actual:
+                drifted.append((sched_act_id, member_count, actual))
+                if not pretend:
+                    # Only overwrite the count if no signup has changed it in the meantime
+                    self.filter(id=sched_act_id, member_count=member_count).update(member_count=actual)
+
+        return drifted
+
 
 class EighthScheduledActivity(AbstractBaseEighthModel):
     """Represents the relationship between an activity and a block in which it has been scheduled.
@@ -629,6 +693,9 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
             not set, falls back on the EighthActivity's special setting.
         cancelled
             whether the :class:`EighthScheduledActivity` has been cancelled
+        member_count
+            The number of :class:`EighthSignup`\s for the scheduled
+            activity, kept up to date by :class:`EighthSignup`
 
     """
 
@@ -655,6 +722,8 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
     attendance_taken = models.BooleanField(default=False)
     cancelled = models.BooleanField(default=False)
 
+    member_count = models.IntegerField(default=0)
+
     history = HistoricalRecords()
 
     def get_scheduled_rooms(self):
@@ -768,28 +837,26 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
         else:
             return self.activity.special
 
-    def is_full(self):
+    def is_full(self, capacity=None):
         """Return whether the activity is full."""
-        capacity = self.get_true_capacity()
+        if capacity is None:
+            capacity = self.get_true_capacity()
         if capacity != -1:
-            num_signed_up = self.eighthsignup_set.count()
-            return num_signed_up >= capacity
+            return self.member_count >= capacity
         return False
 
     def is_almost_full(self):
         """Return whether the activity is almost full (>90%)."""
         capacity = self.get_true_capacity()
         if capacity != -1:
-            num_signed_up = self.eighthsignup_set.count()
-            return num_signed_up >= (0.9 * capacity)
+            return self.member_count >= (0.9 * capacity)
         return False
 
     def is_overbooked(self):
         """Return whether the activity is overbooked."""
         capacity = self.get_true_capacity()
         if capacity != -1:
-            num_signed_up = self.eighthsignup_set.count()
-            return num_signed_up > capacity
+            return self.member_count > capacity
         return False
 
     def is_too_early_to_signup(self, now=None):
@@ -808,6 +875,15 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
         """Return whether there are passes that have not been acknowledged."""
         return self.eighthsignup_set.filter(after_deadline=True, pass_accepted=False)
 
+    def get_members_with_permissions(self):
+        """Get the list of members with the LDAP attributes needed to check their visibility and
+        sort them prefetched.
+
+        Returns: List of members
+
+        """
+        return User.objects.prefetch_ldap(self.members.all(), ["permissions", "last_name", "first_name"])
+
     def get_viewable_members(self, user=None):
         """Get the list of members that you have permissions to view.
 
@@ -815,7 +891,7 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
 
         """
         members = []
-        for member in self.members.all():
+        for member in self.get_members_with_permissions():
             show = False
             if member.dn and member.can_view_eighth:
                 show = member.can_view_eighth
@@ -841,7 +917,7 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
         """
         ids = []
         user = request.user
-        for member in self.members.all():
+        for member in self.get_members_with_permissions():
             show = False
             if member.dn and member.can_view_eighth:
                 show = member.can_view_eighth
@@ -865,7 +941,7 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
 
         """
         hidden_members = []
-        for member in self.members.all():
+        for member in self.get_members_with_permissions():
             show = False
             if member.dn and member.can_view_eighth:
                 show = member.can_view_eighth
@@ -927,6 +1003,9 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
         all_sched_act = [self]
         all_blocks = [self.block]
 
+        # Capacities to enforce when the signups are saved (none if forced)
+        capacities = {}
+
         if self.activity.both_blocks:
             # Finds the other scheduling of the same activity on the same day
             # See note above in get_both_blocks_sibling()
@@ -968,7 +1047,8 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
                     exception.ScheduledActivityCancelled = True
 
                 # Check if the activity is full
-                if sched_act.is_full():
+                capacities[sched_act.id] = sched_act.get_true_capacity()
+                if sched_act.is_full(capacities[sched_act.id]):
                     exception.ActivityFull = True
 
             # Check if it's too early to sign up for the activity
@@ -1059,15 +1139,16 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
                     existing_signup.pass_accepted = False
                     existing_signup.previous_activity_name = previous_activity_name
                     existing_signup.previous_activity_sponsors = previous_activity_sponsors
-                    existing_signup.save()
+                    existing_signup.save(capacity=capacities.get(self.id))
                 else:
                     # Clear out the other signups for this block if the user is
                     # switching out of a both-blocks activity
                     EighthSignup.objects.filter(user=user, scheduled_activity__block__in=all_blocks).delete()
                     EighthSignup.objects.create_signup(user=user, scheduled_activity=self, after_deadline=after_deadline,
-                                                       previous_activity_name=previous_activity_name, previous_activity_sponsors=previous_activity_sponsors, own_signup=(user == request.user))
+                                                       previous_activity_name=previous_activity_name, previous_activity_sponsors=previous_activity_sponsors, own_signup=(user == request.user),
+                                                       capacity=capacities.get(self.id))
             except EighthSignup.DoesNotExist:
-                EighthSignup.objects.create_signup(user=user, scheduled_activity=self, after_deadline=after_deadline)
+                EighthSignup.objects.create_signup(user=user, scheduled_activity=self, after_deadline=after_deadline, capacity=capacities.get(self.id))
         else:
             existing_signups = EighthSignup.objects.filter(user=user, scheduled_activity__block__in=all_blocks)
 
@@ -1088,7 +1169,8 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
                     previous_activity_sponsors = None
 
                 EighthSignup.objects.create_signup(user=user, scheduled_activity=sched_act, after_deadline=after_deadline,
-                                                   previous_activity_name=previous_activity_name, previous_activity_sponsors=previous_activity_sponsors, own_signup=(user == request.user))
+                                                   previous_activity_name=previous_activity_name, previous_activity_sponsors=previous_activity_sponsors, own_signup=(user == request.user),
+                                                   capacity=capacities.get(sched_act.id))
 
                 # signup.previous_activity_name = signup.activity.name_with_flags
                 # signup.previous_activity_sponsors = ", ".join(map(str, signup.get_true_sponsors()))
@@ -1102,6 +1184,223 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
 
         return success_message
 
+    @transaction.atomic
+    def add_users_bulk(self, users, request=None, force=False, no_after_deadline=False):
+        """Sign up many users to this scheduled activity at once.
+
+        Runs the same checks as :meth:`add_user`, but with a fixed number
+        of queries for the whole list of users, and then moves, removes
+        and creates their signups in bulk within a single transaction.
+        Users are given any remaining seats in the order they are passed
+        in.
+
+        Returns:
+            An OrderedDict mapping each user to None if they were signed
+            up, or to the :class:`SignupException` explaining why they
+            were not.
+
+        """
+        if request is not None:
+            force = (force or ("force" in request.GET)) and request.user.is_eighth_admin
+
+        results = OrderedDict((user, eighth_exceptions.SignupException()) for user in users)
+        user_ids = [user.id for user in results]
+
+        all_sched_act = [self]
+        all_blocks = [self.block]
+
+        if self.activity.both_blocks:
+            # See note in get_both_blocks_sibling()
+            sibling = self.get_both_blocks_sibling()
+
+            if sibling:
+                all_sched_act.append(sibling)
+                all_blocks.append(sibling.block)
+
+        if not force:
+            # Checks that apply to every user alike
+            exception = eighth_exceptions.SignupException()
+            if self.activity.deleted:
+                exception.ActivityDeleted = True
+            for sched_act in all_sched_act:
+                if sched_act.block.locked:
+                    exception.BlockLocked = True
+                if sched_act.cancelled:
+                    exception.ScheduledActivityCancelled = True
+            if self.activity.presign and self.is_too_early_to_signup():
+                exception.Presign = True
+
+            if exception.errors:
+                return OrderedDict((user, exception) for user in results)
+
+            in_stickie = set(EighthSignup.objects.filter(Q(scheduled_activity__activity__sticky=True) | Q(scheduled_activity__sticky=True),
+                                                         user_id__in=user_ids, scheduled_activity__block__in=all_blocks).values_list("user_id", flat=True))
+
+            in_act = set()
+            if not self.activity.both_blocks and self.activity.one_a_day:
+                in_act = set(EighthSignup.objects.exclude(scheduled_activity__block=self.block).filter(
+                    user_id__in=user_ids, scheduled_activity__block__date=self.block.date, scheduled_activity__activity=self.activity).values_list(
+                        "user_id", flat=True))
+
+            restricted = set()
+            if self.get_restricted():
+                restricted = set(user_ids) - self.activity.users_allowed_if_restricted(list(results))
+
+            blacklisted = set(self.activity.users_blacklisted.filter(id__in=user_ids).values_list("id", flat=True))
+
+            for user, exception in results.items():
+                if request is not None and user != request.user and not request.user.is_eighth_admin:
+                    exception.SignupForbidden = True
+                if user.id in in_stickie:
+                    exception.Sticky = True
+                if user.id in in_act:
+                    exception.OneADay = True
+                if user.id in restricted:
+                    exception.Restricted = True
+                if user.id in blacklisted:
+                    exception.Blacklisted = True
+
+            # Lock the scheduled activities so no other signup can take the
+            # remaining seats while they are handed out
+            locked = EighthScheduledActivity.objects.select_for_update().filter(id__in=[sched_act.id for sched_act in all_sched_act])
+            seats = {}
+            for sched_act in locked:
+                capacity = sched_act.get_true_capacity()
+                seats[sched_act.id] = None if capacity == -1 else capacity - sched_act.member_count
+
+            already_in = defaultdict(set)
+            for user_id, sched_act_id in EighthSignup.objects.filter(user_id__in=user_ids, scheduled_activity__in=all_sched_act).values_list(
+                    "user_id", "scheduled_activity_id"):
+                already_in[user_id].add(sched_act_id)
+
+            for user, exception in results.items():
+                if exception.errors:
+                    continue
+                needs_seat = [sched_act_id for sched_act_id in seats if sched_act_id not in already_in[user.id]]
+                if any(seats[sched_act_id] is not None and seats[sched_act_id] <= 0 for sched_act_id in needs_seat):
+                    exception.ActivityFull = True
+                    continue
+                for sched_act_id in needs_seat:
+                    if seats[sched_act_id] is not None:
+                        seats[sched_act_id] -= 1
+
+        signup_users = [user for user, exception in results.items() if not exception.errors]
+        for user in signup_users:
+            results[user] = None
+
+        if not signup_users:
+            return results
+
+        after_deadline = self.block.locked and not no_after_deadline
+        now = datetime.datetime.now()
+
+        sponsors_cache = {}
+
+        def previous_activity(sched_act):
+            if sched_act.id not in sponsors_cache:
+                sponsors_cache[sched_act.id] = ", ".join(map(str, sched_act.get_true_sponsors()))
+            return sched_act.activity.name_with_flags, sponsors_cache[sched_act.id]
+
+        # (user ID, scheduled activity) -> (previous activity name, previous activity sponsors)
+        new_signups = OrderedDict()
+
+        existing_signups = EighthSignup.objects.filter(user_id__in=[user.id for user in signup_users],
+                                                       scheduled_activity__block__in=all_blocks).select_related("scheduled_activity__activity",
+                                                                                                                "scheduled_activity__block")
+
+        if not self.activity.both_blocks:
+            moved = defaultdict(list)
+            previous = {}
+            for signup in existing_signups:
+                if signup.scheduled_activity_id == self.id:
+                    continue
+                if signup.scheduled_activity.activity.both_blocks:
+                    # Switching out of a both-blocks activity, so the old signup is removed
+                    previous[signup.user_id] = previous_activity(signup.scheduled_activity)
+                else:
+                    moved[signup.scheduled_activity].append(signup.id)
+
+            for prev_sched_act, signup_ids in moved.items():
+                name, sponsors = previous_activity(prev_sched_act)
+                EighthSignup.objects.filter(id__in=signup_ids).update(scheduled_activity=self, after_deadline=after_deadline, was_absent=False,
+                                                                      absence_acknowledged=False, pass_accepted=False, previous_activity_name=name,
+                                                                      previous_activity_sponsors=sponsors, time=now, last_modified_time=now)
+
+            if previous:
+                EighthSignup.objects.filter(user_id__in=list(previous), scheduled_activity__block__in=all_blocks).delete()
+
+            moved_user_ids = set(EighthSignup.objects.filter(scheduled_activity=self, user_id__in=[user.id for user in signup_users]).values_list(
+                "user_id", flat=True))
+            for user in signup_users:
+                if user.id not in moved_user_ids:
+                    new_signups[(user, self)] = previous.get(user.id, (None, None))
+        else:
+            previous = {}
+            for signup in existing_signups:
+                previous[(signup.user_id, signup.scheduled_activity.block.block_letter)] = previous_activity(signup.scheduled_activity)
+            existing_signups.delete()
+
+            for sched_act in all_sched_act:
+                for user in signup_users:
+                    new_signups[(user, sched_act)] = previous.get((user.id, sched_act.block.block_letter), (None, None))
+
+        EighthSignup.objects.bulk_create([EighthSignup(user=user, scheduled_activity=sched_act, after_deadline=after_deadline,
+                                                       previous_activity_name=name, previous_activity_sponsors=sponsors,
+                                                       own_signup=(request is not None and user == request.user))
+                                          for (user, sched_act), (name, sponsors) in new_signups.items()])
+
+        created = defaultdict(int)
+        for user, sched_act in new_signups:
+            created[sched_act.id] += 1
+        for sched_act_id, count in created.items():
+            EighthScheduledActivity.objects.change_member_count(sched_act_id, count)
+
+        # bulk_create() does not send post_save signals, so neither the signup summaries nor cacheops are invalidated
+        from .history import invalidate_signup_summaries
+        invalidate_signup_summaries([user.id for user, sched_act in new_signups])
+        if new_signups:
+            invalidate_model(EighthSignup)
+
+        return results
+
+    def take_attendance(self, present_user_ids):
+        """Record the attendance of this scheduled activity.
+
+        Members whose IDs are in ``present_user_ids`` are marked present
+        and everyone else absent, except that members with a pass that has
+        not been accepted are always absent. Only the signups whose state
+        changes are written, in a single UPDATE, and the cached signup
+        queries are invalidated once rather than per signup.
+
+        Returns:
+            A dict with the number of members who are "present" and
+            "absent", of those absent because of an unaccepted pass
+            ("passes"), and of signups that were "changed".
+
+        """
+        signups = EighthSignup.objects.filter(scheduled_activity=self)
+        present_user_ids = list(present_user_ids)
+
+        with transaction.atomic():
+            if present_user_ids:
+                absent = ~Q(user_id__in=present_user_ids) | Q(after_deadline=True, pass_accepted=False)
+                changed = (signups.filter((absent & Q(was_absent=False)) | (~absent & Q(was_absent=True)))
+                           .update(was_absent=Case(When(absent, then=Value(True)), default=Value(False), output_field=models.BooleanField())))
+            else:
+                # An empty IN list matches nothing, and can't be negated inside a CASE
+                changed = signups.filter(was_absent=False).update(was_absent=True)
+            self.attendance_taken = True
+            self.save()
+
+        if changed:
+            invalidate_model(EighthSignup)
+
+        counts = signups.aggregate(absent=Count(Case(When(was_absent=True, then=1), output_field=models.IntegerField())),
+                                   present=Count(Case(When(was_absent=False, then=1), output_field=models.IntegerField())),
+                                   passes=Count(Case(When(after_deadline=True, pass_accepted=False, then=1), output_field=models.IntegerField())))
+        counts["changed"] = changed
+        return counts
+
     def cancel(self):
         """Cancel an EighthScheduledActivity.
 
@@ -1158,6 +1457,10 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
         """
 
     def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # member_count is only changed with change_member_count(), so
+            # never write back a (possibly stale) loaded value
+            kwargs["update_fields"] = [f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != "member_count"]
         super(EighthScheduledActivity, self).save(*args, **kwargs)
 
     class Meta:
@@ -1170,13 +1473,68 @@ class EighthScheduledActivity(AbstractBaseEighthModel):
         return "{}{} on {}{}".format(self.activity, suff, self.block, cancelled_str)
 
 
-class EighthSignupManager(Manager):
+class EighthSignupQuerySet(models.query.QuerySet):
+    """QuerySet for EighthSignup that keeps :attr:`EighthScheduledActivity.member_count` up to date
+    on bulk deletes and moves."""
+
+    def _scheduled_activity_ids(self):
+        return list(self.order_by().values_list("scheduled_activity_id", flat=True).distinct())
+
+    def delete(self):
+        # The signups of each scheduled activity are deleted separately so
+        # that its member_count changes by exactly the number deleted
+        total = 0
+        per_model = defaultdict(int)
+        with transaction.atomic():
+            for sched_act_id in self._scheduled_activity_ids():
+                deleted, counts = super(EighthSignupQuerySet, self.filter(scheduled_activity_id=sched_act_id)).delete()
+                total += deleted
+                for label, count in counts.items():
+                    per_model[label] += count
+                if counts.get(EighthSignup._meta.label):
+                    EighthScheduledActivity.objects.change_member_count(sched_act_id, -counts[EighthSignup._meta.label])
+        return total, dict(per_model)
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def update(self, **kwargs):
+        if "scheduled_activity" not in kwargs and "scheduled_activity_id" not in kwargs:
+            return super(EighthSignupQuerySet, self).update(**kwargs)
+
+        from .history import invalidate_signup_summaries
+
+        with transaction.atomic():
+            user_ids = list(self.values_list("user_id", flat=True))
+            # Like delete(), the signups of each scheduled activity are moved
+            # separately so that its member_count changes by exactly the number moved
+            rows = 0
+            for sched_act_id in self._scheduled_activity_ids():
+                moved = super(EighthSignupQuerySet, self.filter(scheduled_activity_id=sched_act_id)).update(**kwargs)
+                EighthScheduledActivity.objects.change_member_count(sched_act_id, -moved)
+                rows += moved
+            new_sched_act = kwargs.get("scheduled_activity", kwargs.get("scheduled_activity_id"))
+            EighthScheduledActivity.objects.change_member_count(getattr(new_sched_act, "id", new_sched_act), rows)
+        # Moves do not send post_save signals, so neither the signup summaries nor cacheops are invalidated
+        invalidate_signup_summaries(user_ids)
+        if rows:
+            invalidate_model(EighthSignup)
+        return rows
+
+    update.alters_data = True
+
+
+class EighthSignupManager(Manager.from_queryset(EighthSignupQuerySet)):
     """Model manager for EighthSignup."""
 
-    def create_signup(self, user, scheduled_activity, **kwargs):
+    def create_signup(self, user, scheduled_activity, capacity=None, **kwargs):
+        """Create a signup, raising a :class:`SignupException` if it would exceed ``capacity``
+        (see :meth:`EighthSignup.save`)."""
         if EighthSignup.objects.filter(user=user, scheduled_activity__block=scheduled_activity.block).count() > 0:
             raise ValidationError("EighthSignup already exists for this user on this block.")
-        self.create(user=user, scheduled_activity=scheduled_activity, **kwargs)
+        signup = self.model(user=user, scheduled_activity=scheduled_activity, **kwargs)
+        signup.save(force_insert=True, capacity=capacity)
+        return signup
 
     def get_absences(self):
         return (EighthSignup.objects.filter(was_absent=True, scheduled_activity__attendance_taken=True))
@@ -1227,10 +1585,46 @@ class EighthSignup(AbstractBaseEighthModel):
     absence_acknowledged = models.BooleanField(default=False, blank=True)
     absence_emailed = models.BooleanField(default=False, blank=True)
 
+    # The scheduled activity the signup was for when it was loaded from the database
+    _saved_scheduled_activity_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(EighthSignup, cls).from_db(db, field_names, values)
+        instance._saved_scheduled_activity_id = instance.scheduled_activity_id
+        return instance
+
     def save(self, *args, **kwargs):
+        """Save the signup and update the member counts of the scheduled activities it was moved
+        out of and into.
+
+        If a ``capacity`` keyword argument is given, the signup is only
+        saved if it fits within that capacity; otherwise a
+        :class:`SignupException` is raised.
+
+        """
+        capacity = kwargs.pop("capacity", None)
         if self.has_conflict():
             raise ValidationError("EighthSignup already exists for this user on this block.")
-        super(EighthSignup, self).save(*args, **kwargs)
+
+        with transaction.atomic():
+            previous = self._saved_scheduled_activity_id
+            super(EighthSignup, self).save(*args, **kwargs)
+            if previous != self.scheduled_activity_id:
+                if previous is not None:
+                    EighthScheduledActivity.objects.change_member_count(previous, -1)
+                if not EighthScheduledActivity.objects.change_member_count(self.scheduled_activity_id, 1, capacity=capacity):
+                    exception = eighth_exceptions.SignupException()
+                    exception.ActivityFull = True
+                    raise exception
+            self._saved_scheduled_activity_id = self.scheduled_activity_id
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            super(EighthSignup, self).delete(*args, **kwargs)
+            if self._saved_scheduled_activity_id is not None:
+                EighthScheduledActivity.objects.change_member_count(self._saved_scheduled_activity_id, -1)
+                self._saved_scheduled_activity_id = None
 
     own_signup = models.BooleanField(default=False)
 
@@ -1,28 +1,54 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from collections import defaultdict
+from smtplib import SMTPException, SMTPServerDisconnected
 
-from .models import EighthSignup
-from ..notifications.emails import email_send
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db.models import Case, Count, IntegerField, Q, When
+from django.template.loader import get_template
+
+from .models import EighthBlock, EighthSignup
+from ..notifications.emails import EMAIL_ERRORS, email_build, email_send, email_send_many
+from ..notifications.jobs import job
+from ..users.models import User
 
 logger = logging.getLogger(__name__)
 
 
-def signup_status_email(user, next_blocks):
-    em = user.tj_email if user.tj_email else user.emails[0] if user.emails and len(user.emails) >= 1 else None
-    if em:
-        emails = [em]
-    else:
-        return False
+def user_email(user):
+    return user.tj_email if user.tj_email else user.emails[0] if user.emails and len(user.emails) >= 1 else None
+
+
+def signup_status_recipients(users, next_blocks):
+    """Find which of ``users`` have not signed up for one of ``next_blocks``, or are signed up
+    for a cancelled activity, with one grouped query.
+
+    Returns:
+        The users, annotated with their number of signups for the blocks
+        (``num_signups``) and how many of them are cancelled
+        (``num_cancelled``).
+
+    """
+    block_ids = [blk.id for blk in next_blocks]
+    in_blocks = Q(eighthsignup__scheduled_activity__block__in=block_ids)
+    cancelled = in_blocks & Q(eighthsignup__scheduled_activity__cancelled=True)
+    return (users.annotate(num_signups=Count(Case(When(in_blocks, then=1), output_field=IntegerField())),
+                           num_cancelled=Count(Case(When(cancelled, then=1), output_field=IntegerField())))
+            .filter(Q(num_signups__lt=len(block_ids)) | Q(num_cancelled__gt=0)))
+
 
+def signup_status_data(user, next_blocks, signups):
+    """The context of the signup status email of a user.
+
+    signups: A dict mapping the ids of ``next_blocks`` to the user's signups for them
+
+    """
     blocks = []
     issues = 0
     for blk in next_blocks:
-        try:
-            signup = EighthSignup.objects.get(user=user, scheduled_activity__block=blk)
-        except EighthSignup.DoesNotExist:
-            signup = None
-
+        signup = signups.get(blk.id)
         cancelled = False
 
         if not signup:
@@ -40,12 +66,10 @@ def signup_status_email(user, next_blocks):
 
     date_str = block_date.strftime("%A, %B %-d")
 
-    subject = "Signup Status for {}".format(date_str)
-
     # We can't build an absolute URI because this isn't being executed
     # in the context of a Django request
     base_url = "https://ion.tjhsst.edu/"  # request.build_absolute_uri(reverse('index'))
-    data = {
+    return {
         "user": user,
         "blocks": blocks,
         "block_date": block_date,
@@ -56,12 +80,63 @@ def signup_status_email(user, next_blocks):
         "info_link": base_url + "eighth/signup"
     }
 
-    email_send("eighth/emails/signup_status.txt", "eighth/emails/signup_status.html", data, subject, emails)
+
+def signup_status_emails(users, next_blocks):
+    """Build the signup status emails of many users.
+
+    The users' signups for ``next_blocks`` are loaded with one query
+    and their addresses with one batched LDAP search, and every email is
+    rendered from the same templates. Users without an address are
+    skipped.
+
+    Returns:
+        A list of EmailMultiAlternatives.
+
+    """
+    next_blocks = list(next_blocks)
+    users = User.objects.prefetch_ldap(users, ["emails", "user_type"])
+
+    signups = defaultdict(dict)
+    for signup in (EighthSignup.objects.filter(user__in=[user.id for user in users], scheduled_activity__block__in=next_blocks)
+                   .select_related("scheduled_activity__activity", "scheduled_activity__block")):
+        signups[signup.user_id][signup.scheduled_activity.block_id] = signup
+
+    subject = "Signup Status for {}".format(next_blocks[0].date.strftime("%A, %B %-d"))
+    text = get_template("eighth/emails/signup_status.txt")
+    html = get_template("eighth/emails/signup_status.html")
+
+    messages = []
+    for user in users:
+        em = user_email(user)
+        if em:
+            messages.append(email_build(text, html, signup_status_data(user, next_blocks, signups[user.id]), subject, [em]))
+    return messages
+
+
+def signup_status_email(user, next_blocks):
+    messages = signup_status_emails([user], next_blocks)
+    if not messages:
+        return False
+    messages[0].send()
+
+
+def absence_data(signup, num_absences):
+    # We can't build an absolute URI because this isn't being executed
+    # in the context of a Django request
+    base_url = "https://ion.tjhsst.edu/"  # request.build_absolute_uri(reverse('index'))
+    return {"user": signup.user, "signup": signup, "num_absences": num_absences, "base_url": base_url, "info_link": base_url + "eighth/absences"}
+
+
+def absence_message_id(signup):
+    """A Message-ID that is the same each time the absence email of ``signup`` is built, so that
+    mail systems can recognize an email that is sent again (e.g. after a crash) as a
+    duplicate."""
+    return "<eighth-absence-{}@{}>".format(signup.id, settings.EMAIL_FROM.split("@")[-1])
 
 
 def absence_email(signup):
     user = signup.user
-    em = user.tj_email if user.tj_email else user.emails[0] if user.emails and len(user.emails) >= 1 else None
+    em = user_email(user)
     if em:
         emails = [em]
     else:
@@ -71,9 +146,100 @@ def absence_email(signup):
 
     subject = "Eighth Period Absence Information"
 
-    # We can't build an absolute URI because this isn't being executed
-    # in the context of a Django request
-    base_url = "https://ion.tjhsst.edu/"  # request.build_absolute_uri(reverse('index'))
-    data = {"user": user, "signup": signup, "num_absences": num_absences, "base_url": base_url, "info_link": base_url + "eighth/absences"}
+    email_send("eighth/emails/absence.txt", "eighth/emails/absence.html", absence_data(signup, num_absences), subject, emails,
+               headers={"Message-ID": absence_message_id(signup)})
+
 
-    email_send("eighth/emails/absence.txt", "eighth/emails/absence.html", data, subject, emails)
+def absence_emails(signups):
+    """Build the absence emails of many signups.
+
+    The signups' users, activities and blocks are loaded with one query,
+    the users' absence counts with one grouped query and their addresses
+    with one batched LDAP search, and every email is rendered from the
+    same templates.
+
+    Returns:
+        A list of (signup id, EmailMultiAlternatives or None) pairs, with
+        None for the signups of users without an address.
+
+    """
+    signups = list(signups.select_related("user", "scheduled_activity__activity", "scheduled_activity__block"))
+    User.objects.prefetch_ldap([signup.user for signup in signups], ["emails", "user_type"])
+    absence_counts = dict(EighthSignup.objects.get_absences().filter(user__in=set(signup.user_id for signup in signups)).order_by()
+                          .values("user").annotate(absences=Count("id")).values_list("user", "absences"))
+
+    subject = "Eighth Period Absence Information"
+    text = get_template("eighth/emails/absence.txt")
+    html = get_template("eighth/emails/absence.html")
+
+    messages = []
+    for signup in signups:
+        em = user_email(signup.user)
+        msg = None
+        if em:
+            msg = email_build(text, html, absence_data(signup, absence_counts.get(signup.user_id, 0)), subject, [em],
+                              headers={"Message-ID": absence_message_id(signup)})
+        messages.append((signup.id, msg))
+    return messages
+
+
+@job(retry_on=EMAIL_ERRORS)
+def send_signup_status_email(user_id, block_ids):
+    """Job that sends :func:`signup_status_email` to a user for the given blocks."""
+    user = User.objects.get(id=user_id)
+    next_blocks = EighthBlock.objects.filter(id__in=block_ids).order_by("date", "block_letter")
+    signup_status_email(user, next_blocks)
+
+
+@job
+def send_signup_status_emails(user_ids, block_ids):
+    """Job that sends :func:`signup_status_email` to several users for the given blocks over one
+    SMTP connection."""
+    users = User.objects.filter(id__in=user_ids)
+    next_blocks = EighthBlock.objects.filter(id__in=block_ids).order_by("date", "block_letter")
+    email_send_many(signup_status_emails(users, next_blocks))
+
+
+@job(retry_on=EMAIL_ERRORS)
+def send_absence_email(signup_id):
+    """Job that sends :func:`absence_email` for a signup and marks it as emailed."""
+    try:
+        signup = EighthSignup.objects.get(id=signup_id, absence_emailed=False)
+    except EighthSignup.DoesNotExist:
+        # Already emailed, or the absence was cleared
+        return
+    absence_email(signup)
+    EighthSignup.objects.filter(id=signup_id).update(absence_emailed=True)
+
+
+@job
+def send_absence_emails(signup_ids):
+    """Job that sends the absence emails of several signups over one SMTP connection and marks
+    them as emailed.
+
+    Signups that were already emailed are skipped, and the ones that are
+    sent are marked with a single UPDATE, even if a later email fails. An
+    email that the SMTP server rejects is logged, and its signup is marked
+    too so that it is not sent again. If the process dies before that
+    UPDATE, running the job again resends those emails (rather than
+    skipping them) with the same Message-IDs.
+
+    """
+    messages = absence_emails(EighthSignup.objects.get_absences().filter(id__in=signup_ids, absence_emailed=False))
+    done = []
+    try:
+        with get_connection() as connection:
+            for signup_id, msg in messages:
+                if msg is not None:
+                    try:
+                        connection.send_messages([msg])
+                    except SMTPException as e:
+                        logger.exception("Could not send the absence email of signup {}".format(signup_id))
+                        if isinstance(e, SMTPServerDisconnected):
+                            # Reconnect for the next email
+                            connection.close()
+                done.append(signup_id)
+    finally:
+        if done:
+            EighthSignup.objects.filter(id__in=done).update(absence_emailed=True)
+    logger.info("Sent {} absence emails".format(len(done)))
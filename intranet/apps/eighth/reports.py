@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Reports for the eighth period office, computed with set-based queries."""
+
+import logging
+from collections import OrderedDict, namedtuple
+
+from cacheops import cached_as
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .models import EighthActivity, EighthBlock, EighthRoom, EighthScheduledActivity, EighthSignup
+from ..users.models import Grade, User, UserDirectoryEntry
+from ...utils.date import get_date_range_this_year
+
+logger = logging.getLogger(__name__)
+
+# The number of students whose names and counselors are loaded at a time by
+# DelinquentReport.iter_rows()
+ROWS_CHUNK_SIZE = 500
+
+
+class DelinquentReport(object):
+    """The students with a number of absences within some limits in a date range.
+
+    Only absences from activities whose attendance was taken count.
+
+    Attributes:
+        lower, upper
+            The limits on the number of absences (inclusive). Students with
+            no absences are included if either is 0.
+        grades
+            The grades (9-12) of the students to include.
+        start_date, end_date
+            The range of block dates to count absences in; either may be None.
+
+    """
+
+    def __init__(self, lower=1, upper=1000, grades=(9, 10, 11, 12), start_date=None, end_date=None):
+        self.lower = lower
+        self.upper = upper
+        self.grades = list(grades)
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def absences(self):
+        signups = EighthSignup.objects.filter(was_absent=True, scheduled_activity__attendance_taken=True)
+        if self.start_date is not None:
+            signups = signups.filter(scheduled_activity__block__date__gte=self.start_date)
+        if self.end_date is not None:
+            signups = signups.filter(scheduled_activity__block__date__lte=self.end_date)
+        return signups
+
+    def counts(self):
+        """Return a list of (user id, absences) pairs.
+
+        The absences are counted (and limited) in one grouped query, and
+        students without absences are found with an anti-join. With
+        LDAP_DIRECTORY_MIRROR, grades are filtered in the same queries;
+        otherwise :meth:`rows` filters them.
+
+        """
+        absences = self.absences()
+        if settings.LDAP_DIRECTORY_MIRROR:
+            years = [Grade.year_from_grade(grade) for grade in self.grades]
+            absences = absences.filter(user__directory_entry__graduation_year__in=years)
+
+        counts = []
+        if self.upper > 0:
+            counts += list(absences.order_by().values("user").annotate(absences=Count("id"))
+                           .filter(absences__gte=max(self.lower, 1), absences__lte=self.upper).values_list("user", "absences"))
+        if self.lower == 0 or self.upper == 0:
+            if settings.LDAP_DIRECTORY_MIRROR:
+                students = User.objects.filter(directory_entry__graduation_year__in=years)
+            else:
+                students = User.objects.get_students()
+            counts += [(user_id, 0) for user_id in students.exclude(id__in=absences.values("user")).values_list("id", flat=True)]
+        return counts
+
+    def rows(self):
+        """Return a list of dicts with each student ("user"), their number of "absences" and their
+        "counselor", most absences first.
+
+        The names, emails, grades and counselors of the students are
+        loaded with a few batched LDAP searches.
+
+        """
+        return sorted(self.iter_rows(), key=lambda row: (-row["absences"], row["user"].last_name or ""))
+
+    def iter_rows(self, chunk_size=ROWS_CHUNK_SIZE):
+        """Yield the rows of :meth:`rows`, loading the students and their counselors
+        ``chunk_size`` at a time, so that the first rows can be used (e.g. streamed) before the
+        rest are loaded.
+
+        Students with the same number of absences are sorted by last name
+        with LDAP_DIRECTORY_MIRROR, which has the names in the database, and
+        by id otherwise.
+
+        """
+        counts = self.counts()
+        if settings.LDAP_DIRECTORY_MIRROR:
+            last_names = dict(UserDirectoryEntry.objects.filter(user__in=[user_id for user_id, _ in counts]).values_list("user", "last_name"))
+            counts.sort(key=lambda count: (-count[1], last_names.get(count[0], ""), count[0]))
+        else:
+            counts.sort(key=lambda count: (-count[1], count[0]))
+
+        for i in range(0, len(counts), chunk_size):
+            chunk = counts[i:i + chunk_size]
+            users = User.objects.in_bulk([user_id for user_id, _ in chunk])
+            User.objects.prefetch_ldap(users.values(), ["graduation_year", "last_name", "first_name", "emails", "user_type"])
+            counselors = User.objects.prefetch_counselors(users.values())
+
+            for user_id, absences in chunk:
+                user = users.get(user_id)
+                if user is None or not user.grade or user.grade.number not in self.grades:
+                    continue
+                yield {"user": user, "absences": absences, "counselor": counselors.get(user_id)}
+
+
+class RoomUtilizationRow(namedtuple("RoomUtilizationRow", ["scheduled_activity", "rooms", "capacity", "signups", "sponsors"])):
+    """A scheduled activity in a :class:`RoomUtilizationReport`, with its true rooms, capacity
+    (-1 if unlimited) and sponsors resolved."""
+
+    __slots__ = ()
+
+    @property
+    def is_full(self):
+        return self.capacity != -1 and self.signups >= self.capacity
+
+    @property
+    def is_almost_full(self):
+        return self.capacity != -1 and self.signups >= 0.9 * self.capacity
+
+    @property
+    def is_overbooked(self):
+        return self.capacity != -1 and self.signups > self.capacity
+
+
+class RoomUtilizationReport(object):
+    """The scheduled activities in a range of blocks with the rooms they use.
+
+    Attributes:
+        start_block, end_block
+            The first and last blocks of the range (inclusive).
+        rooms
+            Only include activities held in one of these rooms, or None to
+            include every activity.
+
+    """
+
+    def __init__(self, start_block, end_block, rooms=None):
+        self.start_block = start_block
+        self.end_block = end_block
+        self.rooms = rooms
+
+    def scheduled_activities(self, hide_administrative=False):
+        """Return the scheduled activities, with their number of signups in ``num_signups`` and
+        everything needed to resolve their rooms, capacity and sponsors prefetched.
+
+        Cancelled activities are included. Activities use their own rooms
+        if they have any and the rooms of their activity otherwise, so
+        the room filter matches either.
+
+        """
+        sched_acts = EighthScheduledActivity.objects.exclude(activity__deleted=True)
+        if self.start_block == self.end_block:
+            sched_acts = sched_acts.filter(block=self.start_block)
+        else:
+            sched_acts = sched_acts.filter(block__date__gte=self.start_block.date, block__date__lte=self.end_block.date)
+        if hide_administrative:
+            sched_acts = sched_acts.exclude(activity__administrative=True)
+        if self.rooms is not None:
+            in_rooms = sched_acts.filter(Q(rooms__in=self.rooms) | Q(rooms__isnull=True, activity__rooms__in=self.rooms))
+            # A subquery rather than a join, so that the rooms do not multiply the signups counted below
+            sched_acts = sched_acts.filter(id__in=in_rooms.values("id"))
+
+        return (sched_acts.annotate(num_signups=Count("eighthsignup_set")).select_related("activity", "block")
+                .prefetch_related("rooms", "sponsors", "activity__rooms", "activity__sponsors"))
+
+    def rows(self, hide_administrative=False, only_overbooked=False):
+        """Yield a :class:`RoomUtilizationRow` for each scheduled activity, ordered by block and
+        then by room names."""
+        rows = []
+        for sched_act in self.scheduled_activities(hide_administrative):
+            # These use the prefetched rooms and sponsors
+            rows.append(RoomUtilizationRow(sched_act, list(sched_act.get_true_rooms()), sched_act.get_true_capacity(), sched_act.num_signups,
+                                           list(sched_act.get_true_sponsors())))
+
+        rows.sort(key=lambda row: (row.scheduled_activity.block.date, row.scheduled_activity.block.block_letter, [rm.name for rm in row.rooms]))
+        for row in rows:
+            if only_overbooked and not row.is_overbooked:
+                continue
+            yield row
+
+
+def compute_activity_statistics(activity):
+    """Compute the signup statistics of an activity for this school year.
+
+    Blocks from previous years are only counted in "old_blocks". The
+    members are counted with one grouped query, the scheduled activities
+    (with their signups, for the monthly trend and capacity utilization)
+    with another, and their rooms with batched prefetches.
+
+    Returns:
+        A dict of plain data (so that it can be cached and exported as
+        JSON) with the "total_blocks", "total_signups", "average_signups"
+        and "old_blocks", the "members" as a list of (user id, username,
+        signups) tuples, most signups first, the "months" as a list of
+        dicts with the "month" (YYYY-MM), "blocks" and "signups", and the
+        "blocks" as a list of dicts with each block's "id", "date",
+        "block_letter", "signups", "capacity" (-1 if unlimited) and
+        "utilization" (percent, None if unlimited).
+
+    """
+    start_date, end_date = get_date_range_this_year()
+    scheduled_activities = EighthScheduledActivity.objects.filter(activity=activity)
+    this_year = scheduled_activities.filter(block__date__gte=start_date, block__date__lte=end_date)
+
+    members = list(EighthSignup.objects.filter(scheduled_activity__in=this_year).values_list("user", "user__username")
+                   .annotate(signups=Count("id")).order_by("-signups", "user__username"))
+
+    blocks = []
+    months = OrderedDict()
+    for sched_act in (this_year.annotate(num_signups=Count("eighthsignup_set")).select_related("activity", "block")
+                      .prefetch_related("rooms", "activity__rooms").order_by("block__date", "block__block_letter")):
+        # This uses the prefetched rooms
+        capacity = sched_act.get_true_capacity()
+        utilization = round(100 * sched_act.num_signups / capacity, 2) if capacity > 0 else None
+        blocks.append({"id": sched_act.block.id, "date": sched_act.block.date.isoformat(), "block_letter": sched_act.block.block_letter,
+                       "signups": sched_act.num_signups, "capacity": capacity, "utilization": utilization})
+
+        month = months.setdefault(sched_act.block.date.strftime("%Y-%m"), {"blocks": 0, "signups": 0})
+        month["blocks"] += 1
+        month["signups"] += sched_act.num_signups
+
+    total_blocks = len(blocks)
+    total_signups = sum(block["signups"] for block in blocks)
+    return {
+        "total_blocks": total_blocks,
+        "total_signups": total_signups,
+        "average_signups": round(total_signups / total_blocks, 2) if total_blocks else 0,
+        "old_blocks": scheduled_activities.count() - total_blocks,
+        "members": members,
+        "months": [dict(month=name, **month) for name, month in months.items()],
+        "blocks": blocks
+    }
+
+
+def get_activity_statistics(activity):
+    """Return the statistics of an activity from :func:`compute_activity_statistics`.
+
+    The statistics are cached with cacheops until a signup for, or a
+    scheduling of, the activity, or a block or room, changes.
+
+    """
+    sched_act_ids = list(EighthScheduledActivity.objects.filter(activity=activity).values_list("id", flat=True))
+
+    @cached_as(EighthSignup.objects.filter(scheduled_activity__in=sched_act_ids), EighthScheduledActivity.objects.filter(activity=activity),
+               EighthActivity.objects.filter(id=activity.id), EighthBlock, EighthRoom, EighthActivity.rooms.through,
+               EighthScheduledActivity.rooms.through, timeout=settings.CACHE_AGE["eighth_activity_statistics"])
+    def _get_activity_statistics(activity_id):
+        return compute_activity_statistics(activity)
+
+    return _get_activity_statistics(activity.id)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Printable PDF rosters of scheduled activities."""
+
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from cacheops import cached_as
+
+from django.conf import settings
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import (PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle)
+
+from .models import (EighthActivity, EighthBlock, EighthRoom, EighthScheduledActivity, EighthSignup, EighthSponsor)
+from ..users.models import User
+
+logger = logging.getLogger(__name__)
+
+# Everything needed to draw the roster of a scheduled activity. Rosters
+# are plain data so that they can be sent to other processes to be
+# rendered; ``members`` is a sorted list of (name, id, grade) tuples.
+Roster = namedtuple("Roster", ["activity_id", "scheduled_activity_id", "title", "block_letter", "date", "sponsors", "rooms", "members"])
+
+# The processes that render rosters, started by start_render_pool()
+_render_pool = None
+
+INSTRUCTIONS = """
+<b>Highlight or circle</b> the names of students who are <b>absent</b>, and put an <b>"X"</b> next to those <b>present</b>.<br />
+If a student arrives and their name is not on the roster, please send them to the <b>8th Period Office</b>.<br />
+If a student leaves your activity early, please make a note. <b>Do not make any additions to the roster.</b><br />
+Before leaving for the day, return the roster and any passes to 8th Period coordinator, Joan Burch's mailbox in the <b>main office</b>.
+For questions, please call extension 5046 or 5078. Thank you!<br />"""
+
+
+def load_rosters(sched_act_ids):
+    """Load the rosters of the scheduled activities with the given ids, in the same order.
+
+    The activities, blocks, sponsors, rooms and members are loaded with a
+    few batched queries, and the members' names and grades with
+    :meth:`intranet.apps.users.models.UserManager.prefetch_ldap`.
+
+    """
+    scheduled_activities = (EighthScheduledActivity.objects.select_related("activity", "block")
+                            .prefetch_related("sponsors", "rooms", "activity__sponsors", "activity__rooms").in_bulk(sched_act_ids))
+
+    signups = EighthSignup.objects.filter(scheduled_activity__in=list(scheduled_activities)).select_related("user")
+    members = {}
+    for signup in signups:
+        members.setdefault(signup.scheduled_activity_id, []).append(signup.user)
+    User.objects.prefetch_ldap([user for users in members.values() for user in users], ["last_name", "first_name", "graduation_year"])
+
+    rosters = []
+    for said in sched_act_ids:
+        sact = scheduled_activities.get(int(said))
+        if sact is None:
+            continue
+
+        sponsors_str = "; ".join(s.last_name + ", " + s.first_name for s in sact.get_true_sponsors())
+
+        room_names = [r.name for r in sact.get_true_rooms()]
+        if len(room_names) == 1:
+            rooms_str = "Room " + room_names[0]
+        else:
+            rooms_str = "Rooms: " + ", ".join(room_names)
+
+        roster_members = []
+        for member in members.get(sact.id, []):
+            name = "{}, {}".format(member.last_name or "", member.first_name or "")
+            roster_members.append((name, (member.student_id if member.student_id else "User {}".format(member.id)),
+                                   int(member.grade) if member.grade else "?"))
+
+        rosters.append(Roster(sact.activity.id, sact.id, sact.full_title, sact.block.block_letter, sact.block.date.strftime("%A, %B %-d, %Y"),
+                              sponsors_str, rooms_str, sorted(roster_members)))
+    return rosters
+
+
+def get_styles():
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(name="Center", alignment=TA_CENTER))
+    styles.add(ParagraphStyle(name="BlockLetter", fontSize=60, leading=72, alignment=TA_CENTER))
+    styles.add(ParagraphStyle(name="BlockLetterSmall", fontSize=30, leading=72, alignment=TA_CENTER))
+    styles.add(ParagraphStyle(name="BlockLetterSmallest", fontSize=20, leading=72, alignment=TA_CENTER))
+    styles.add(ParagraphStyle(name="ActivityAttribute", fontSize=15, leading=18, alignment=TA_RIGHT))
+    return styles
+
+
+def roster_elements(roster, styles, include_instructions):
+    """Return the ReportLab flowables of one roster."""
+    elements = []
+    block_letter = roster.block_letter
+
+    if len(block_letter) < 4:
+        block_letter_width = 1 * inch
+        block_letter_width += (0.5 * inch) * (len(block_letter) - 1)
+        block_letter_style = "BlockLetter"
+    elif len(block_letter) < 7:
+        block_letter_width = 0.4 * inch
+        block_letter_width += (0.3 * inch) * (len(block_letter) - 1)
+        block_letter_style = "BlockLetterSmall"
+    else:
+        block_letter_width = 0.3 * inch
+        block_letter_width += (0.2 * inch) * (len(block_letter) - 1)
+        block_letter_style = "BlockLetterSmallest"
+
+    header_data = [[
+        Paragraph("<b>Activity ID: {}<br />Scheduled ID: {}</b>".format(roster.activity_id, roster.scheduled_activity_id), styles["Normal"]),
+        Paragraph("{}<br/>{}<br/>{}".format(roster.sponsors, roster.rooms, roster.date), styles["ActivityAttribute"]),
+        Paragraph(block_letter, styles[block_letter_style])
+    ]]
+    header_style = TableStyle([("VALIGN", (0, 0), (0, 0), "TOP"),
+                               ("VALIGN", (1, 0), (2, 0), "MIDDLE"),
+                               ("TOPPADDING", (0, 0), (0, 0), 15),
+                               ("RIGHTPADDING", (1, 0), (1, 0), 0)])
+
+    elements.append(Table(header_data, style=header_style, colWidths=[2 * inch, None, block_letter_width]))
+    elements.append(Spacer(0, 10))
+    elements.append(Paragraph(roster.title, styles["Title"]))
+
+    num_members = len(roster.members)
+    num_members_label = "{} Student{}".format(num_members, "s" if num_members != 1 else "")
+    elements.append(Paragraph(num_members_label, styles["Center"]))
+    elements.append(Spacer(0, 5))
+
+    attendance_data = [[Paragraph("Present", styles["Heading5"]), Paragraph("Student Name (ID)", styles["Heading5"]),
+                        Paragraph("Grade", styles["Heading5"])]]
+
+    for member_name, member_id, member_grade in roster.members:
+        row = ["", "{} ({})".format(member_name, member_id), member_grade]
+        attendance_data.append(row)
+
+    # Line commands are like this:
+    # op, start, stop, weight, colour, cap, dashes, join, linecount, linespacing
+    attendance_style = TableStyle([
+        ("LINEABOVE", (0, 1), (2, 1), 1, colors.black, None, None, None, 2),
+        ("LINEBELOW", (0, 1), (0, len(attendance_data)), 1, colors.black),
+        ("TOPPADDING", (0, 1), (-1, -1), 6),
+        ("BOTTOMPADDING", (0, 1), (-1, -1), 0),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), 5),
+    ])
+
+    elements.append(Table(attendance_data, style=attendance_style, colWidths=[1.3 * inch, None, 0.8 * inch]))
+    elements.append(Spacer(0, 15))
+
+    if include_instructions:
+        elements.append(Paragraph(INSTRUCTIONS, styles["Normal"]))
+    return elements
+
+
+def render_rosters(rosters, include_instructions=True):
+    """Render a list of Rosters, one or more pages each, as a PDF and return its bytes."""
+    pdf_buffer = BytesIO()
+    h_margin = 1 * inch
+    v_margin = 0.5 * inch
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=letter, rightMargin=h_margin, leftMargin=h_margin, topMargin=v_margin, bottomMargin=v_margin)
+
+    styles = get_styles()
+    elements = []
+    for i, roster in enumerate(rosters):
+        elements += roster_elements(roster, styles, include_instructions)
+        if i != len(rosters) - 1:
+            elements.append(PageBreak())
+
+    doc.build(elements)
+    return pdf_buffer.getvalue()
+
+
+def merge_pdfs(documents):
+    """Concatenate the pages of several PDFs (as bytes)."""
+    from PyPDF2 import PdfFileMerger
+
+    merger = PdfFileMerger()
+    for document in documents:
+        merger.append(BytesIO(document))
+    output = BytesIO()
+    merger.write(output)
+    return output.getvalue()
+
+
+def start_render_pool():
+    """Start the ROSTER_RENDER_PROCESSES processes that :func:`render_rosters_parallel` uses,
+    if it is more than 1.
+
+    This is called once when a web worker starts (in intranet.wsgi), before
+    it serves any requests, because forking a process while other threads
+    are running can deadlock the child. The processes stay resident for
+    the life of the worker.
+
+    """
+    global _render_pool
+    if _render_pool is None and settings.ROSTER_RENDER_PROCESSES > 1:
+        _render_pool = ProcessPoolExecutor(max_workers=settings.ROSTER_RENDER_PROCESSES)
+        # The processes are only forked when the first task is submitted
+        _render_pool.submit(int).result()
+
+
+def stop_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown()
+        _render_pool = None
+
+
+def render_rosters_parallel(rosters, include_instructions=True):
+    """Render rosters like :func:`render_rosters`, splitting them between the processes
+    started by :func:`start_render_pool` if there are more than ROSTER_RENDER_CHUNK_SIZE of
+    them.
+
+    If the processes were not started (e.g. in a management command), the
+    rosters are rendered in this process.
+
+    """
+    processes = min(settings.ROSTER_RENDER_PROCESSES, -(-len(rosters) // settings.ROSTER_RENDER_CHUNK_SIZE))
+    if _render_pool is None or processes <= 1:
+        return render_rosters(rosters, include_instructions)
+
+    chunk_size = -(-len(rosters) // processes)
+    chunks = [rosters[i:i + chunk_size] for i in range(0, len(rosters), chunk_size)]
+    try:
+        documents = list(_render_pool.map(render_rosters, chunks, [include_instructions] * len(chunks)))
+    except BrokenProcessPool:
+        logger.exception("Roster rendering processes died, rendering in this process")
+        return render_rosters(rosters, include_instructions)
+    return merge_pdfs(documents)
+
+
+def generate_roster_pdf(sched_act_ids, include_instructions=True):
+    """Return the bytes of a PDF with the rosters of the scheduled activities with the given
+    ids."""
+    return render_rosters_parallel(load_rosters(sched_act_ids), include_instructions)
+
+
+def get_block_roster_pdf(block, sched_act_ids, include_instructions=True):
+    """Return the bytes of a PDF with the rosters of the given scheduled activities of ``block``.
+
+    The PDF is cached with cacheops until a signup for one of the
+    activities, or the block, the activities, their sponsors or their rooms
+    change.
+
+    """
+    sched_act_ids = [int(said) for said in sched_act_ids]
+
+    @cached_as(EighthSignup.objects.filter(scheduled_activity__in=sched_act_ids), EighthBlock.objects.filter(id=block.id),
+               EighthScheduledActivity.objects.filter(block=block), EighthActivity, EighthRoom, EighthSponsor, EighthActivity.rooms.through,
+               EighthActivity.sponsors.through, EighthScheduledActivity.rooms.through, EighthScheduledActivity.sponsors.through,
+               timeout=settings.CACHE_AGE["block_rosters"])
+    def _get_block_roster_pdf(block_id, sched_act_ids, include_instructions):
+        return generate_roster_pdf(sched_act_ids, include_instructions)
+
+    return _get_block_roster_pdf(block.id, sched_act_ids, include_instructions)
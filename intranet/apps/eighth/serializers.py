@@ -1,15 +1,16 @@
 # -*- coding: utf-8 -*-
 import collections
-import functools
 import logging
 
+from cacheops import cached_as
+
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Count
 
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 
-from .models import (EighthActivity, EighthBlock, EighthScheduledActivity, EighthSignup, EighthSponsor)
+from .models import (EighthActivity, EighthBlock, EighthRoom, EighthScheduledActivity, EighthSignup, EighthSponsor)
 from ..users.models import User
 
 logger = logging.getLogger(__name__)
@@ -63,17 +64,152 @@ class EighthBlockListSerializer(serializers.HyperlinkedModelSerializer):
         fields = ("id", "url", "date", "block_letter", "locked")
 
 
-class FallbackDict(dict):
+def get_block_activity_payload(block):
+    """Build the part of a block's activity list that is the same for every user.
+
+    The payload maps activity IDs to dictionaries with the activity's
+    rooms, sponsors, capacity and flags. URLs are stored as paths and
+    signup counts are left at zero; :class:`EighthBlockDetailSerializer`
+    fills in both, along with the per-user fields, for each request.
+
+    The result is cached in Redis with cacheops, which drops it as soon
+    as a scheduled activity in the block or any activity, room, sponsor or
+    their assignments change.
+
+    """
+
+    @cached_as(EighthScheduledActivity.objects.filter(block=block), EighthActivity, EighthRoom, EighthSponsor, EighthActivity.rooms.through,
+               EighthActivity.sponsors.through, EighthScheduledActivity.rooms.through, EighthScheduledActivity.sponsors.through,
+               timeout=settings.CACHE_AGE["eighth_block_payload"])
+    def _get_block_activity_payload(block_id):
+        return build_block_activity_payload(block)
+
+    return _get_block_activity_payload(block.id)
 
-    def __init__(self, fallback):
-        super().__init__()
-        self.fallback = fallback
 
-    def __getitem__(self, key):
-        try:
-            return dict.__getitem__(self, key)
-        except KeyError:
-            return self.fallback(key)
+def build_block_activity_payload(block):
+    """Compute the payload returned by :func:`get_block_activity_payload`, without caching."""
+    activity_list = {}
+    scheduled_activity_to_activity_map = {}
+
+    # Find all scheduled activities that don't correspond to
+    # deleted activities
+    scheduled_activities = list(block.eighthscheduledactivity_set.exclude(activity__deleted=True).select_related("activity"))
+
+    for scheduled_activity in scheduled_activities:
+        activity = scheduled_activity.activity
+        scheduled_activity_to_activity_map[scheduled_activity.id] = activity.id
+        activity_list[activity.id] = process_scheduled_activity(scheduled_activity)
+
+    all_sponsors = {}
+    for sponsor_id, user_id, first_name, last_name, show_full_name in EighthSponsor.objects.values_list("id", "user_id", "first_name", "last_name",
+                                                                                                       "show_full_name"):
+        name = first_name + " " + last_name if show_full_name else last_name
+        if not name and user_id:
+            # We're not using User.get_user() here since we only want
+            # a value from LDAP that is probably already cached.
+            # This eliminates several hundred SQL queries on some
+            # pages.
+            dn = User.dn_from_id(user_id)
+            name = User(dn=dn).last_name if dn is not None else None
+        all_sponsors[sponsor_id] = name or None
+
+    activity_ids = list(activity_list)
+    scheduled_activity_ids = list(scheduled_activity_to_activity_map)
+
+    sponsorships = EighthActivity.sponsors.through.objects.filter(eighthactivity_id__in=activity_ids).values_list("eighthactivity_id",
+                                                                                                                 "eighthsponsor_id")
+    for activity_id, sponsor_id in sponsorships:
+        activity_list[activity_id]["sponsors"].append(all_sponsors[sponsor_id])
+
+    overidden_sponsorships = EighthScheduledActivity.sponsors.through.objects.filter(
+        eighthscheduledactivity_id__in=scheduled_activity_ids).values_list("eighthscheduledactivity_id", "eighthsponsor_id")
+    activities_sponsors_overidden = set()
+    for scheduled_activity_id, sponsor_id in overidden_sponsorships:
+        activity_id = scheduled_activity_to_activity_map[scheduled_activity_id]
+        if activity_id not in activities_sponsors_overidden:
+            activities_sponsors_overidden.add(activity_id)
+            del activity_list[activity_id]["sponsors"][:]
+        activity_list[activity_id]["sponsors"].append(all_sponsors[sponsor_id])
+
+    roomings = EighthActivity.rooms.through.objects.filter(eighthactivity_id__in=activity_ids).select_related("eighthroom", "eighthactivity")
+    for rooming in roomings:
+        activity_id = rooming.eighthactivity.id
+        activity_cap = rooming.eighthactivity.default_capacity
+        activity_list[activity_id]["rooms"].append(rooming.eighthroom.name)
+        if activity_cap:
+            # use activity default capacity instead of sum of activity rooms
+            activity_list[activity_id]["roster"]["capacity"] = activity_cap
+        else:
+            activity_list[activity_id]["roster"]["capacity"] += rooming.eighthroom.capacity
+
+    overidden_roomings = EighthScheduledActivity.rooms.through.objects.filter(
+        eighthscheduledactivity_id__in=scheduled_activity_ids).select_related("eighthroom")
+    activities_rooms_overidden = set()
+    for rooming in overidden_roomings:
+        activity_id = scheduled_activity_to_activity_map[rooming.eighthscheduledactivity_id]
+        if activity_id not in activities_rooms_overidden:
+            activities_rooms_overidden.add(activity_id)
+            del activity_list[activity_id]["rooms"][:]
+            activity_list[activity_id]["roster"]["capacity"] = 0
+        activity_list[activity_id]["rooms"].append(rooming.eighthroom.name)
+        activity_list[activity_id]["roster"]["capacity"] += rooming.eighthroom.capacity
+
+    for scheduled_activity in scheduled_activities:
+        if scheduled_activity.capacity is not None:
+            activity_list[scheduled_activity.activity.id]["roster"]["capacity"] = scheduled_activity.capacity
+
+    return activity_list
+
+
+def process_scheduled_activity(scheduled_activity):
+    """Return the user-independent payload entry for a scheduled activity."""
+    activity = scheduled_activity.activity
+    prefix = "Special: " if activity.special else ""
+    prefix += activity.name
+    if scheduled_activity.title:
+        prefix += " - " + scheduled_activity.title
+    suffix = " (S)" if activity.sticky else ""
+    suffix += " (BB)" if activity.both_blocks else ""
+    suffix += " (A)" if activity.administrative else ""
+    suffix += " (Deleted)" if activity.deleted else ""
+
+    return {
+        "id": activity.id,
+        "aid": activity.aid,
+        "scheduled_activity": {
+            "id": scheduled_activity.id,
+            "url": reverse("api_eighth_scheduled_activity_signup_list", args=[scheduled_activity.id])
+        },
+        "url": reverse("api_eighth_activity_detail", args=[activity.id]),
+        "name": activity.name,
+        "name_prefix": prefix,
+        "name_suffix": suffix,
+        "description": activity.description,
+        "cancelled": scheduled_activity.cancelled,
+        "roster": {
+            "count": 0,
+            "capacity": 0,
+            "url": reverse("api_eighth_scheduled_activity_signup_list", args=[scheduled_activity.id])
+        },
+        "rooms": [],
+        "sponsors": [],
+        "restricted": scheduled_activity.get_restricted(),
+        "both_blocks": activity.both_blocks,
+        "one_a_day": activity.one_a_day,
+        "special": scheduled_activity.get_special(),
+        "administrative": scheduled_activity.get_administrative(),
+        "presign": activity.presign,
+        "sticky": scheduled_activity.get_sticky(),
+        "title": scheduled_activity.title,
+        "comments": scheduled_activity.comments,
+        "display_text": ""
+    }
+
+
+def get_block_signup_counts(scheduled_activity_ids):
+    """Return a dictionary mapping the given scheduled activity IDs to their number of signups."""
+    return dict(EighthScheduledActivity.objects.filter(id__in=scheduled_activity_ids).values_list("id", "member_count"))
 
 
 class EighthBlockDetailSerializer(serializers.Serializer):
@@ -83,188 +219,40 @@ class EighthBlockDetailSerializer(serializers.Serializer):
     block_letter = serializers.CharField(max_length=10)
     comments = serializers.CharField(max_length=100)
 
-    def process_scheduled_activity(self, scheduled_activity, request=None, user=None, favorited_activities=None, available_restricted_acts=None):
-        activity = scheduled_activity.activity
-        restricted_for_user = (scheduled_activity.get_restricted() and not (user.is_eighth_admin and not user.is_student) and
-                               (activity.id not in available_restricted_acts))
-        prefix = "Special: " if activity.special else ""
-        prefix += activity.name
-        if scheduled_activity.title:
-            prefix += " - " + scheduled_activity.title
+    def add_user_overlay(self, activity_info, request, user, favorited_activities, available_restricted_acts):
+        """Add the user-specific fields and absolute URLs to an entry of the block payload."""
+        restricted_for_user = (activity_info["restricted"] and not (user.is_eighth_admin and not user.is_student) and
+                               (activity_info["id"] not in available_restricted_acts))
+        prefix = activity_info.pop("name_prefix")
+        suffix = activity_info.pop("name_suffix")
         middle = " (R)" if restricted_for_user else ""
-        suffix = " (S)" if activity.sticky else ""
-        suffix += " (BB)" if activity.both_blocks else ""
-        suffix += " (A)" if activity.administrative else ""
-        suffix += " (Deleted)" if activity.deleted else ""
-
-        name_with_flags = prefix + middle + suffix
-        name_with_flags_for_user = prefix + (middle if restricted_for_user else "") + suffix
-
-        activity_info = {
-            "id": activity.id,
-            "aid": activity.aid,
-            "scheduled_activity": {
-                "id": scheduled_activity.id,
-                "url": reverse("api_eighth_scheduled_activity_signup_list", args=[scheduled_activity.id], request=request)
-            },
-            "url": reverse("api_eighth_activity_detail", args=[activity.id], request=request),
-            "name": activity.name,
-            "name_with_flags": name_with_flags,
-            "name_with_flags_for_user": name_with_flags_for_user,
-            "description": activity.description,
-            "cancelled": scheduled_activity.cancelled,
-            "favorited": activity.id in favorited_activities,
-            "roster": {
-                "count": 0,
-                "capacity": 0,
-                "url": reverse("api_eighth_scheduled_activity_signup_list", args=[scheduled_activity.id], request=request)
-            },
-            "rooms": [],
-            "sponsors": [],
-            "restricted": scheduled_activity.get_restricted(),
-            "restricted_for_user": restricted_for_user,
-            "both_blocks": activity.both_blocks,
-            "one_a_day": activity.one_a_day,
-            "special": scheduled_activity.get_special(),
-            "administrative": scheduled_activity.get_administrative(),
-            "presign": activity.presign,
-            "sticky": scheduled_activity.get_sticky(),
-            "title": scheduled_activity.title,
-            "comments": scheduled_activity.comments,
-            "display_text": ""
-        }
-        return activity_info
 
-    def get_activity(self, user, favorited_activities, available_restricted_acts, activity_id, scheduled_activity=None):
-        if scheduled_activity is None:
-            scheduled_activity = EighthScheduledActivity.objects.get(id=activity_id)
-        return self.process_scheduled_activity(scheduled_activity, self.context["request"], user, favorited_activities,
-                                               available_restricted_acts)
+        activity_info["name_with_flags"] = prefix + middle + suffix
+        activity_info["name_with_flags_for_user"] = prefix + (middle if restricted_for_user else "") + suffix
+        activity_info["favorited"] = activity_info["id"] in favorited_activities
+        activity_info["restricted_for_user"] = restricted_for_user
 
-    def get_scheduled_activity(self, scheduled_activity_id):
-        scheduled_activity = EighthScheduledActivity.objects.get(id=scheduled_activity_id)
-        return scheduled_activity.activity.id
+        if request is not None:
+            for info in (activity_info, activity_info["scheduled_activity"], activity_info["roster"]):
+                info["url"] = request.build_absolute_uri(info["url"])
+
+        return activity_info
 
     @transaction.atomic
     def fetch_activity_list_with_metadata(self, block):
-        user = self.context.get("user", self.context["request"].user)
+        request = self.context["request"]
+        user = self.context.get("user", request.user)
 
         favorited_activities = set(user.favorited_activity_set.values_list("id", flat=True))
 
         available_restricted_acts = EighthActivity.restricted_activities_available_to_user(user)
 
-        activity_list = FallbackDict(functools.partial(self.get_activity, user, favorited_activities, available_restricted_acts))
-        scheduled_activity_to_activity_map = FallbackDict(self.get_scheduled_activity)
-
-        # Find all scheduled activities that don't correspond to
-        # deleted activities
-        scheduled_activities = (block.eighthscheduledactivity_set.exclude(activity__deleted=True).select_related("activity"))
+        activity_list = get_block_activity_payload(block)
+        counts = get_block_signup_counts([info["scheduled_activity"]["id"] for info in activity_list.values()])
 
-        for scheduled_activity in scheduled_activities:
-            # Avoid re-fetching scheduled_activity.
-            activity_info = self.get_activity(user, favorited_activities, available_restricted_acts, None, scheduled_activity)
-            activity = scheduled_activity.activity
-            scheduled_activity_to_activity_map[scheduled_activity.id] = activity.id
-            activity_list[activity.id] = activity_info
-
-        # Find the number of students signed up for every activity
-        # in this block
-        activities_with_signups = (EighthSignup.objects.filter(scheduled_activity__block=block).exclude(
-            scheduled_activity__activity__deleted=True).values_list("scheduled_activity__activity_id")
-            .annotate(user_count=Count("scheduled_activity")))
-
-        for activity, user_count in activities_with_signups:
-            activity_list[activity]["roster"]["count"] = user_count
-
-        sponsors_dict = (EighthSponsor.objects.values_list("id", "user_id", "first_name", "last_name", "show_full_name"))
-
-        all_sponsors = dict((sponsor[0], {"user_id": sponsor[1],
-                                          "name": sponsor[2] + " " + sponsor[3] if sponsor[4] else sponsor[3]}) for sponsor in sponsors_dict)
-
-        activity_ids = scheduled_activities.values_list("activity__id")
-        sponsorships = (EighthActivity.sponsors.through.objects.filter(eighthactivity_id__in=activity_ids).select_related("sponsors").values(
-            "eighthactivity", "eighthsponsor"))
-
-        scheduled_activity_ids = scheduled_activities.values_list("id", flat=True)
-        overidden_sponsorships = (EighthScheduledActivity.sponsors.through.objects.filter(
-            eighthscheduledactivity_id__in=scheduled_activity_ids).values("eighthscheduledactivity", "eighthsponsor"))
-
-        for sponsorship in sponsorships:
-            activity_id = int(sponsorship["eighthactivity"])
-            sponsor_id = sponsorship["eighthsponsor"]
-            sponsor = all_sponsors[sponsor_id]
-
-            if sponsor["user_id"]:
-                # We're not using User.get_user() here since we only want
-                # a value from LDAP that is probably already cached.
-                # This eliminates several hundred SQL queries on some
-                # pages.
-                dn = User.dn_from_id(sponsor["user_id"])
-                if dn is not None:
-                    name = User(dn=dn).last_name
-                else:
-                    name = None
-            else:
-                name = None
-
-            if activity_id in activity_list:
-                activity_list[activity_id]["sponsors"].append(sponsor["name"] or name)
-
-        activities_sponsors_overidden = []
-        for sponsorship in overidden_sponsorships:
-            scheduled_activity_id = sponsorship["eighthscheduledactivity"]
-            activity_id = scheduled_activity_to_activity_map[scheduled_activity_id]
-            sponsor_id = sponsorship["eighthsponsor"]
-            sponsor = all_sponsors[sponsor_id]
-
-            if activity_id not in activities_sponsors_overidden:
-                activities_sponsors_overidden.append(activity_id)
-                del activity_list[activity_id]["sponsors"][:]
-
-            if sponsor["user_id"]:
-                # See a few lines up for why we're not using User.get_user()
-                dn = User.dn_from_id(sponsor["user_id"])
-                if dn is not None:
-                    name = User(dn=dn).last_name
-                else:
-                    name = None
-            else:
-                name = None
-            activity_list[activity_id]["sponsors"].append(sponsor["name"] or name)
-
-        roomings = (EighthActivity.rooms.through.objects.filter(eighthactivity_id__in=activity_ids).select_related("eighthroom", "eighthactivity"))
-        overidden_roomings = (EighthScheduledActivity.rooms.through.objects.filter(
-            eighthscheduledactivity_id__in=scheduled_activity_ids).select_related("eighthroom", "eighthscheduledactivity"))
-
-        for rooming in roomings:
-            activity_id = rooming.eighthactivity.id
-            activity_cap = rooming.eighthactivity.default_capacity
-            room_name = rooming.eighthroom.name
-            activity_list[activity_id]["rooms"].append(room_name)
-            if activity_cap:
-                # use activity default capacity instead of sum of activity rooms
-                activity_list[activity_id]["roster"]["capacity"] = activity_cap
-            else:
-                activity_list[activity_id]["roster"]["capacity"] += rooming.eighthroom.capacity
-
-        activities_rooms_overidden = []
-        for rooming in overidden_roomings:
-            scheduled_activity_id = rooming.eighthscheduledactivity.id
-
-            activity_id = scheduled_activity_to_activity_map[scheduled_activity_id]
-            if activity_id not in activities_rooms_overidden:
-                activities_rooms_overidden.append(activity_id)
-                del activity_list[activity_id]["rooms"][:]
-                activity_list[activity_id]["roster"]["capacity"] = 0
-            room_name = rooming.eighthroom.name
-            activity_list[activity_id]["rooms"].append(room_name)
-            activity_list[activity_id]["roster"]["capacity"] += rooming.eighthroom.capacity
-
-        for scheduled_activity in scheduled_activities:
-            if scheduled_activity.capacity is not None:
-                capacity = scheduled_activity.capacity
-                sched_act_id = scheduled_activity.activity.id
-                activity_list[sched_act_id]["roster"]["capacity"] = capacity
+        for activity_info in activity_list.values():
+            activity_info["roster"]["count"] = counts.get(activity_info["scheduled_activity"]["id"], 0)
+            self.add_user_overlay(activity_info, request, user, favorited_activities, available_restricted_acts)
 
         return activity_list
 
@@ -379,6 +367,12 @@ class EighthAddSignupSerializer(serializers.Serializer):
         queryset=EighthScheduledActivity.objects.select_related('activity').select_related('block'), required=False)
     use_scheduled_activity = serializers.BooleanField(required=False)
     force = serializers.BooleanField(required=False)
+    users = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), many=True, required=False)
 
     class Meta:
         validators = [add_signup_validator]
+
+
+class EighthAttendanceSerializer(serializers.Serializer):
+    # The IDs of the members who are present; everyone else is marked absent
+    present = serializers.ListField(child=serializers.IntegerField())
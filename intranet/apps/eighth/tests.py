@@ -1,10 +1,28 @@
 # -*- coding: utf-8 -*-
 
+import datetime
+from io import BytesIO
+from smtplib import SMTPRecipientsRefused
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail.backends import locmem
 from django.core.urlresolvers import reverse
+from django.utils import timezone
+
+from PyPDF2 import PdfFileReader
 
 from ..eighth.exceptions import SignupException
-from ..eighth.models import EighthActivity, EighthBlock, EighthRoom, EighthScheduledActivity
+from ..eighth.history import get_history_signups, get_often_activities
+from ..eighth.management.commands import absence_email, signup_status_email
+from ..eighth.models import EighthActivity, EighthBlock, EighthRoom, EighthScheduledActivity, EighthSignup, EighthSponsor
+from ..eighth.notifications import absence_message_id, send_absence_emails, signup_status_emails, signup_status_recipients
+from ..eighth.reports import DelinquentReport, RoomUtilizationReport, compute_activity_statistics
+from ..eighth.rosters import load_rosters, render_rosters_parallel, start_render_pool, stop_render_pool
+from ..eighth.serializers import build_block_activity_payload, get_block_signup_counts
 from ..groups.models import Group
+from ..notifications.jobs import enqueue
+from ..notifications.models import Job
 from ..users.models import User
 from ...test.ion_test import IonTestCase
 """
@@ -133,3 +151,323 @@ class EighthTest(IonTestCase):
         self.assertEqual('Wey. 999', room3.formatted_name)
         room4 = EighthRoom.objects.create(name="Room 999")
         self.assertEqual('Rm. 999', room4.formatted_name)
+
+    def test_block_activity_payload(self):
+        """Make sure the block payload includes rooms and capacities, and signup counts are per scheduled activity."""
+        user1 = User.objects.create(username="user1")
+        block1 = EighthBlock.objects.create(date='2015-01-01', block_letter="A")
+        room1 = EighthRoom.objects.create(name="room1", capacity=5)
+
+        act1 = EighthActivity.objects.create(name="Test Activity 1", sticky=True)
+        act1.rooms.add(room1)
+        schact1 = EighthScheduledActivity.objects.create(activity=act1, block=block1)
+        schact1.add_user(user1)
+
+        payload = build_block_activity_payload(block1)
+        self.assertEqual(list(payload), [act1.id])
+        self.assertEqual(payload[act1.id]["rooms"], ["room1"])
+        self.assertEqual(payload[act1.id]["roster"]["capacity"], 5)
+        self.assertEqual(payload[act1.id]["name_suffix"], " (S)")
+        self.assertEqual(get_block_signup_counts([schact1.id]), {schact1.id: 1})
+
+    def test_member_count(self):
+        """Make sure member counts follow signups and capacity is enforced even with a stale count."""
+        user1 = User.objects.create(username="user1")
+        user2 = User.objects.create(username="user2")
+        block1 = EighthBlock.objects.create(date='2015-01-01', block_letter="A")
+        room1 = EighthRoom.objects.create(name="room1", capacity=1)
+
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        act1.rooms.add(room1)
+        schact1 = EighthScheduledActivity.objects.create(activity=act1, block=block1)
+        stale_schact1 = EighthScheduledActivity.objects.get(id=schact1.id)
+
+        schact1.add_user(user1)
+        self.assertEqual(EighthScheduledActivity.objects.get(id=schact1.id).member_count, 1)
+        with self.assertRaisesMessage(SignupException, "ActivityFull"):
+            stale_schact1.add_user(user2)
+
+        EighthScheduledActivity.objects.filter(id=schact1.id).update(member_count=5)
+        self.assertEqual(EighthScheduledActivity.objects.reconcile_member_counts(), [(schact1.id, 5, 1)])
+
+        self.assertEqual(schact1.eighthsignup_set.all().delete()[0], 1)
+        self.assertEqual(EighthScheduledActivity.objects.get(id=schact1.id).member_count, 0)
+
+        # Moving signups from several scheduled activities at once
+        schact2 = EighthScheduledActivity.objects.create(activity=act1, block=EighthBlock.objects.create(date='2015-01-02', block_letter="A"))
+        schact3 = EighthScheduledActivity.objects.create(activity=act1, block=EighthBlock.objects.create(date='2015-01-03', block_letter="A"))
+        schact1.add_user(user1)
+        schact2.add_user(user2)
+        self.assertEqual(EighthSignup.objects.filter(user__in=[user1, user2]).update(scheduled_activity=schact3), 2)
+        self.assertEqual([EighthScheduledActivity.objects.get(id=schact.id).member_count for schact in (schact1, schact2, schact3)], [0, 0, 2])
+
+    def test_add_users_bulk(self):
+        """Make sure bulk signups respect capacity and blacklists and move existing signups."""
+        users = [User.objects.create(username="user{}".format(i)) for i in range(4)]
+        block1 = EighthBlock.objects.create(date='2015-01-01', block_letter="A")
+        room1 = EighthRoom.objects.create(name="room1", capacity=2)
+
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        act1.rooms.add(room1)
+        act1.users_blacklisted.add(users[0])
+        act2 = EighthActivity.objects.create(name="Test Activity 2")
+        act2.rooms.add(room1)
+        schact1 = EighthScheduledActivity.objects.create(activity=act1, block=block1)
+        schact2 = EighthScheduledActivity.objects.create(activity=act2, block=block1)
+        schact2.add_user(users[1])
+
+        results = schact1.add_users_bulk(users)
+        self.assertEqual(list(results), users)
+        self.assertIn("Blacklisted", results[users[0]].errors)
+        self.assertIsNone(results[users[1]])
+        self.assertIsNone(results[users[2]])
+        self.assertIn("ActivityFull", results[users[3]].errors)
+
+        self.assertEqual(set(schact1.members.all()), {users[1], users[2]})
+        self.assertEqual(EighthSignup.objects.get(user=users[1]).previous_activity_name, act2.name_with_flags)
+        self.assertEqual(EighthScheduledActivity.objects.get(id=schact1.id).member_count, 2)
+        self.assertEqual(EighthScheduledActivity.objects.get(id=schact2.id).member_count, 0)
+
+        results = schact1.add_users_bulk(users, force=True)
+        self.assertTrue(all(exception is None for exception in results.values()))
+        self.assertEqual(EighthScheduledActivity.objects.get(id=schact1.id).member_count, 4)
+
+    def test_rosters(self):
+        """Make sure rosters are loaded in the requested order and rendered in parallel into one PDF."""
+        user1 = User.get_user(username="awilliam")
+        user1.save()
+        block1 = EighthBlock.objects.create(date='2015-01-01', block_letter="A")
+        room1 = EighthRoom.objects.create(name="room1", capacity=5)
+        sponsor1 = EighthSponsor.objects.create(first_name="Ada", last_name="Lovelace")
+
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        act1.rooms.add(room1)
+        act1.sponsors.add(sponsor1)
+        act2 = EighthActivity.objects.create(name="Test Activity 2")
+        schact1 = EighthScheduledActivity.objects.create(activity=act1, block=block1)
+        schact2 = EighthScheduledActivity.objects.create(activity=act2, block=block1, title="Second")
+        schact1.add_user(user1)
+
+        rosters = load_rosters([str(schact2.id), str(schact1.id)])
+        self.assertEqual([roster.scheduled_activity_id for roster in rosters], [schact2.id, schact1.id])
+        self.assertEqual(rosters[0].title, "Test Activity 2 - Second")
+        self.assertEqual(rosters[1].sponsors, "Lovelace, Ada")
+        self.assertEqual(rosters[1].rooms, "Room room1")
+        self.assertEqual([member[1] for member in rosters[1].members], ["User {}".format(user1.id)])
+
+        with self.settings(ROSTER_RENDER_PROCESSES=2, ROSTER_RENDER_CHUNK_SIZE=1):
+            start_render_pool()
+            try:
+                pdf = render_rosters_parallel(rosters)
+            finally:
+                stop_render_pool()
+        self.assertEqual(PdfFileReader(BytesIO(pdf)).getNumPages(), 2)
+
+    def test_delinquent_report_counts(self):
+        """Make sure absences are counted only where attendance was taken, within the limits and date range."""
+        users = [User.objects.create(username="2016user{}".format(i)) for i in range(3)]
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        for day in range(1, 4):
+            block = EighthBlock.objects.create(date="2015-01-0{}".format(day), block_letter="A")
+            schact = EighthScheduledActivity.objects.create(activity=act1, block=block, attendance_taken=day != 3)
+            EighthSignup.objects.create(user=users[0], scheduled_activity=schact, was_absent=True)
+            EighthSignup.objects.create(user=users[1], scheduled_activity=schact, was_absent=day == 1)
+            EighthSignup.objects.create(user=users[2], scheduled_activity=schact)
+
+        self.assertEqual(sorted(DelinquentReport().counts()), [(users[0].id, 2), (users[1].id, 1)])
+        self.assertEqual(DelinquentReport(lower=2).counts(), [(users[0].id, 2)])
+        self.assertEqual(sorted(DelinquentReport(lower=0, upper=1).counts()), [(users[1].id, 1), (users[2].id, 0)])
+        self.assertEqual(DelinquentReport(upper=0).counts(), [(users[2].id, 0)])
+        self.assertEqual(sorted(DelinquentReport(start_date="2015-01-02").counts()), [(users[0].id, 1)])
+
+        # Nothing is loaded until the rows are used
+        with self.assertNumQueries(0):
+            DelinquentReport().iter_rows()
+
+    def test_room_utilization_report(self):
+        """Make sure the room utilization report resolves rooms, capacities and signups, and filters by true room."""
+        user = User.objects.create(username="2016user")
+        block1 = EighthBlock.objects.create(date="2015-01-01", block_letter="A")
+        room1 = EighthRoom.objects.create(name="room1", capacity=1)
+        room2 = EighthRoom.objects.create(name="room2", capacity=5)
+
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        act1.rooms.add(room1)
+        schact1 = EighthScheduledActivity.objects.create(activity=act1, block=block1)
+        act2 = EighthActivity.objects.create(name="Test Activity 2")
+        act2.rooms.add(room1)
+        schact2 = EighthScheduledActivity.objects.create(activity=act2, block=block1)
+        schact2.rooms.add(room2)
+        EighthSignup.objects.create(user=user, scheduled_activity=schact1)
+        EighthSignup.objects.create(user=User.objects.create(username="2016user2"), scheduled_activity=schact1)
+
+        rows = list(RoomUtilizationReport(block1, block1).rows())
+        self.assertEqual([row.scheduled_activity for row in rows], [schact1, schact2])
+        self.assertEqual([(row.rooms, row.capacity, row.signups) for row in rows], [([room1], 1, 2), ([room2], 5, 0)])
+        self.assertTrue(rows[0].is_overbooked)
+
+        # schact2 overrides its activity's room, so it is not in room1
+        self.assertEqual([row.scheduled_activity for row in RoomUtilizationReport(block1, block1, [room1]).rows()], [schact1])
+        self.assertEqual([row.scheduled_activity for row in RoomUtilizationReport(block1, block1, [room2]).rows()], [schact2])
+        self.assertEqual([row.scheduled_activity for row in RoomUtilizationReport(block1, block1).rows(only_overbooked=True)], [schact1])
+
+    def test_signup_status_recipients(self):
+        """Make sure users who have not signed up, or are in cancelled activities, are emailed about their signups."""
+        users = [User.objects.create(username="2016user{}".format(i)) for i in range(4)]
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        for letter in "AB":
+            EighthBlock.objects.create(date="2015-01-01", block_letter=letter)
+        blocks = EighthBlock.objects.order_by("block_letter")
+        schacts = [EighthScheduledActivity.objects.create(activity=act1, block=block) for block in blocks]
+        for schact in schacts:
+            EighthSignup.objects.create(user=users[0], scheduled_activity=schact)
+        EighthSignup.objects.create(user=users[1], scheduled_activity=schacts[0])
+        EighthSignup.objects.create(user=users[2], scheduled_activity=schacts[1])
+        # users[3] has not signed up for anything
+        self.assertEqual(list(signup_status_recipients(User.objects.filter(id__in=[u.id for u in users]), blocks).order_by("id")),
+                         users[1:])
+
+        schacts[0].cancelled = True
+        schacts[0].save()
+        recipients = signup_status_recipients(User.objects.filter(id__in=[u.id for u in users]), blocks).order_by("id")
+        self.assertEqual([(u, u.num_signups, u.num_cancelled) for u in recipients], [(users[0], 2, 1), (users[1], 1, 1), (users[2], 1, 0),
+                                                                                         (users[3], 0, 0)])
+
+        messages = signup_status_emails(recipients, blocks)
+        self.assertEqual([msg.to for msg in messages], [[u.tj_email] for u in users])
+
+    def test_signup_status_email_command(self):
+        """Make sure running the signup status command again does not email anyone twice in a day."""
+        block = EighthBlock.objects.create(date="2015-01-01", block_letter="A")
+        other_block = EighthBlock.objects.create(date="2015-01-01", block_letter="B")
+        today = datetime.date(2015, 1, 1)
+        command = signup_status_email.Command()
+
+        with self.settings(JOB_QUEUE_ASYNC=True):
+            command.enqueue_batch([1, 2], today, [block.id], 1)
+            command.enqueue_batch([3], today, [block.id], 1)
+            command.enqueue_batch([4], today, [block.id, other_block.id], 1)
+            command.enqueue_batch([5], today - datetime.timedelta(days=1), [block.id], 1)
+            failed = command.enqueue_batch([6], today, [block.id], 1)
+        self.assertEqual(command.queued_user_ids(today, [block.id]), {1, 2, 3, 6})
+
+        # Users whose batch failed are emailed again by the next run
+        Job.objects.filter(id=failed.id).update(status=Job.FAILED)
+        self.assertEqual(command.queued_user_ids(today, [block.id]), {1, 2, 3})
+        with self.settings(JOB_QUEUE_ASYNC=True):
+            self.assertNotEqual(command.enqueue_batch([6], today, [block.id], 2).id, failed.id)
+
+    def test_send_absence_emails(self):
+        """Make sure absence emails are sent once and their signups are marked as emailed."""
+        users = [User.objects.create(username="2016user{}".format(i)) for i in range(2)]
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        block1 = EighthBlock.objects.create(date="2015-01-01", block_letter="A")
+        schact1 = EighthScheduledActivity.objects.create(activity=act1, block=block1, attendance_taken=True)
+        signups = [EighthSignup.objects.create(user=user, scheduled_activity=schact1, was_absent=True) for user in users]
+
+        send_absence_emails([signup.id for signup in signups])
+        self.assertEqual(sorted(msg.extra_headers["Message-ID"] for msg in mail.outbox),
+                         sorted(absence_message_id(signup) for signup in signups))
+        self.assertEqual(EighthSignup.objects.filter(absence_emailed=True).count(), 2)
+
+        send_absence_emails([signup.id for signup in signups])
+        self.assertEqual(len(mail.outbox), 2)
+
+        # An email that is rejected is skipped, and the rest are still sent
+        block2 = EighthBlock.objects.create(date="2015-01-02", block_letter="A")
+        schact2 = EighthScheduledActivity.objects.create(activity=act1, block=block2, attendance_taken=True)
+        signups = [EighthSignup.objects.create(user=user, scheduled_activity=schact2, was_absent=True) for user in users]
+        mail.outbox = []
+        send_messages = locmem.EmailBackend.send_messages
+
+        def reject_first(backend, messages):
+            if messages[0].extra_headers["Message-ID"] == absence_message_id(signups[0]):
+                raise SMTPRecipientsRefused({})
+            return send_messages(backend, messages)
+
+        with patch.object(locmem.EmailBackend, "send_messages", reject_first):
+            send_absence_emails([signup.id for signup in signups])
+        self.assertEqual([msg.extra_headers["Message-ID"] for msg in mail.outbox], [absence_message_id(signups[1])])
+        self.assertEqual(EighthSignup.objects.filter(absence_emailed=True).count(), 4)
+
+    def test_absence_email_command(self):
+        """Make sure the absence email command does not queue a signup that is already waiting in
+        a job."""
+        command = absence_email.Command()
+        with self.settings(JOB_QUEUE_ASYNC=True):
+            enqueue(send_absence_emails, [1, 2])
+            enqueue(send_absence_emails, [3])
+        Job.objects.filter(arguments__contains="[3]").update(status=Job.SUCCEEDED)
+        self.assertEqual(command.queued_signup_ids(), {1, 2})
+
+        # A job whose process died while running it inline does not hold its signups forever
+        with self.settings(JOB_QUEUE_TIMEOUT=60):
+            Job.objects.filter(arguments__contains="[1, 2]").update(status=Job.RUNNING, worker="inline",
+                                                                    heartbeat_time=timezone.now() - datetime.timedelta(minutes=2))
+            command.handle(silent=True, pretend=False, batch_size=None)
+        self.assertEqual(command.queued_signup_ids(), set())
+        self.assertEqual(Job.objects.get(arguments__contains="[1, 2]").status, Job.FAILED)
+
+    def test_take_attendance(self):
+        """Make sure attendance marks everyone not present, and unaccepted passes, as absent."""
+        users = [User.objects.create(username="2016user{}".format(i)) for i in range(3)]
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        block1 = EighthBlock.objects.create(date="2015-01-01", block_letter="A")
+        schact1 = EighthScheduledActivity.objects.create(activity=act1, block=block1)
+        for user in users[:2]:
+            EighthSignup.objects.create(user=user, scheduled_activity=schact1)
+        EighthSignup.objects.create(user=users[2], scheduled_activity=schact1, after_deadline=True)
+
+        summary = schact1.take_attendance([users[0].id, users[2].id])
+        self.assertEqual(summary, {"present": 1, "absent": 2, "passes": 1, "changed": 2})
+        self.assertEqual(set(EighthSignup.objects.filter(was_absent=True).values_list("user", flat=True)), {users[1].id, users[2].id})
+        self.assertTrue(EighthScheduledActivity.objects.get(id=schact1.id).attendance_taken)
+
+        self.assertEqual(schact1.take_attendance([users[0].id, users[2].id])["changed"], 0)
+        self.assertEqual(schact1.take_attendance([user.id for user in users])["changed"], 1)
+
+        # Nobody was present
+        self.assertEqual(schact1.take_attendance([]), {"present": 0, "absent": 3, "passes": 1, "changed": 2})
+        self.assertEqual(EighthSignup.objects.filter(was_absent=True).count(), 3)
+
+    def test_often_activities(self):
+        """Make sure the most frequent signups are counted over this year's locked blocks."""
+        user = User.objects.create(username="2016user")
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        act2 = EighthActivity.objects.create(name="Test Activity 2")
+        for act, letters in ((act1, "AB"), (act2, "C"), (act2, "D")):
+            for letter in letters:
+                block = EighthBlock.objects.create(date=datetime.date.today(), block_letter=letter, locked=letter != "D")
+                EighthSignup.objects.create(user=user, scheduled_activity=EighthScheduledActivity.objects.create(activity=act, block=block))
+
+        self.assertEqual([(often["activity"], often["count"]) for often in get_often_activities(user)], [(act1, 2), (act2, 1)])
+        self.assertEqual(sorted(block.block_letter for block in EighthBlock.objects.filter(id__in=get_history_signups(user))), ["A", "B", "C"])
+
+    def test_activity_statistics(self):
+        """Make sure activity statistics count this year's signups, months and capacity."""
+        users = [User.objects.create(username="2016user{}".format(i)) for i in range(3)]
+        room1 = EighthRoom.objects.create(name="room1", capacity=4)
+        act1 = EighthActivity.objects.create(name="Test Activity 1")
+        act1.rooms.add(room1)
+        today = datetime.date.today()
+        old_block = EighthBlock.objects.create(date=today - datetime.timedelta(days=3 * 365), block_letter="A")
+        EighthScheduledActivity.objects.create(activity=act1, block=old_block).add_user(users[0], force=True)
+        for letter, members in (("A", users), ("B", users[2:])):
+            schact = EighthScheduledActivity.objects.create(activity=act1, block=EighthBlock.objects.create(date=today, block_letter=letter))
+            for user in members:
+                schact.add_user(user, force=True)
+
+        statistics = compute_activity_statistics(act1)
+        self.assertEqual((statistics["total_blocks"], statistics["total_signups"], statistics["average_signups"], statistics["old_blocks"]),
+                         (2, 4, 2, 1))
+        self.assertEqual(statistics["members"], [(users[2].id, "2016user2", 2), (users[0].id, "2016user0", 1), (users[1].id, "2016user1", 1)])
+        self.assertEqual(statistics["months"], [{"month": today.strftime("%Y-%m"), "blocks": 2, "signups": 4}])
+        self.assertEqual([(block["block_letter"], block["capacity"], block["utilization"]) for block in statistics["blocks"]],
+                         [("A", 4, 75), ("B", 4, 25)])
+
+        self.login()
+        User.get_user(username="awilliam").groups.add(Group.objects.get_or_create(name="admin_all")[0])
+        response = self.client.get(reverse("eighth_statistics_json", args=[act1.id]))
+        self.assertEqual(response.json()["total_signups"], 4)
+        response = self.client.get(reverse("eighth_statistics_csv", args=[act1.id]))
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 4)
@@ -38,6 +38,8 @@ urlpatterns = [
     # Activity Info (for students/teachers)
     url(r"^/activity/(?P<activity_id>\d+)$", activities.activity_view, name="eighth_activity"),
     url(r"^/activity/statistics/(?P<activity_id>\d+)$", activities.statistics_view, name="eighth_statistics"),
+    url(r"^/activity/statistics/(?P<activity_id>\d+)/csv$", activities.statistics_view, name="eighth_statistics_csv"),
+    url(r"^/activity/statistics/(?P<activity_id>\d+)/json$", activities.statistics_view, name="eighth_statistics_json"),
 
     # Admin
     url(r"^/admin$", general.eighth_admin_dashboard_view, name="eighth_admin_dashboard"),
@@ -4,9 +4,12 @@ import logging
 from datetime import datetime, timedelta
 
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, render
 
 from ..models import EighthActivity, EighthBlock, EighthScheduledActivity
+from ..reports import get_activity_statistics
+from ....utils.streaming import streaming_csv_response
 
 logger = logging.getLogger(__name__)
 
@@ -35,30 +38,19 @@ def statistics_view(request, activity_id=None):
         return render(request, "error/403.html", {"reason": "You do not have permission to view statistics for this activity."}, status=403)
 
     activity = get_object_or_404(EighthActivity, id=activity_id)
+    statistics = get_activity_statistics(activity)
 
-    activities = EighthScheduledActivity.objects.filter(activity=activity)
+    url_name = request.resolver_match.url_name
+    if url_name == "eighth_statistics_json":
+        return JsonResponse(dict(statistics, activity=activity.id))
 
-    signups = {}
+    if url_name == "eighth_statistics_csv":
+        def rows():
+            yield ["User ID", "Username", "Total Signups"]
+            for user_id, username, signups in statistics["members"]:
+                yield [user_id, username, signups]
 
-    old_blocks = 0
+        return streaming_csv_response(rows(), "activity_{}_statistics.csv".format(activity.id))
 
-    for a in activities:
-        if a.block.is_this_year:
-            for user in a.members.all():
-                if user in signups:
-                    signups[user] += 1
-                else:
-                    signups[user] = 1
-        else:
-            old_blocks += 1
-
-    signups = sorted(signups.items(), key=lambda kv: (-kv[1], kv[0].username))
-    total_blocks = activities.count()
-    total_signups = sum(n for _, n in signups)
-    if total_blocks:
-        average_signups = round(total_signups / total_blocks, 2)
-    else:
-        average_signups = 0
-
-    context = {"activity": activity, "members": signups, "total_blocks": total_blocks, "total_signups": total_signups, "average_signups": average_signups, "old_blocks": old_blocks}
+    context = dict(statistics, activity=activity)
     return render(request, "eighth/statistics.html", context)
@@ -2,19 +2,20 @@
 
 import csv
 import logging
-from datetime import MAXYEAR, MINYEAR, date, datetime, timedelta
+from datetime import datetime, timedelta
 
 from cacheops import invalidate_obj
 
 from django import http
 from django.contrib import messages
-from django.db.models import Count, Q
+from django.db.models import Q
 from django.shortcuts import redirect, render
 
 from ...models import (EighthActivity, EighthBlock, EighthRoom, EighthScheduledActivity, EighthSignup)
+from ...reports import DelinquentReport
 from ...utils import get_start_date
 from ....auth.decorators import eighth_admin_required
-from ....users.models import User
+from .....utils.streaming import streaming_csv_response
 
 logger = logging.getLogger(__name__)
 
@@ -52,17 +53,13 @@ def delinquent_students_view(request):
 
     try:
         start_date = datetime.strptime(start_date, "%Y-%m-%d")
-        start_date_filter = start_date
     except ValueError:
         start_date = ""
-        start_date_filter = date(MINYEAR, 1, 1)
 
     try:
         end_date = datetime.strptime(end_date, "%Y-%m-%d")
-        end_date_filter = end_date
     except ValueError:
         end_date = ""
-        end_date_filter = date(MAXYEAR, 12, 31)
 
     context = {
         "lower_absence_limit": lower_absence_limit,
@@ -78,93 +75,29 @@ def delinquent_students_view(request):
     query_params = ["lower", "upper", "freshmen", "sophomores", "juniors", "seniors", "start", "end"]
 
     if set(request.GET.keys()).intersection(set(query_params)):
-        # attendance MUST have been taken on the activity for the absence to be valid
-        non_delinquents = []
-        delinquents = []
-        if int(upper_absence_limit_filter) == 0 or int(lower_absence_limit_filter) == 0:
-            users_with_absence = (EighthSignup.objects.filter(
-                was_absent=True, scheduled_activity__attendance_taken=True, scheduled_activity__block__date__gte=start_date_filter,
-                scheduled_activity__block__date__lte=end_date_filter).values("user").annotate(absences=Count("user")).filter(absences__gte=1)
-                .values("user", "absences").order_by("user"))
-
-            uids_with_absence = [row["user"] for row in users_with_absence]
-            all_students = User.objects.get_students().values_list("id")
-            uids_all_students = [row[0] for row in all_students]
-            uids_without_absence = set(uids_all_students) - set(uids_with_absence)
-            users_without_absence = User.objects.filter(id__in=uids_without_absence).order_by("id")
-            non_delinquents = []
-            for usr in users_without_absence:
-                non_delinquents.append({"absences": 0, "user": usr})
-
-            logger.debug(non_delinquents)
-
-        if int(upper_absence_limit_filter) > 0:
-            delinquents = (EighthSignup.objects.filter(
-                was_absent=True, scheduled_activity__attendance_taken=True, scheduled_activity__block__date__gte=start_date_filter,
-                scheduled_activity__block__date__lte=end_date_filter).values("user").annotate(absences=Count("user"))
-                .filter(absences__gte=lower_absence_limit_filter,
-                        absences__lte=upper_absence_limit_filter).values("user", "absences").order_by("user"))
-
-            user_ids = [d["user"] for d in delinquents]
-            delinquent_users = User.objects.filter(id__in=user_ids).order_by("id")
-            for index, user in enumerate(delinquent_users):
-                delinquents[index]["user"] = user
-            logger.debug(delinquents)
-
-            delinquents = list(delinquents)
-
-        delinquents += non_delinquents
-
-        def filter_by_grade(delinquent):
-            grade = delinquent["user"].grade.number
-            include = False
-            if include_freshmen:
-                include |= (grade == 9)
-            if include_sophomores:
-                include |= (grade == 10)
-            if include_juniors:
-                include |= (grade == 11)
-            if include_seniors:
-                include |= (grade == 12)
-            return include
-
-        delinquents = list(filter(filter_by_grade, delinquents))
-        # most absences at top
-        delinquents = sorted(delinquents, key=lambda x: (-1 * x["absences"], x["user"].last_name))
-
-        logger.debug(delinquents)
+        grades = [grade for grade, include in ((9, include_freshmen), (10, include_sophomores), (11, include_juniors), (12, include_seniors))
+                  if include]
+        report = DelinquentReport(int(lower_absence_limit_filter), int(upper_absence_limit_filter), grades, start_date or None, end_date or None)
     else:
-        delinquents = None
-
-    context["delinquents"] = delinquents
+        report = None
 
     if request.resolver_match.url_name == "eighth_admin_view_delinquent_students":
+        context["delinquents"] = report.rows() if report else None
         context["admin_page_title"] = "Delinquent Students"
         return render(request, "eighth/admin/delinquent_students.html", context)
     else:
-        response = http.HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = "attachment; filename=\"delinquent_students.csv\""
 
-        writer = csv.writer(response)
-        writer.writerow(["Start Date", "End Date", "Absences", "Last Name", "First Name", "Student ID", "Grade", "Counselor", "TJ Email",
-                         "Other Email"])
+        def rows():
+            yield ["Start Date", "End Date", "Absences", "Last Name", "First Name", "Student ID", "Grade", "Counselor", "TJ Email", "Other Email"]
 
-        for delinquent in delinquents:
-            row = []
-            row.append(str(start_date).split(" ")[0])
-            row.append(str(end_date).split(" ")[0])
-            row.append(delinquent["absences"])
-            row.append(delinquent["user"].last_name)
-            row.append(delinquent["user"].first_name)
-            row.append(delinquent["user"].student_id)
-            row.append(delinquent["user"].grade.number)
-            counselor = delinquent["user"].counselor
-            row.append(counselor.last_name if counselor else "")
-            row.append("{}".format(delinquent["user"].tj_email))
-            row.append(delinquent["user"].emails[0] if delinquent["user"].emails and len(delinquent["user"].emails) > 0 else "")
-            writer.writerow(row)
+            for delinquent in report.iter_rows() if report else []:
+                user = delinquent["user"]
+                counselor = delinquent["counselor"]
+                yield [str(start_date).split(" ")[0], str(end_date).split(" ")[0], delinquent["absences"], user.last_name, user.first_name,
+                       user.student_id, user.grade.number, counselor.last_name if counselor else "", "{}".format(user.tj_email),
+                       user.emails[0] if user.emails and len(user.emails) > 0 else ""]
 
-        return response
+        return streaming_csv_response(rows(), "delinquent_students.csv")
 
 
 @eighth_admin_required
@@ -12,9 +12,9 @@ from django.core.urlresolvers import reverse
 from django.http import HttpResponse
 from django.shortcuts import redirect, render
 
-from ..attendance import generate_roster_pdf
 from ...forms.admin.blocks import BlockForm, QuickBlockForm
 from ...models import EighthBlock, EighthScheduledActivity
+from ...rosters import get_block_roster_pdf
 from ....auth.decorators import eighth_admin_required
 
 logger = logging.getLogger(__name__)
@@ -137,21 +137,21 @@ def delete_block_view(request, block_id):
 
 @eighth_admin_required
 def print_block_rosters_view(request, block_id):
+    try:
+        block = EighthBlock.objects.get(id=block_id)
+    except EighthBlock.DoesNotExist:
+        raise http.Http404
+
     if "schact_id" in request.POST:
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = "inline; filename=\"block_{}_rosters.pdf\"".format(block_id)
-        sched_act_ids = request.POST.getlist("schact_id")
+        sched_act_ids = [said for said in request.POST.getlist("schact_id") if said.isdigit()]
+        pdf = get_block_roster_pdf(block, sched_act_ids, True)
 
-        pdf_buffer = generate_roster_pdf(sched_act_ids, True)
-        response.write(pdf_buffer.getvalue())
-        pdf_buffer.close()
+        response = HttpResponse(pdf, content_type="application/pdf")
+        response["Content-Disposition"] = "inline; filename=\"block_{}_rosters.pdf\"".format(block_id)
         return response
     else:
-        try:
-            block = EighthBlock.objects.get(id=block_id)
-            schacts = EighthScheduledActivity.objects.filter(block=block).order_by("sponsors")
-            schacts = sorted(schacts, key=lambda x: "{}".format(x.get_true_sponsors()))
-        except (EighthBlock.DoesNotExist, EighthScheduledActivity.DoesNotExist):
-            raise http.Http404
+        schacts = (EighthScheduledActivity.objects.filter(block=block).select_related("activity", "block")
+                   .prefetch_related("sponsors", "rooms", "activity__sponsors", "activity__rooms").order_by("sponsors"))
+        schacts = sorted(schacts, key=lambda x: "{}".format(x.get_true_sponsors()))
         context = {"eighthblock": block, "admin_page_title": "Choose activities to print", "schacts": schacts}
         return render(request, "eighth/admin/choose_roster_activities.html", context)
@@ -402,8 +402,7 @@ def eighth_admin_signup_group_action(request, group_id):
     users = group.user_set.all()
 
     if "confirm" in request.POST:
-        for user in users:
-            scheduled_activity.add_user(user, request, force=True, no_after_deadline=True)
+        scheduled_activity.add_users_bulk(users, request, force=True, no_after_deadline=True)
         messages.success(request, "Successfully signed up group for activity.")
         return redirect("eighth_admin_dashboard")
 
@@ -529,9 +528,9 @@ def eighth_admin_distribute_action(request):
         changes = 0
         logger.debug(activity_user_map)
         for schact, userids in activity_user_map.items():
-            for uid in userids:
-                changes += 1
-                schact.add_user(User.objects.get(id=int(uid)), request=None, force=True, no_after_deadline=True)
+            users = User.objects.filter(id__in=[int(uid) for uid in userids])
+            results = schact.add_users_bulk(users, request=None, force=True, no_after_deadline=True)
+            changes += sum(1 for exception in results.values() if exception is None)
 
         messages.success(request, "Successfully completed {} activity signups.".format(changes))
 
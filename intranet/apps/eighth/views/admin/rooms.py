@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import csv
 import logging
 import pickle
 from collections import defaultdict
@@ -8,16 +7,17 @@ from collections import defaultdict
 from django import http
 from django.contrib import messages
 from django.core.urlresolvers import reverse
-from django.db.models import Q
 from django.shortcuts import redirect, render
 
 from formtools.wizard.views import SessionWizardView
 
 from ...forms.admin.blocks import BlockSelectionForm
 from ...forms.admin.rooms import RoomForm
-from ...models import EighthBlock, EighthRoom, EighthScheduledActivity
+from ...models import EighthBlock, EighthRoom
+from ...reports import RoomUtilizationReport
 from ...utils import get_start_date
 from ....auth.decorators import eighth_admin_required
+from .....utils.streaming import streaming_csv_response
 
 logger = logging.getLogger(__name__)
 
@@ -170,8 +170,6 @@ def room_utilization_action(request, start_id, end_id):
     try:
         start_block = EighthBlock.objects.get(id=start_id)
         end_block = EighthBlock.objects.get(id=end_id)
-
-        one_block = (start_id == end_id)
     except EighthBlock.DoesNotExist:
         raise http.Http404
 
@@ -207,80 +205,38 @@ def room_utilization_action(request, start_id, end_id):
     }
     get_csv = request.resolver_match.url_name == "eighth_admin_room_utilization_csv"
     if show_listing or get_csv:
-        sched_acts = (EighthScheduledActivity.objects.exclude(activity__deleted=True))
-        # .exclude(cancelled=True) # include cancelled activities
-        if not one_block:
-            sched_acts = (sched_acts.filter(block__date__gte=start_block.date, block__date__lte=end_block.date))
-        else:
-            sched_acts = sched_acts.filter(block=start_block)
-
-        logger.debug("sched_acts before: {}".format(sched_acts.count()))
         room_ids = request.GET.getlist("room")
         if "room" in request.GET:
             rooms = EighthRoom.objects.filter(id__in=room_ids)
-            sched_acts = sched_acts.filter(Q(rooms__in=rooms) | Q(activity__rooms__in=rooms))
-
-        logger.debug("sched_acts: {}".format(sched_acts.count()))
-
-        sched_acts = (sched_acts.order_by("block__date", "block__block_letter"))
-
-        if "room" in request.GET:
-            all_sched_acts = sched_acts
-            sched_acts = []
-            for sched_act in all_sched_acts:
-                if len(set(rooms).intersection(set(sched_act.get_true_rooms()))) > 0:
-                    sched_acts.append(sched_act)
+            report = RoomUtilizationReport(start_block, end_block, rooms)
         else:
             rooms = all_rooms
+            report = RoomUtilizationReport(start_block, end_block)
 
-        logger.debug("sched_acts end: {}".format(len(sched_acts)))
-
-        sched_acts = sorted(sched_acts, key=lambda x: ("{}".format(x.block), "{}".format(x.get_true_rooms())))
-
-        context.update({"scheduled_activities": sched_acts, "rooms": rooms, "room_ids": [int(i) for i in room_ids]})
+        context.update({"rooms": rooms, "room_ids": [int(i) for i in room_ids]})
+        if not get_csv:
+            context["utilization_rows"] = list(report.rows())
 
     if get_csv:
-        response = http.HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = "attachment; filename=\"room_utilization.csv\""
-
-        writer = csv.writer(response)
-
-        title_row = []
-        for opt in show_opts:
-            if show[opt]:
-                title_row.append(opt.capitalize().replace("_", " "))
-        writer.writerow(title_row)
-
-        for sch_act in sched_acts:
-            row = []
-            if sch_act.activity.administrative and hide_administrative:
-                continue
-
-            if not sch_act.is_overbooked() and only_show_overbooked:
-                continue
-
-            if show["block"]:
-                row.append(sch_act.block)
-            if show["rooms"]:
-                row.append(";".join([rm.name for rm in sch_act.get_true_rooms()]))
-            if show["capacity"]:
-                row.append(sch_act.get_true_capacity())
-            if show["signups"]:
-                row.append(sch_act.members.count())
-            if show["aid"]:
-                row.append(sch_act.activity.aid)
-            if show["activity"]:
-                row.append(sch_act.activity)
-            if show["comments"]:
-                row.append(sch_act.comments)
-            if show["sponsors"]:
-                row.append(";".join([str(sp) for sp in sch_act.get_true_sponsors()]))
-            if show["admin_comments"]:
-                row.append(sch_act.admin_comments)
-
-            writer.writerow(row)
-
-        return response
+        def rows():
+            yield [opt.capitalize().replace("_", " ") for opt in show_opts if show[opt]]
+
+            for row in report.rows(hide_administrative=hide_administrative, only_overbooked=only_show_overbooked):
+                sch_act = row.scheduled_activity
+                values = {
+                    "block": sch_act.block,
+                    "rooms": ";".join([rm.name for rm in row.rooms]),
+                    "capacity": row.capacity,
+                    "signups": row.signups,
+                    "aid": sch_act.activity.aid,
+                    "activity": sch_act.activity,
+                    "comments": sch_act.comments,
+                    "sponsors": ";".join([str(sp) for sp in row.sponsors]),
+                    "admin_comments": sch_act.admin_comments
+                }
+                yield [values[opt] for opt in show_opts if show[opt]]
+
+        return streaming_csv_response(rows(), "room_utilization.csv")
 
     return render(request, "eighth/admin/room_utilization.html", context)
 
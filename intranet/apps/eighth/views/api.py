@@ -11,8 +11,8 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
 from ..models import (EighthActivity, EighthBlock, EighthScheduledActivity, EighthSignup)
-from ..serializers import (EighthActivityDetailSerializer, EighthActivityListSerializer, EighthAddSignupSerializer, EighthBlockDetailSerializer,
-                           EighthBlockListSerializer, EighthScheduledActivitySerializer, EighthSignupSerializer)
+from ..serializers import (EighthActivityDetailSerializer, EighthActivityListSerializer, EighthAddSignupSerializer, EighthAttendanceSerializer,
+                           EighthBlockDetailSerializer, EighthBlockListSerializer, EighthScheduledActivitySerializer, EighthSignupSerializer)
 
 logger = logging.getLogger(__name__)
 
@@ -107,6 +107,16 @@ class EighthUserSignupListAdd(generics.ListCreateAPIView):
         if force and not request.user.is_eighth_admin:
             return Response({"error": "You are not an administrator."}, status=status.HTTP_400_BAD_REQUEST)
 
+        if "users" in serializer.validated_data:
+            if not request.user.is_eighth_admin:
+                return Response({"error": "You are not an administrator."}, status=status.HTTP_400_BAD_REQUEST)
+
+            results = schactivity.add_users_bulk(serializer.validated_data["users"], request, force=force)
+            return Response({"results": [{"user": user.id,
+                                          "success": exception is None,
+                                          "details": exception.messages(admin=True) if exception else []} for user, exception in results.items()]},
+                            status=status.HTTP_201_CREATED)
+
         schactivity.add_user(user, request, force=force)
 
         return Response(EighthActivityDetailSerializer(schactivity.activity, context={"request": request}).data, status=status.HTTP_201_CREATED)
@@ -122,6 +132,37 @@ class EighthScheduledActivitySignupList(views.APIView):
         return Response(serializer.data)
 
 
+class EighthScheduledActivityAttendance(views.APIView):
+    """API endpoint that records the attendance of a scheduled activity.
+
+    POST the IDs of the members who are present as "present"; the
+    response summarizes the attendance (see
+    :meth:`EighthScheduledActivity.take_attendance`).
+
+    """
+
+    def post(self, request, scheduled_activity_id):
+        try:
+            scheduled_activity = (EighthScheduledActivity.objects.select_related("activity", "block").get(activity__deleted=False,
+                                                                                                          id=scheduled_activity_id))
+        except EighthScheduledActivity.DoesNotExist:
+            raise Http404
+
+        if not request.user.is_eighth_admin:
+            if not request.user.is_attendance_taker or not scheduled_activity.user_is_sponsor(request.user):
+                return Response({"error": "You are not a sponsor of this activity."}, status=status.HTTP_403_FORBIDDEN)
+            if scheduled_activity.cancelled:
+                return Response({"error": "The activity was cancelled."}, status=status.HTTP_403_FORBIDDEN)
+            if not scheduled_activity.block.locked:
+                return Response({"error": "The block has not been locked yet."}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = EighthAttendanceSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(scheduled_activity.take_attendance(serializer.validated_data["present"]))
+
+
 class EighthSignupDetail(generics.RetrieveAPIView):
     """API endpoint that shows details of an eighth signup."""
     queryset = EighthSignup.objects.all()
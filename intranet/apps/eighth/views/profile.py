@@ -10,6 +10,7 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
 
+from ..history import get_history_signups, get_often_activities, history_blocks
 from ..models import (EighthBlock, EighthScheduledActivity, EighthSignup, EighthSponsor)
 from ..serializers import EighthBlockDetailSerializer
 from ..utils import get_start_date
@@ -199,20 +200,22 @@ def profile_history_view(request, user_id=None):
     if profile_user.is_eighth_sponsor and not profile_user.is_student and request.user.is_eighth_admin:
         return redirect("eighth_admin_sponsor_schedule", profile_user.get_eighth_sponsor().id)
 
-    blocks = EighthBlock.objects.get_blocks_this_year()
-    blocks = blocks.filter(locked=True)
-    blocks = blocks.order_by("date", "block_letter")
+    blocks = history_blocks().order_by("date", "block_letter")
+    signups = get_history_signups(profile_user)
+
+    try:
+        highlighted_activity = int(request.GET.get("activity") or 0)
+    except ValueError:
+        highlighted_activity = 0
 
     eighth_schedule = []
 
     for block in blocks:
         sch = {}
         sch["block"] = block
-        try:
-            sch["signup"] = EighthSignup.objects.get(scheduled_activity__block=block, user=profile_user)
-            sch["highlighted"] = (int(request.GET.get("activity") or 0) == sch["signup"].scheduled_activity.activity.id)
-        except EighthSignup.DoesNotExist:
-            sch["signup"] = None
+        sch["signup"] = signups.get(block.id)
+        if sch["signup"]:
+            sch["highlighted"] = (highlighted_activity == sch["signup"].scheduled_activity.activity_id)
         eighth_schedule.append(sch)
 
     logger.debug(eighth_schedule)
@@ -239,20 +242,7 @@ def profile_often_view(request, user_id=None):
     if profile_user != request.user and not (request.user.is_eighth_admin or request.user.is_teacher):
         return render(request, "error/403.html", {"reason": "You may only view your own schedule."}, status=403)
 
-    blocks = EighthBlock.objects.get_blocks_this_year()
-    blocks = blocks.filter(locked=True)
-
-    signups = EighthSignup.objects.filter(user=profile_user, scheduled_activity__block__in=blocks)
-    activities = []
-    for sch in signups:
-        activities.append(sch.scheduled_activity.activity)
-
-    oftens = []
-    unique_activities = set(activities)
-    for act in unique_activities:
-        oftens.append({"count": activities.count(act), "activity": act})
-
-    oftens = sorted(oftens, key=lambda x: (-1 * x["count"]))
+    oftens = get_often_activities(profile_user)
 
     logger.debug(oftens)
 
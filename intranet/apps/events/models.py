@@ -32,6 +32,18 @@ class EventManager(Manager):
 
         return (Event.objects.filter(approved=True).filter(Q(groups__in=user.groups.all()) | Q(groups__isnull=True) | Q(user=user)))
 
+    def visible_to_groups(self, groups):
+        """Get the approved events that are public or in one of the groups with the given ids.
+
+        Unlike visible_to_user, this doesn't join the groups, so it
+        returns no duplicates and can be ordered and sliced by the
+        database.
+
+        """
+        in_groups = Event.groups.through.objects.filter(group_id__in=groups).values("event_id")
+        with_groups = Event.groups.through.objects.values("event_id")
+        return Event.objects.filter(approved=True).filter(Q(id__in=in_groups) | ~Q(id__in=with_groups))
+
     def hidden_events(self, user):
         """Get a list of events marked as hidden for a given user (usually request.user).
 
@@ -188,6 +200,7 @@ class Event(models.Model):
 
     class Meta:
         ordering = ["time"]
+        index_together = [("added", "id")]
 
 
 class TJStarUUIDMap(models.Model):
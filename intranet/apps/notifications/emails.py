@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import socket
+from smtplib import SMTPException, SMTPServerDisconnected
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import get_template
 
 logger = logging.getLogger(__name__)
 
+# Errors from sending an email that are worth retrying, e.g. with
+# job(retry_on=EMAIL_ERRORS) for jobs that send a single email
+EMAIL_ERRORS = (SMTPException, socket.error)
+
 
 def email_send(text_template, html_template, data, subject, emails, headers=None):
     """Send an HTML/Plaintext email with the following fields.
@@ -21,20 +27,65 @@ def email_send(text_template, html_template, data, subject, emails, headers=None
 
     """
 
-    text = get_template(text_template)
-    html = get_template(html_template)
-    text_content = text.render(data)
-    html_content = html.render(data)
-    subject = settings.EMAIL_SUBJECT_PREFIX + subject
-    headers = {} if headers is None else headers
-    msg = EmailMultiAlternatives(subject, text_content, settings.EMAIL_FROM, emails, headers=headers)
-    msg.attach_alternative(html_content, "text/html")
-    logger.debug("Emailing {} to {}".format(subject, emails))
+    msg = email_build(get_template(text_template), get_template(html_template), data, subject, emails, headers)
+    logger.debug("Emailing {} to {}".format(msg.subject, emails))
     msg.send()
 
     return msg
 
 
+def email_build(text, html, data, subject, emails, headers=None):
+    """Build (but do not send) an HTML/Plaintext email from already loaded templates, so that
+    many emails can be rendered from the same templates.
+
+    text: The template for the text email's contents
+    html: The template for the HTML email's contents
+    data: The context to pass to the templates
+    subject: The subject of the email
+    emails: The addresses to send the email to
+    headers: A dict of additional headers to send to the message
+
+    """
+
+    subject = settings.EMAIL_SUBJECT_PREFIX + subject
+    headers = {} if headers is None else headers
+    msg = EmailMultiAlternatives(subject, text.render(data), settings.EMAIL_FROM, emails, headers=headers)
+    msg.attach_alternative(html.render(data), "text/html")
+    return msg
+
+
+def email_send_many(messages, batch_size=None):
+    """Send many emails, each batch of them over one SMTP connection.
+
+    messages: The EmailMessages to send
+    batch_size: The number of messages sent over each connection (defaults to settings.EMAIL_SEND_BATCH_SIZE)
+
+    A message that the SMTP server rejects is logged and skipped, so that
+    the rest are still sent.
+
+    Returns the number of messages that were sent.
+
+    """
+
+    messages = list(messages)
+    batch_size = batch_size or settings.EMAIL_SEND_BATCH_SIZE
+
+    sent = 0
+    for i in range(0, len(messages), batch_size):
+        with get_connection() as connection:
+            for msg in messages[i:i + batch_size]:
+                try:
+                    sent += connection.send_messages([msg]) or 0
+                except SMTPException as e:
+                    logger.exception("Could not send email to {}".format(", ".join(msg.to)))
+                    if isinstance(e, SMTPServerDisconnected):
+                        # Reconnect for the next message
+                        connection.close()
+    logger.info("Sent {} of {} emails".format(sent, len(messages)))
+
+    return sent
+
+
 def email_send_bcc(text_template, html_template, data, subject, emails, headers=None):
     """Send an HTML/Plaintext email with the following fields.
 
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    """Raised by a job to report a failure that should be retried."""
+    pass
+
+
+def job(func=None, retry_on=()):
+    """Mark a function as runnable by the job queue.
+
+    Only functions with this decorator can be passed to :func:`enqueue`
+    or run by a worker. Their arguments must be JSON serializable, so
+    jobs take IDs rather than model instances.
+
+    A job is only retried if it raises :class:`JobError` or one of the
+    exceptions in ``retry_on``; anything else may have happened after part
+    of its work was done, so the job fails without being run again. Use
+    ``retry_on`` only for jobs that can safely be run again, e.g. ones
+    that send a single message. Only those jobs are run again if the
+    worker running them stops (see :meth:`JobManager.requeue_stale`).
+
+    """
+    if func is None:
+        return lambda f: job(f, retry_on)
+    func.is_job = True
+    func.retry_on = (JobError,) + tuple(retry_on)
+    return func
+
+
+def task_name(func):
+    return "{}.{}".format(func.__module__, func.__name__)
+
+
+def get_job_function(task):
+    func = import_string(task)
+    if not getattr(func, "is_job", False):
+        raise JobError("{} is not a job".format(task))
+    return func
+
+
+def enqueue(func, *args, idempotency_key=None, user=None, max_attempts=None, **kwargs):
+    """Queue ``func(*args, **kwargs)`` to be run by a worker.
+
+    If settings.JOB_QUEUE_ASYNC is off, the job is run immediately in
+    this process instead, and is not retried if it fails.
+
+    Args:
+        func: A function decorated with :func:`job`.
+        idempotency_key: If a job with this key was already enqueued,
+            return it instead of queueing the work again.
+        user: The User that the job is being run on behalf of.
+        max_attempts: The number of times to try the job before giving
+            up. Defaults to settings.JOB_QUEUE_MAX_ATTEMPTS.
+
+    Returns:
+        The Job object.
+
+    """
+    if not getattr(func, "is_job", False):
+        raise JobError("{} is not a job".format(task_name(func)))
+
+    if user is not None and not user.is_authenticated():
+        user = None
+
+    new_job = Job(task=task_name(func), arguments=json.dumps({"args": args, "kwargs": kwargs}), idempotency_key=idempotency_key, user=user,
+                  max_attempts=max_attempts or settings.JOB_QUEUE_MAX_ATTEMPTS, retry_safe=func.retry_on != (JobError,))
+
+    if idempotency_key is None:
+        new_job.save()
+    else:
+        try:
+            with transaction.atomic():
+                new_job.save()
+        except IntegrityError:
+            existing = Job.objects.get(idempotency_key=idempotency_key)
+            logger.debug("Job {} already enqueued as {}".format(idempotency_key, existing.id))
+            return existing
+
+    logger.debug("Enqueued job {}: {}".format(new_job.id, new_job))
+
+    if not settings.JOB_QUEUE_ASYNC:
+        now = timezone.now()
+        claimed = Job.objects.filter(id=new_job.id, status=Job.QUEUED)
+        if claimed.update(status=Job.RUNNING, worker="inline", started_time=now, heartbeat_time=now, attempts=1):
+            new_job.refresh_from_db()
+            # Nothing would pick up a requeued job
+            run_job(new_job, retry=False)
+
+    return new_job
+
+
+def retry_delay(attempts):
+    """The number of seconds to wait before the next attempt, doubling after each failure."""
+    return settings.JOB_QUEUE_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+class Heartbeat(threading.Thread):
+    """Record every settings.JOB_QUEUE_HEARTBEAT_INTERVAL seconds that a claimed job is still
+    running, so that :meth:`JobManager.requeue_stale` leaves it alone."""
+
+    def __init__(self, claimed_job):
+        super(Heartbeat, self).__init__(name="heartbeat-{}".format(claimed_job.id))
+        self.daemon = True
+        self.owned = Job.objects.owned(claimed_job)
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.JOB_QUEUE_HEARTBEAT_INTERVAL):
+                self.owned.update(heartbeat_time=timezone.now())
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(claimed_job, retry=True):
+    """Run a job that has been claimed by this worker and record the outcome.
+
+    If the job fails with one of the exceptions it can be retried on, it
+    is queued again (unless ``retry`` is False or it has run out of
+    attempts); otherwise it is marked as failed. The outcome is not
+    recorded if the job was requeued while it ran.
+
+    """
+    owned = Job.objects.owned(claimed_job)
+    # Inline jobs run in the request, which may hold a lock on the job
+    heartbeat = Heartbeat(claimed_job) if claimed_job.worker != "inline" else None
+    if heartbeat:
+        heartbeat.start()
+    func = None
+    try:
+        func = get_job_function(claimed_job.task)
+        data = claimed_job.data
+        func(*data["args"], **data["kwargs"])
+    except Exception as e:
+        claimed_job.last_error = traceback.format_exc()
+        retryable = func is not None and isinstance(e, func.retry_on)
+        if not retry or not retryable or claimed_job.attempts >= claimed_job.max_attempts:
+            logger.error("Job {} failed permanently after {} attempts".format(claimed_job.id, claimed_job.attempts))
+            claimed_job.status = Job.FAILED
+            claimed_job.finished_time = timezone.now()
+        else:
+            logger.warning("Job {} failed, retrying".format(claimed_job.id))
+            claimed_job.status = Job.QUEUED
+            claimed_job.worker = ""
+            claimed_job.run_after = timezone.now() + timedelta(seconds=retry_delay(claimed_job.attempts))
+    else:
+        claimed_job.status = Job.SUCCEEDED
+        claimed_job.finished_time = timezone.now()
+    finally:
+        if heartbeat:
+            heartbeat.stop()
+
+    if not owned.update(status=claimed_job.status, worker=claimed_job.worker, last_error=claimed_job.last_error,
+                        run_after=claimed_job.run_after, finished_time=claimed_job.finished_time):
+        logger.warning("Job {} was requeued while it ran; not recording its outcome".format(claimed_job.id))
+    return claimed_job
+
+
+def worker_name(index=0):
+    return "{}:{}".format(socket.gethostname(), index)
+
+
+def work(name, stop, once=False, poll_interval=None):
+    """Claim and run jobs until ``stop`` is set.
+
+    Args:
+        name: The name of this worker, recorded on each claimed job.
+        stop: A threading.Event that ends the loop.
+        once: Return as soon as no more jobs are due.
+        poll_interval: Seconds to sleep when no jobs are due. Defaults to
+            settings.JOB_QUEUE_POLL_INTERVAL.
+
+    Returns:
+        The number of jobs that were run.
+
+    """
+    if poll_interval is None:
+        poll_interval = settings.JOB_QUEUE_POLL_INTERVAL
+
+    ran = 0
+    try:
+        while not stop.is_set():
+            claimed_job = Job.objects.claim(name)
+            if claimed_job is None:
+                Job.objects.requeue_stale()
+                if once:
+                    break
+                stop.wait(poll_interval)
+                continue
+            run_job(claimed_job)
+            ran += 1
+    finally:
+        connection.close()
+    return ran
+
+
+def start_workers(concurrency, once=False, poll_interval=None):
+    """Start ``concurrency`` worker threads.
+
+    Jobs are I/O bound (SMTP, HTTP), so threads are enough; run the
+    command several times for more processes.
+
+    Returns:
+        A tuple of the threads and the threading.Event that stops them.
+
+    """
+    stop = threading.Event()
+    threads = []
+    for i in range(concurrency):
+        thread = threading.Thread(target=work, name=worker_name(i), args=(worker_name(i), stop), kwargs={"once": once, "poll_interval": poll_interval})
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    return threads, stop
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from intranet.apps.notifications.jobs import start_workers
+from intranet.apps.notifications.models import Job
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (emails, push notifications, tweets) from the job queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, dest='concurrency', default=settings.JOB_QUEUE_CONCURRENCY,
+                            help='Number of jobs to run at the same time.')
+
+        parser.add_argument('--once', action='store_true', dest='once', default=False, help='Exit once there are no more jobs due.')
+
+        parser.add_argument('--poll-interval', type=float, dest='poll_interval', default=settings.JOB_QUEUE_POLL_INTERVAL,
+                            help='Seconds to wait between checks for new jobs.')
+
+    def handle(self, *args, **options):
+        purged, _ = Job.objects.purge()
+        if purged:
+            self.stdout.write("Purged {} old jobs.".format(purged))
+
+        threads, stop = start_workers(options["concurrency"], once=options["once"], poll_interval=options["poll_interval"])
+        self.stdout.write("Started {} workers.".format(len(threads)))
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers after their current jobs...")
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write("Done.")
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0009_job_heartbeat_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='retry_safe',
+            field=models.BooleanField(default=False),
+        ),
+    ]
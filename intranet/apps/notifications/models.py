@@ -2,8 +2,12 @@
 
 import hashlib
 import json
+from datetime import timedelta
 
+from django.conf import settings
 from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
 
 from ..users.models import User
 
@@ -42,3 +46,115 @@ class GCMNotification(models.Model):
         if json_data and "data" in json_data:
             return json_data["data"]
         return {}
+
+
+class JobManager(models.Manager):
+
+    def claim(self, worker):
+        """Claim the next job that is due to run for ``worker``.
+
+        Jobs are claimed with a conditional UPDATE, so any number of
+        workers can poll the same table without running a job twice.
+
+        Returns:
+            The claimed Job, or None if no job is due.
+
+        """
+        now = timezone.now()
+        due = self.filter(status=Job.QUEUED, run_after__lte=now).order_by("run_after", "id").values_list("id", flat=True)
+        for job_id in due[:10]:
+            if self.filter(id=job_id, status=Job.QUEUED).update(status=Job.RUNNING, worker=worker, started_time=now, heartbeat_time=now,
+                                                                attempts=F("attempts") + 1):
+                return self.get(id=job_id)
+        return None
+
+    def owned(self, claimed_job):
+        """Return a QuerySet of ``claimed_job`` if it is still running under the claim it was
+        loaded with (it has not been requeued since)."""
+        return self.filter(id=claimed_job.id, status=Job.RUNNING, worker=claimed_job.worker, started_time=claimed_job.started_time)
+
+    def requeue_stale(self):
+        """Requeue jobs whose worker died while running them.
+
+        A worker records a heartbeat while it runs a job, so only jobs
+        without a heartbeat for settings.JOB_QUEUE_TIMEOUT seconds are
+        requeued. Jobs that are not ``retry_safe`` (they may have done part
+        of their work before the worker stopped), that have run out of
+        attempts or that were run inline (no worker would pick them up
+        again) are failed instead. Inline jobs do not update their heartbeat,
+        so they are considered stale JOB_QUEUE_TIMEOUT seconds after starting.
+
+        Returns:
+            The number of jobs that were requeued.
+
+        """
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=settings.JOB_QUEUE_TIMEOUT)
+        stale = self.filter(Q(heartbeat_time__lt=cutoff) | Q(heartbeat_time__isnull=True, started_time__lt=cutoff), status=Job.RUNNING)
+        stale.filter(Q(retry_safe=False) | Q(attempts__gte=F("max_attempts")) | Q(worker="inline")).update(
+            status=Job.FAILED, finished_time=now, last_error="The worker running the job stopped.")
+        return stale.update(status=Job.QUEUED, worker="")
+
+    def purge(self):
+        """Delete finished jobs that are older than settings.JOB_QUEUE_KEEP_DAYS."""
+        cutoff = timezone.now() - timedelta(days=settings.JOB_QUEUE_KEEP_DAYS)
+        return self.filter(status__in=[Job.SUCCEEDED, Job.FAILED], finished_time__lt=cutoff).delete()
+
+
+class Job(models.Model):
+    """A unit of background work, such as sending an email or a push notification.
+
+    Attributes:
+        task
+            The dotted path of the function decorated with
+            :func:`intranet.apps.notifications.jobs.job` to run.
+        arguments
+            The JSON encoded positional and keyword arguments of the
+            function.
+        idempotency_key
+            An optional unique key. Enqueueing a job with a key that is
+            already in use returns the existing job instead.
+        attempts
+            The number of times the job has been started.
+        retry_safe
+            Whether the job can be run again after a partial run, because
+            its function was decorated with ``retry_on`` exceptions.
+        heartbeat_time
+            The last time the worker running the job reported that it is
+            still running it.
+        run_after
+            The time before which the job will not be run; pushed back
+            after each failed attempt.
+
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUSES = ((QUEUED, "Queued"), (RUNNING, "Running"), (SUCCEEDED, "Succeeded"), (FAILED, "Failed"))
+
+    objects = JobManager()
+
+    task = models.CharField(max_length=250)
+    arguments = models.TextField()
+    idempotency_key = models.CharField(max_length=250, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED, db_index=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=1)
+    retry_safe = models.BooleanField(default=False)
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+    started_time = models.DateTimeField(null=True, blank=True)
+    heartbeat_time = models.DateTimeField(null=True, blank=True)
+    finished_time = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+
+    @property
+    def data(self):
+        return json.loads(self.arguments)
+
+    def __str__(self):
+        return "{} ({})".format(self.task, self.status)
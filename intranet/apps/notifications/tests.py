@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.template.loader import get_template
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .emails import email_build, email_send_many
+from .jobs import JobError, enqueue, job, run_job
+from .models import Job
+from ...test.ion_test import IonTestCase
+
+job_calls = []
+
+
+@job
+def record_call(value):
+    job_calls.append(value)
+    if value == "fail":
+        raise JobError("failed")
+    if value == "error":
+        raise ValueError("error")
+
+
+@job(retry_on=(ValueError,))
+def record_retryable_call(value):
+    record_call(value)
+
+
+class JobQueueTest(IonTestCase):
+    """Tests for the background job queue."""
+
+    def setUp(self):
+        del job_calls[:]
+
+    @override_settings(JOB_QUEUE_ASYNC=True, JOB_QUEUE_MAX_ATTEMPTS=2, JOB_QUEUE_RETRY_DELAY=0)
+    def test_enqueue_and_retry(self):
+        queued = enqueue(record_call, "fail", idempotency_key="test-job")
+        self.assertEqual(queued.status, Job.QUEUED)
+        self.assertEqual(enqueue(record_call, "fail", idempotency_key="test-job").id, queued.id)
+        self.assertEqual(job_calls, [])
+
+        for attempt in range(2):
+            claimed = Job.objects.claim("test")
+            self.assertEqual(claimed.id, queued.id)
+            self.assertIsNone(Job.objects.claim("test"))
+            run_job(claimed)
+
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.FAILED)
+        self.assertEqual(queued.attempts, 2)
+        self.assertIn("JobError", queued.last_error)
+        self.assertEqual(job_calls, ["fail", "fail"])
+
+    @override_settings(JOB_QUEUE_ASYNC=True, JOB_QUEUE_MAX_ATTEMPTS=2, JOB_QUEUE_TIMEOUT=60)
+    def test_other_errors_and_stale_jobs(self):
+        queued = enqueue(record_call, "error")
+        run_job(Job.objects.claim("test"))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.FAILED)
+        self.assertEqual(queued.attempts, 1)
+
+        queued = enqueue(record_retryable_call, "ok")
+        self.assertTrue(queued.retry_safe)
+        claimed = Job.objects.claim("test")
+        self.assertEqual(Job.objects.requeue_stale(), 0)
+        Job.objects.filter(id=queued.id).update(heartbeat_time=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(Job.objects.requeue_stale(), 1)
+        # The first worker finishes after the job was requeued, so its outcome is not recorded
+        run_job(claimed)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.QUEUED)
+
+        # A job that is not safe to run again fails instead of being requeued
+        Job.objects.filter(id=queued.id).update(status=Job.SUCCEEDED)
+        queued = enqueue(record_call, "ok")
+        self.assertFalse(queued.retry_safe)
+        Job.objects.claim("test")
+        Job.objects.filter(id=queued.id).update(heartbeat_time=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(Job.objects.requeue_stale(), 0)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.FAILED)
+        self.assertEqual(job_calls, ["error", "ok"])
+
+        # Nothing would pick up a job that was run inline again, so it fails as well
+        queued = enqueue(record_retryable_call, "ok")
+        Job.objects.filter(id=queued.id).update(status=Job.RUNNING, worker="inline", heartbeat_time=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(Job.objects.requeue_stale(), 0)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.FAILED)
+
+    @override_settings(JOB_QUEUE_ASYNC=False)
+    def test_enqueue_inline(self):
+        done = enqueue(record_call, "ok")
+        self.assertEqual(done.status, Job.SUCCEEDED)
+        self.assertEqual(job_calls, ["ok"])
+        self.assertEqual(enqueue(record_call, "fail").status, Job.FAILED)
+
+        with self.assertRaises(JobError):
+            enqueue(len, "not a job")
+
+
+class EmailTest(IonTestCase):
+    """Tests for sending notification emails."""
+
+    def test_email_send_many(self):
+        text, html = get_template("feedback/email.txt"), get_template("feedback/email.html")
+        messages = [email_build(text, html, {}, "Test", ["user{}@tjhsst.edu".format(i)]) for i in range(5)]
+        self.assertEqual(email_send_many(messages, batch_size=2), 5)
+        self.assertEqual([msg.to for msg in mail.outbox], [["user{}@tjhsst.edu".format(i)] for i in range(5)])
+
+        # A rejected email does not stop the rest from being sent
+        mail.outbox = []
+        send_messages = locmem.EmailBackend.send_messages
+
+        def reject_user1(backend, messages):
+            if messages[0].to == ["user1@tjhsst.edu"]:
+                raise SMTPRecipientsRefused({"user1@tjhsst.edu": (550, b"No such user")})
+            return send_messages(backend, messages)
+
+        with patch.object(locmem.EmailBackend, "send_messages", reject_user1):
+            self.assertEqual(email_send_many(messages, batch_size=2), 4)
+        self.assertEqual([msg.to for msg in mail.outbox], [["user{}@tjhsst.edu".format(i)] for i in (0, 2, 3, 4)])
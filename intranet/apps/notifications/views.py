@@ -6,14 +6,18 @@ import logging
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import redirect, render
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
 import requests
 
-from .models import GCMNotification, NotificationConfig
+from .jobs import JobError, enqueue, job
+from .models import GCMNotification, Job, NotificationConfig
 from ..schedule.notifications import chrome_getdata_check
+from ..users.models import User
 
 logger = logging.getLogger(__name__)
 
@@ -170,6 +174,14 @@ def gcm_post(nc_users, data, user=None, request=None):
     return False, req.text
 
 
+@job
+def send_gcm_post(nc_users, data, user_id):
+    """Job that runs :func:`gcm_post`, failing (and so retrying) if GCM rejects the message."""
+    post, reqtext = gcm_post(nc_users, data, user=User.objects.get(id=user_id))
+    if not post:
+        raise JobError(reqtext)
+
+
 @login_required
 def gcm_post_view(request):
     if not request.user.has_admin_permission("notifications"):
@@ -196,12 +208,17 @@ def gcm_post_view(request):
     context = {"nc_all": nc_all, "has_tokens": has_tokens}
 
     if request.method == "POST":
-        nc_users = request.POST.getlist("nc_users")
-        post, reqtext = gcm_post(nc_users, data, request.user)
-        if post:
-            messages.success(request, "Delivered message: {} success, {} failure".format(post["success"], post["failure"]))
+        nc_users = [int(ncid) for ncid in request.POST.getlist("nc_users")]
+        posted = enqueue(send_gcm_post, nc_users, data, request.user.id, user=request.user)
+        if posted.status == Job.FAILED:
+            # The last line of the traceback has the error GCM returned
+            error = posted.last_error.strip().splitlines()[-1] if posted.last_error else "Unknown error"
+            messages.error(request, "Failed. {}".format(error))
+            return render(request, "notifications/gcm_post.html", context, status=502)
+        elif posted.status == Job.SUCCEEDED:
+            messages.success(request, "Message sent to {} devices.".format(len(nc_users)))
         else:
-            messages.error(request, "Failed. {}".format(reqtext))
+            messages.success(request, "Message queued for {} devices.".format(len(nc_users)))
     return render(request, "notifications/gcm_post.html", context)
 
 
@@ -209,3 +226,32 @@ def get_gcm_schedule_uids():
     nc_all = (NotificationConfig.objects.exclude(gcm_token=None).exclude(gcm_optout=True))
     nc = nc_all.filter(user__receive_schedule_notifications=True)
     return nc.values_list("id", flat=True)
+
+
+@login_required
+def jobs_view(request):
+    """Show the status of recent background jobs, and allow failed jobs to be retried."""
+    if not request.user.has_admin_permission("notifications"):
+        return redirect("index")
+
+    if request.method == "POST" and "retry" in request.POST:
+        try:
+            job_id = int(request.POST["retry"])
+        except ValueError:
+            return HttpResponseBadRequest("retry must be an integer")
+        retried = Job.objects.filter(id=job_id, status=Job.FAILED).update(status=Job.QUEUED, attempts=0, run_after=timezone.now())
+        if retried:
+            messages.success(request, "Requeued job.")
+        return redirect("notif_jobs")
+
+    status_filter = request.GET.get("status")
+    jobs = Job.objects.select_related("user").order_by("-created_time")
+    if status_filter:
+        jobs = jobs.filter(status=status_filter)
+
+    counts = dict(Job.objects.values_list("status").annotate(Count("id")))
+    statuses = [(status, name, counts.get(status, 0)) for status, name in Job.STATUSES]
+
+    context = {"jobs": jobs[:200], "statuses": statuses, "status_filter": status_filter}
+
+    return render(request, "notifications/jobs.html", context)
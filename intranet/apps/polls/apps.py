@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from django.apps import AppConfig
+
+
+class PollsConfig(AppConfig):
+    name = "intranet.apps.polls"
+
+    def ready(self):
+        from .results import connect_signals
+        connect_signals()
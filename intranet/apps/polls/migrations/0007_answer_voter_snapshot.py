@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import Counter
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_split_weights(apps, schema_editor):
+    Answer = apps.get_model("polls", "Answer")
+    answers = Answer.objects.filter(question__type="SAP")
+    counts = Counter(answers.values_list("question", "user"))
+    for (question, user), count in counts.items():
+        if count > 1:
+            answers.filter(question=question, user=user).update(weight=(Decimal(1) / count).quantize(Decimal("0.001")))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('polls', '0006_auto_20160112_0101')]
+
+    operations = [
+        migrations.AddField(model_name='answer', name='voter_grade', field=models.PositiveSmallIntegerField(null=True),),
+        migrations.AddField(model_name='answer', name='voter_sex', field=models.CharField(blank=True, max_length=1),),
+        migrations.CreateModel(name='PollResultSnapshot',
+                               fields=[
+                                   ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                                   ('data', models.TextField()),
+                                   ('created', models.DateTimeField(auto_now_add=True)),
+                                   ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result_snapshot',
+                                                                 to='polls.Poll')),
+                               ],),
+        migrations.RunPython(set_split_weights, migrations.RunPython.noop),
+    ]
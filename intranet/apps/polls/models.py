@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+from decimal import Decimal
 from random import shuffle
 
 from django.contrib.auth.models import Group as DjangoGroup
@@ -242,13 +243,48 @@ class Choice(models.Model):  # individual answer choices
         ordering = ["num"]
 
 
+def split_weight(num_choices):
+    """Return the weight of each of a user's answers to a split approval question, when they
+    chose ``num_choices`` choices."""
+    return (Decimal(1) / num_choices).quantize(Decimal("0.001"))
+
+
+class AnswerManager(Manager):
+
+    def set_split_weights(self, user, question):
+        """Split the vote of a user on a split approval question equally between the choices
+        they chose."""
+        answers = self.filter(user=user, question=question)
+        num_choices = answers.count()
+        if num_choices:
+            answers.update(weight=split_weight(num_choices))
+
+
 class Answer(models.Model):  # individual answer choices selected
+    """An answer to a Question.
+
+    Attributes:
+        voter_grade
+            The grade of the user when they voted (9-12, or 13 for staff and
+            graduates; 0 if they have no grade), or None if it hasn't been
+            recorded yet.
+        voter_sex
+            "m" or "f" (or "" if unknown) when the user voted.
+
+    The grade and sex are stored with the answer so that results can be
+    counted in SQL instead of looking up every voter in LDAP.
+
+    """
+    objects = AnswerManager()
+
     question = models.ForeignKey(Question)
     user = models.ForeignKey(User)
     choice = models.ForeignKey(Choice, null=True)  # for multiple choice questions
     answer = models.CharField(max_length=10000, null=True)  # for free response
     clear_vote = models.BooleanField(default=False)
     weight = models.DecimalField(max_digits=4, decimal_places=3, default=1)  # for split approval
+    voter_grade = models.PositiveSmallIntegerField(null=True)
+    voter_sex = models.CharField(max_length=1, blank=True)
 
     def __str__(self):
         if self.choice:
@@ -270,3 +306,25 @@ class AnswerVotes(models.Model):  # record of total selection of a given answer
 
     def __str__(self):
         return self.choice
+
+
+class PollResultSnapshot(models.Model):
+    """The results of a closed poll, stored so that they don't need to be counted again.
+
+    Attributes:
+        poll
+            The Poll.
+        data
+            The JSON-encoded results, from
+            :func:`intranet.apps.polls.results.count_results`.
+
+    Snapshots are deleted if the poll is changed or an answer is
+    changed after it closed.
+
+    """
+    poll = models.OneToOneField(Poll, related_name="result_snapshot")
+    data = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "Results of {}".format(self.poll)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import post_delete, post_save
+
+from .models import Answer, Choice, Poll, PollResultSnapshot, Question
+from ..users.models import User
+
+logger = logging.getLogger(__name__)
+
+# The grades results are broken down by; 13 is staff (and graduates)
+GRADES = range(9, 14)
+
+
+def voter_snapshot(user):
+    """Return the voter_grade and voter_sex to store with the answers of ``user``."""
+    grade = user.grade
+    return {"voter_grade": grade.number if grade else 0, "voter_sex": "m" if user.is_male else "f" if user.is_female else ""}
+
+
+def record_missing_voters(questions):
+    """Store the grade and sex of the voters of answers from before they were recorded."""
+    missing = Answer.objects.filter(question__in=questions, voter_grade__isnull=True)
+    users = User.objects.filter(id__in=missing.values("user").distinct())
+    if not users:
+        return
+    User.objects.prefetch_ldap(users, ["graduation_year", "sex"])
+    for user in users:
+        missing.filter(user=user).update(**voter_snapshot(user))
+
+
+def question_cache_key(question_id):
+    return "polls:results:{}".format(question_id)
+
+
+def count_question_results(question_ids):
+    """Count the answers to the questions with the given ids with two grouped queries.
+
+    Returns:
+        A dict mapping each question id to a dict with a list of
+        (choice id, clear vote, grade, sex, answers, weight) "choices" rows
+        and a list of (grade, sex, users) "voters" rows.
+
+    """
+    results = {question_id: {"choices": [], "voters": []} for question_id in question_ids}
+    answers = Answer.objects.filter(question__in=question_ids).order_by()
+
+    for row in answers.values("question", "choice", "clear_vote", "voter_grade", "voter_sex").annotate(answers=Count("id"), weight=Sum("weight")):
+        results[row["question"]]["choices"].append([row["choice"], row["clear_vote"], row["voter_grade"], row["voter_sex"], row["answers"],
+                                                    float(row["weight"] or 0)])
+
+    for row in answers.values("question", "voter_grade", "voter_sex").annotate(users=Count("user", distinct=True)):
+        results[row["question"]]["voters"].append([row["voter_grade"], row["voter_sex"], row["users"]])
+
+    return results
+
+
+def count_results(poll):
+    """Return the counted results of every choice question of ``poll``, keyed by question id.
+
+    The results of each question are cached until one of its answers
+    changes, so a vote only causes that question to be counted again.
+
+    """
+    question_ids = list(poll.question_set.filter(type__in=[Question.STD, Question.ELECTION, Question.APP, Question.SPLIT_APP])
+                        .values_list("id", flat=True))
+    keys = {question_cache_key(question_id): question_id for question_id in question_ids}
+    results = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+
+    missing = [question_id for question_id in question_ids if question_id not in results]
+    if missing:
+        record_missing_voters(missing)
+        counted = count_question_results(missing)
+        cache.set_many({question_cache_key(question_id): value for question_id, value in counted.items()},
+                       timeout=settings.CACHE_AGE["poll_results"])
+        results.update(counted)
+    return results
+
+
+def get_poll_results(poll):
+    """Return the counted results of ``poll``, as :func:`count_results` does.
+
+    Once a poll has closed, its results are frozen in a
+    PollResultSnapshot and read from there.
+
+    """
+    if poll.before_end_time():
+        return count_results(poll)
+
+    try:
+        snapshot = PollResultSnapshot.objects.get(poll=poll)
+    except PollResultSnapshot.DoesNotExist:
+        results = count_results(poll)
+        try:
+            with transaction.atomic():
+                PollResultSnapshot.objects.create(poll=poll, data=json.dumps(results))
+        except IntegrityError:
+            # Another request saved the snapshot first
+            pass
+        return results
+    # JSON object keys are strings
+    return {int(question_id): value for question_id, value in json.loads(snapshot.data).items()}
+
+
+def tally():
+    return {"all": 0, "male": 0, "female": 0}
+
+
+def fmt(num):
+    return round(num, 2)
+
+
+def perc(num, den):
+    if den == 0:
+        return 0
+    return int(10000 * num / den) / 100
+
+
+def build_question_results(question, counted, choices, do_gender=True, answers=None):
+    """Return the rows of the results table of a choice question.
+
+    Args:
+        counted: The results of the question from :func:`count_results`.
+        choices: The choices of the question, in order.
+        answers: The question's Answers (with their users), to list who
+            chose each choice, or None.
+
+    """
+    split = question.type == Question.SPLIT_APP
+
+    by_choice = defaultdict(lambda: defaultdict(tally))
+    votes_all = 0
+    for choice_id, clear_vote, grade, sex, num_answers, weight in counted["choices"]:
+        key = "clear" if clear_vote else choice_id
+        # Split approval votes are weighted by each user's share of their vote
+        amount = weight if split else num_answers
+        votes_all += num_answers
+        for group in ("total", grade):
+            counts = by_choice[key][group]
+            counts["all"] += num_answers
+            if sex == "m":
+                counts["male"] += amount
+            elif sex == "f":
+                counts["female"] += amount
+
+    voters = defaultdict(tally)
+    for grade, sex, num_users in counted["voters"]:
+        for group in ("total", grade):
+            voters[group]["all"] += num_users
+            if sex == "m":
+                voters[group]["male"] += num_users
+            elif sex == "f":
+                voters[group]["female"] += num_users
+    users_all = voters["total"]["all"]
+
+    users = defaultdict(list)
+    user_scale = {}
+    for answer in answers or []:
+        users["clear" if answer.clear_vote else answer.choice_id].append(answer.user)
+        user_scale[answer.user_id] = float(answer.weight)
+
+    def row(label, counts, denominator, users=None):
+        votes = {group: counts[group] for group in ["total"] + list(GRADES)}
+        votes["total"]["all_percent"] = perc(votes["total"]["all"], denominator)
+        for group in votes.values():
+            if not do_gender:
+                group["male"] = group["female"] = 0
+            elif split:
+                group["male"], group["female"] = fmt(group["male"]), fmt(group["female"])
+        return {"choice": label, "votes": votes, "users": users or []}
+
+    denominator = users_all if split else votes_all
+    rows = [row(choice, by_choice[choice.id], denominator, users[choice.id]) for choice in choices]
+    rows.append(row("Clear vote", by_choice["clear"], denominator, users["clear"]))
+
+    total = row("Total", voters, users_all)
+    if split:
+        total["votes"]["total"]["votes_all"] = votes_all
+    else:
+        total["votes"]["total"]["all"] = votes_all
+        total["votes"]["total"]["users_all"] = users_all
+        total["votes"]["total"]["all_percent"] = perc(votes_all, users_all)
+    rows.append(total)
+
+    result = {"question": question, "choices": rows}
+    if split:
+        result["user_scale"] = user_scale
+    return result
+
+
+def get_results_context(poll, do_gender=True, show_answers=False):
+    """Return the results of every question of ``poll``, in the form used by the results
+    template."""
+    counted = get_poll_results(poll)
+
+    choices = defaultdict(list)
+    for choice in Choice.objects.filter(question__poll=poll).order_by("num"):
+        choices[choice.question_id].append(choice)
+
+    answers = defaultdict(list)
+    if show_answers:
+        for answer in Answer.objects.filter(question__poll=poll).select_related("user").order_by("id"):
+            answers[answer.question_id].append(answer)
+
+    questions = []
+    for q in poll.question_set.all():
+        if q.is_choice():
+            empty = {"choices": [], "voters": []}
+            questions.append(build_question_results(q, counted.get(q.id, empty), choices[q.id], do_gender, answers[q.id]))
+        elif q.is_writing():
+            questions.append({"question": q, "answers": answers[q.id]})
+    return questions
+
+
+def invalidate_question(question_id):
+    """Forget the counted results of a question, e.g. after a vote."""
+    cache.delete(question_cache_key(question_id))
+    PollResultSnapshot.objects.filter(poll__question=question_id).delete()
+
+
+def answer_changed(sender, instance, **kwargs):
+    invalidate_question(instance.question_id)
+
+
+def poll_changed(sender, instance, **kwargs):
+    PollResultSnapshot.objects.filter(poll=instance).delete()
+
+
+def connect_signals():
+    post_save.connect(answer_changed, sender=Answer, dispatch_uid="poll_results_answer_save")
+    post_delete.connect(answer_changed, sender=Answer, dispatch_uid="poll_results_answer_delete")
+    post_save.connect(poll_changed, sender=Poll, dispatch_uid="poll_results_poll_save")
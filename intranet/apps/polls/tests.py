@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Answer, Choice, Poll, PollResultSnapshot, Question
+from .results import get_poll_results, get_results_context
+from ..users.models import User
+from ...test.ion_test import IonTestCase
+
+
+class PollResultsTest(IonTestCase):
+    """Tests for counting poll results."""
+
+    def make_poll(self, end_time):
+        poll = Poll.objects.create(title="Test poll", description="", start_time=timezone.now() - timedelta(days=1), end_time=end_time)
+        question = Question.objects.create(poll=poll, question="Which?", num=1, type=Question.SPLIT_APP, max_choices=2)
+        choices = [Choice.objects.create(question=question, num=i, info="Choice {}".format(i)) for i in range(1, 4)]
+        return poll, question, choices
+
+    def test_split_approval_results(self):
+        poll, question, choices = self.make_poll(timezone.now() + timedelta(days=1))
+        users = [User.objects.get_or_create(username="polluser{}".format(i))[0] for i in range(3)]
+
+        for user, chosen, grade, sex in [(users[0], choices[:2], 9, "m"), (users[1], choices[:1], 9, "f"), (users[2], choices[1:2], 13, "")]:
+            for choice in chosen:
+                Answer.objects.create(user=user, question=question, choice=choice, voter_grade=grade, voter_sex=sex)
+            Answer.objects.set_split_weights(user, question)
+
+        rows = get_results_context(poll)[0]["choices"]
+        self.assertEqual([row["choice"] for row in rows], choices + ["Clear vote", "Total"])
+        self.assertEqual(rows[0]["votes"]["total"], {"all": 2, "all_percent": 66.66, "male": 0.5, "female": 1})
+        self.assertEqual(rows[0]["votes"][9], {"all": 2, "male": 0.5, "female": 1})
+        self.assertEqual(rows[1]["votes"][13]["all"], 1)
+        self.assertEqual(rows[-1]["votes"]["total"]["all"], 3)
+        self.assertEqual(rows[-1]["votes"]["total"]["votes_all"], 4)
+
+        # A vote only recounts its question
+        Answer.objects.create(user=users[2], question=question, choice=choices[2], voter_grade=13, voter_sex="")
+        rows = get_results_context(poll)[0]["choices"]
+        self.assertEqual(rows[2]["votes"]["total"]["all"], 1)
+
+    def test_closed_poll_snapshot(self):
+        poll, question, choices = self.make_poll(timezone.now() - timedelta(hours=1))
+        user = User.objects.get_or_create(username="polluser")[0]
+        Answer.objects.create(user=user, question=question, choice=choices[0], voter_grade=10, voter_sex="f")
+
+        results = get_poll_results(poll)
+        self.assertTrue(PollResultSnapshot.objects.filter(poll=poll).exists())
+        self.assertEqual(get_poll_results(poll), results)
+
+        Answer.objects.create(user=user, question=question, choice=choices[1], voter_grade=10, voter_sex="f")
+        self.assertFalse(PollResultSnapshot.objects.filter(poll=poll).exists())
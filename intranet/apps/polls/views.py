@@ -9,6 +9,7 @@ from django.shortcuts import redirect, render
 from django.utils import timezone
 
 from .models import Answer, Choice, Poll, Question
+from .results import get_results_context, invalidate_question, voter_snapshot
 from ..users.models import User
 
 logger = logging.getLogger(__name__)
@@ -52,6 +53,7 @@ def poll_vote_view(request, poll_id):
     if request.method == "POST":
         questions = poll.question_set.all()
         entries = request.POST
+        voter = voter_snapshot(user)
         for name in entries:
             if name.startswith("question-"):
                 logger.debug(name)
@@ -73,7 +75,7 @@ def poll_vote_view(request, poll_id):
                     if question_obj.is_single_choice():
                         if choice_num and choice_num == "CLEAR":
                             Answer.objects.filter(user=user, question=question_obj).delete()
-                            Answer.objects.create(user=user, question=question_obj, clear_vote=True)
+                            Answer.objects.create(user=user, question=question_obj, clear_vote=True, **voter)
                             messages.success(request, "Clear Vote for {}".format(question_obj))
                         else:
                             try:
@@ -84,14 +86,14 @@ def poll_vote_view(request, poll_id):
                             else:
                                 logger.debug(choice_obj)
                                 Answer.objects.filter(user=user, question=question_obj).delete()
-                                Answer.objects.create(user=user, question=question_obj, choice=choice_obj)
+                                Answer.objects.create(user=user, question=question_obj, choice=choice_obj, **voter)
                                 messages.success(request, "Voted for {} on {}".format(choice_obj, question_obj))
                     elif question_obj.is_many_choice():
                         total_choices = request.POST.getlist(name)
                         logger.debug("total choices: {}".format(total_choices))
                         if len(total_choices) == 1 and total_choices[0] == "CLEAR":
                             Answer.objects.filter(user=user, question=question_obj).delete()
-                            Answer.objects.create(user=user, question=question_obj, clear_vote=True)
+                            Answer.objects.create(user=user, question=question_obj, clear_vote=True, **voter)
                             messages.success(request, "Clear Vote for {}".format(question_obj))
                         else:
                             current_choices = Answer.objects.filter(user=user, question=question_obj)
@@ -114,15 +116,18 @@ def poll_vote_view(request, poll_id):
                                 else:
                                     if (current_choices.count() + 1) <= question_obj.max_choices:
                                         Answer.objects.filter(user=user, question=question_obj, clear_vote=True).delete()
-                                        Answer.objects.get_or_create(user=user, question=question_obj, choice=choice_obj)
+                                        Answer.objects.get_or_create(user=user, question=question_obj, choice=choice_obj, defaults=voter)
                                         messages.success(request, "Voted for {} on {}".format(choice_obj, question_obj))
                                     else:
                                         messages.error(request, "You have voted on too many options for {}".format(question_obj))
                                         current_choices.delete()
+                            if question_obj.type == Question.SPLIT_APP:
+                                Answer.objects.set_split_weights(user, question_obj)
+                                invalidate_question(question_obj.id)
 
                 elif question_obj.is_writing():
                     Answer.objects.filter(user=user, question=question_obj).delete()
-                    Answer.objects.create(user=user, question=question_obj, answer=choice_num)
+                    Answer.objects.create(user=user, question=question_obj, answer=choice_num, **voter)
                     messages.success(request, "Answer saved for {}".format(question_obj))
 
     questions = []
@@ -158,169 +163,6 @@ def poll_vote_view(request, poll_id):
     return render(request, "polls/vote.html", context)
 
 
-def fmt(num):
-    return int(100 * num) / 100
-
-
-def perc(num, den):
-    if den == 0:
-        return 0
-    return int(10000 * num / den) / 100
-
-
-def handle_sap(q):
-    question_votes = votes = Answer.objects.filter(question=q)
-    users = q.get_users_voted()
-    num_users_votes = {u.id: votes.filter(user=u).count() for u in users}
-    user_scale = {u.id: (1 / num_users_votes[u.id]) for u in users}
-    choices = []
-    for c in q.choice_set.all().order_by("num"):
-        votes = question_votes.filter(choice=c)
-        vote_users = set([v.user for v in votes])
-        choice = {
-            "choice": c,
-            "votes": {
-                "total": {
-                    "all": len(vote_users),
-                    "all_percent": perc(
-                        len(vote_users), users.count()),
-                    "male": fmt(sum([v.user.is_male * user_scale[v.user.id] for v in votes])),
-                    "female": fmt(sum([v.user.is_female * user_scale[v.user.id] for v in votes]))
-                }
-            },
-            "users": [v.user for v in votes]
-        }
-        for yr in range(9, 14):
-            yr_votes = [v.user if v.user.grade and v.user.grade.number == yr else None for v in votes]
-            yr_votes = list(filter(None, yr_votes))
-            choice["votes"][yr] = {
-                "all": len(set(yr_votes)),
-                "male": fmt(sum([u.is_male * user_scale[u.id] for u in yr_votes])),
-                "female": fmt(sum([u.is_female * user_scale[u.id] for u in yr_votes])),
-            }
-    """ Clear vote """
-    votes = question_votes.filter(clear_vote=True)
-    clr_users = set([v.user for v in votes])
-    choice = {
-        "choice": "Clear vote",
-        "votes": {
-            "total": {
-                "all": len(clr_users),
-                "all_percent": perc(
-                    len(clr_users), users.count()),
-                "male": fmt(sum([v.user.is_male * user_scale[v.user.id] for v in votes])),
-                "female": fmt(sum([v.user.is_female * user_scale[v.user.id] for v in votes]))
-            }
-        },
-        "users": clr_users
-    }
-    for yr in range(9, 14):
-        yr_votes = [v.user if v.user.grade and v.user.grade.number == yr else None for v in votes]
-        yr_votes = list(filter(None, yr_votes))
-        choice["votes"][yr] = {"all": len(yr_votes),
-                               "male": fmt(sum([u.is_male * user_scale[u.id] for u in yr_votes])),
-                               "female": fmt(sum([u.is_female * user_scale[u.id] for u in yr_votes]))}
-
-    choice = {
-        "choice": "Total",
-        "votes": {
-            "total": {
-                "all": users.count(),
-                "votes_all": question_votes.count(),
-                "all_percent": perc(users.count(), users.count()),
-                "male": sum([u.is_male for u in users]),
-                "female": sum([u.is_female for u in users]),
-            }
-        }
-    }
-    for yr in range(9, 14):
-        yr_votes = [u if u.grade and u.grade.number == yr else None for u in users]
-        yr_votes = list(filter(None, yr_votes))
-        choice["votes"][yr] = {
-            "all": len(set(yr_votes)),
-            "male": fmt(sum([u.is_male * user_scale[u.id] for u in yr_votes])),
-            "female": fmt(sum([u.is_female * user_scale[u.id] for u in yr_votes]))
-        }
-
-    choices.append(choice)
-
-    return {"question": q, "choices": choices, "user_scale": user_scale}
-
-
-def handle_choice(q, do_gender=True):
-    question_votes = votes = Answer.objects.filter(question=q)
-    users = q.get_users_voted()
-    choices = []
-    for c in q.choice_set.all().order_by("num"):
-        votes = question_votes.filter(choice=c)
-        choice = {
-            "choice": c,
-            "votes": {
-                "total": {
-                    "all": votes.count(),
-                    "all_percent": perc(votes.count(), question_votes.count()),
-                    "male": sum([v.user.is_male for v in votes]) if do_gender else 0,
-                    "female": sum([v.user.is_female for v in votes]) if do_gender else 0
-                }
-            },
-            "users": [v.user for v in votes]
-        }
-
-        for yr in range(9, 14):
-            yr_votes = [v.user if v.user.grade and v.user.grade.number == yr else None for v in votes]
-            yr_votes = list(filter(None, yr_votes))
-            choice["votes"][yr] = {"all": len(yr_votes),
-                                   "male": sum([u.is_male for u in yr_votes]) if do_gender else 0,
-                                   "female": sum([u.is_female for u in yr_votes]) if do_gender else 0}
-        choices.append(choice)
-
-    """ Clear vote """
-    votes = question_votes.filter(clear_vote=True)
-    choice = {
-        "choice": "Clear vote",
-        "votes": {
-            "total": {
-                "all": votes.count(),
-                "all_percent": perc(votes.count(), question_votes.count()),
-                "male": sum([v.user.is_male for v in votes]) if do_gender else 0,
-                "female": sum([v.user.is_female for v in votes]) if do_gender else 0
-            }
-        },
-        "users": [v.user for v in votes]
-    }
-
-    for yr in range(9, 14):
-        yr_votes = [v.user if v.user.grade and v.user.grade.number == yr else None for v in votes]
-        yr_votes = list(filter(None, yr_votes))
-        choice["votes"][yr] = {"all": len(yr_votes),
-                               "male": sum([u.is_male for u in yr_votes]) if do_gender else 0,
-                               "female": sum([u.is_female for u in yr_votes]) if do_gender else 0}
-
-    choices.append(choice)
-    choice = {
-        "choice": "Total",
-        "votes": {
-            "total": {
-                "all": question_votes.count(),
-                "users_all": users.count(),
-                "all_percent": perc(question_votes.count(), users.count()),
-                "male": sum([u.is_male for u in users]) if do_gender else 0,
-                "female": sum([u.is_female for u in users]) if do_gender else 0,
-            }
-        }
-    }
-    for yr in range(9, 14):
-        yr_votes = [u if u.grade and u.grade.number == yr else None for u in users]
-        yr_votes = list(filter(None, yr_votes))
-        choice["votes"][yr] = {"all": len(yr_votes),
-                               "male": sum([u.is_male for u in yr_votes]) if do_gender else 0,
-                               "female": sum([u.is_female for u in yr_votes]) if do_gender else 0}
-
-    choices.append(choice)
-
-    return {"question": q, "choices": choices}
-
-
 @login_required
 def poll_results_view(request, poll_id):
     if not request.user.has_admin_permission("polls"):
@@ -332,18 +174,10 @@ def poll_results_view(request, poll_id):
     except Poll.DoesNotExist:
         raise http.Http404
 
-    questions = []
-    for q in poll.question_set.all():
-        if q.type == "SAP":  # Split-approval; each person splits their one vote
-            questions.append(handle_sap(q))
-        elif q.is_choice():
-            questions.append(handle_choice(q, do_gender))
-        elif q.is_writing():
-            answers = Answer.objects.filter(question=q)
-            question = {"question": q, "answers": answers}
-            questions.append(question)
-
-    context = {"poll": poll, "grades": range(9, 13), "questions": questions, "show_answers": request.GET.get("show_answers", False), "do_gender": do_gender}
+    show_answers = request.GET.get("show_answers", False)
+    questions = get_results_context(poll, do_gender, bool(show_answers))
+
+    context = {"poll": poll, "grades": range(9, 13), "questions": questions, "show_answers": show_answers, "do_gender": do_gender}
     return render(request, "polls/results.html", context)
 
 
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import json
+from datetime import date
 
 from django.core.management.base import BaseCommand
 
-from intranet.apps.notifications.views import gcm_post, get_gcm_schedule_uids
+from intranet.apps.notifications.jobs import enqueue
+from intranet.apps.notifications.views import get_gcm_schedule_uids, send_gcm_post
 from intranet.apps.schedule.notifications import period_start_end_data
 from intranet.apps.users.models import User
 
@@ -15,9 +18,12 @@ class Command(BaseCommand):
         parser.add_argument('--notify', action='store_true', dest='notify', default=False, help='notify')
 
     def do_notify(self, pd_data):
-        users = get_gcm_schedule_uids()
+        users = list(get_gcm_schedule_uids())
         user = User.objects.get(id=9999)
-        post, reqtext = gcm_post(users, pd_data, user=user)
+        # Don't send the same period notification twice if cron runs this again
+        digest = hashlib.sha1(json.dumps(pd_data, sort_keys=True).encode()).hexdigest()
+        key = "schedule-notify-{}-{}".format(date.today(), digest)
+        enqueue(send_gcm_post, users, pd_data, user.id, idempotency_key=key, user=user)
 
     def handle(self, *args, **options):
 
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from django.apps import AppConfig
+
+
+class SearchConfig(AppConfig):
+    name = "intranet.apps.search"
+
+    def ready(self):
+        from .signals import connect_signals
+        connect_signals()
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from fnmatch import translate
+
+from django.conf import settings
+
+from ..users.models import Grade, UserDirectoryEntry
+
+logger = logging.getLogger(__name__)
+
+# Mirror fields loaded into the index, in the order of each row
+FIELDS = ("id", "username", "first_name", "middle_name", "last_name", "nickname", "graduation_year", "sex", "user_type")
+
+NUMERIC_FIELDS = ("id", "graduation_year")
+
+# Fields matched by words without a key, as with the givenName/sn/iodineUid/nickname LDAP search
+NAME_FIELDS = ("first_name", "last_name", "username", "nickname")
+
+# A mapping between search keys and index fields. Keys that the index has
+# no data for (e.g. "city" or "phone") make the query fall back to LDAP.
+MAP_FIELDS = {
+    "firstname": ("first_name", "nickname"),
+    "first": ("first_name", "nickname"),
+    "lastname": ("last_name",),
+    "last": ("last_name",),
+    "nick": ("nickname",),
+    "nickname": ("nickname",),
+    "name": ("last_name", "middle_name", "first_name", "nickname"),
+    "middlename": ("middle_name",),
+    "middle": ("middle_name",),
+    "grade": ("graduation_year",),
+    "gradyear": ("graduation_year",),
+    "sex": ("sex",),
+    "gender": ("sex",),
+    "id": ("id",),
+    "username": ("username",),
+    "type": ("user_type",)
+}
+
+LDAP_ONLY_KEYS = ("city", "town", "phone", "homephone", "cell", "address", "zip", "email", "studentid", "counselor")
+
+# Scores of the ways a word can match a field, used to rank results
+EXACT = 3
+PREFIX = 2
+SUFFIX = 1
+
+
+class UserSearchIndex(object):
+    """An in-memory index of the students and teachers in the directory mirror, answering the
+    same queries as the LDAP user search.
+
+    Each field is kept as sorted lists of (value, id) and (reversed value,
+    id) pairs, so exact, prefix ("term*") and suffix ("*term") matches are
+    binary searches. Matching is case insensitive, like LDAP.
+
+    """
+
+    def __init__(self, rows, version=None):
+        """
+        Args:
+            rows: Tuples of the values of FIELDS for each user.
+            version: The UserDirectoryEntry.objects.version() the rows were
+                loaded at.
+
+        """
+        self.version = version
+        self.built_time = time.time()
+        self.rows = {}
+        self.values = {field: {} for field in FIELDS}
+        for row in rows:
+            self.rows[row[0]] = row
+            for field, value in zip(FIELDS, row):
+                if value is not None and value != "":
+                    self.values[field][row[0]] = value if field in NUMERIC_FIELDS else value.lower()
+
+        self.forward = {}
+        self.backward = {}
+        for field in FIELDS:
+            if field not in NUMERIC_FIELDS:
+                self.forward[field] = sorted((value, uid) for uid, value in self.values[field].items())
+                self.backward[field] = sorted((value[::-1], uid) for uid, value in self.values[field].items())
+
+    @classmethod
+    def build(cls):
+        """Load the index from the directory mirror."""
+        version = UserDirectoryEntry.objects.version()
+        entries = UserDirectoryEntry.objects.filter(user_type__in=[settings.LDAP_OBJECT_CLASSES["student"], settings.LDAP_OBJECT_CLASSES[
+            "teacher"]]).values_list("user_id", "ion_username", *FIELDS[2:])
+        return cls(entries, version)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _starting_with(self, pairs, prefix):
+        i = bisect_left(pairs, (prefix,))
+        while i < len(pairs) and pairs[i][0].startswith(prefix):
+            yield pairs[i][1]
+            i += 1
+
+    def match(self, field, op, value):
+        """Return the set of ids whose ``field`` matches ``value``.
+
+        ``op`` is one of "=", "<=", ">=", "prefix" or "suffix"; "*" in
+        ``value`` is a wildcard for "=".
+
+        """
+        if field in NUMERIC_FIELDS:
+            if "*" in value:
+                pattern = re.compile(translate(value))
+                return {uid for uid, v in self.values[field].items() if pattern.match(str(v))}
+            try:
+                value = int(value)
+            except ValueError:
+                return set()
+        else:
+            value = value.lower()
+
+        if op == "<=":
+            return {uid for uid, v in self.values[field].items() if v <= value}
+        elif op == ">=":
+            return {uid for uid, v in self.values[field].items() if v >= value}
+        elif field in NUMERIC_FIELDS:
+            return {uid for uid, v in self.values[field].items() if v == value}
+
+        if "*" in value:
+            if op == "prefix":
+                value += "*"
+            elif op == "suffix":
+                value = "*" + value
+            pattern = re.compile(translate(value))
+            return {uid for uid, v in self.values[field].items() if pattern.match(v)}
+
+        if op == "prefix":
+            return set(self._starting_with(self.forward[field], value))
+        elif op == "suffix":
+            return set(self._starting_with(self.backward[field], value[::-1]))
+        return {uid for uid in self._starting_with(self.forward[field], value) if self.values[field][uid] == value}
+
+    def match_word(self, word, admin=False):
+        """Match a word without a key against the name fields (and the middle name for admins).
+
+        Returns:
+            A dict mapping ids to the score of their best match.
+
+        """
+        fields = NAME_FIELDS + (("middle_name",) if admin else ())
+        exact = False
+        if word.startswith('"') and word.endswith('"') and len(word) >= 2:
+            exact = True
+            word = word[1:-1]
+        else:
+            # Wildcards are already implied at the start and end
+            if word.endswith("*"):
+                word = word[:-1]
+            if word.startswith("*"):
+                word = word[1:]
+
+        if not word:
+            return None
+
+        scores = {}
+        for field in fields:
+            if exact:
+                matches = ((self.match(field, "=", word), EXACT),)
+            else:
+                matches = ((self.match(field, "=", word), EXACT), (self.match(field, "prefix", word), PREFIX),
+                           (self.match(field, "suffix", word), SUFFIX))
+            for ids, score in matches:
+                for uid in ids:
+                    if scores.get(uid, 0) < score:
+                        scores[uid] = score
+        return scores
+
+    def match_keyed(self, part):
+        """Match a "key:value" (or key=value, key<value, key>value) part of an advanced query.
+
+        Returns:
+            A dict mapping ids to a score, None if the key should be
+            ignored, or False if the index can't answer it.
+
+        """
+        sep = "="
+        if ":" in part:
+            cat, val = part.split(":")
+        elif "=" in part:
+            cat, val = part.split("=")
+        elif "<" in part:
+            cat, val = part.split("<")
+            sep = "<="
+        else:
+            cat, val = part.split(">")
+            sep = ">="
+
+        if val.startswith('"') and val.endswith('"'):
+            # Already exact
+            val = val[1:-1]
+
+        cat = cat.lower()
+        val = val.lower()
+
+        # fix grade, because only the graduation year is stored
+        if cat == "grade" and val.isdigit():
+            val = "{}".format(Grade.year_from_grade(int(val)))
+        elif cat == "grade" and val == "staff":
+            cat = "type"
+            val = "teacher"
+        elif cat == "grade" and val == "student":
+            cat = "type"
+            val = "student"
+
+        if cat == "type" and val == "teacher":
+            val = settings.LDAP_OBJECT_CLASSES["teacher"]
+        elif cat == "type" and val == "student":
+            val = settings.LDAP_OBJECT_CLASSES["student"]
+
+        # replace sex:male with sex:m and sex:female with sex:f
+        if cat == "sex" or cat == "gender":
+            val = val[:1]
+
+        if cat in LDAP_ONLY_KEYS:
+            return False
+
+        # if an invalid key, ignore
+        if cat not in MAP_FIELDS:
+            return None
+
+        ids = set()
+        for field in MAP_FIELDS[cat]:
+            ids |= self.match(field, sep, val)
+        return {uid: EXACT for uid in ids}
+
+    def search(self, q, admin=False):
+        """Search for users.
+
+        Supports the same syntax as the LDAP search: space separated words
+        that must all match a name, and "key:value" parts.
+
+        Returns:
+            A list of ids, best matches first, or None if the query uses
+            keys that the index has no data for.
+
+        """
+        scores = None
+        for part in q.split(" "):
+            if any(sep in part for sep in ":=<>"):
+                part_scores = self.match_keyed(part)
+                if part_scores is False:
+                    return None
+            else:
+                part_scores = self.match_word(part, admin)
+
+            if part_scores is None:
+                continue
+            if scores is None:
+                scores = part_scores
+            else:
+                scores = {uid: score + part_scores[uid] for uid, score in scores.items() if uid in part_scores}
+
+        if scores is None:
+            # Nothing to search for
+            return []
+
+        def rank(uid):
+            row = self.rows[uid]
+            return (-scores[uid], row[4] or "", row[2] or "", uid)
+
+        return sorted(scores, key=rank)
+
+    def describe(self, uid):
+        """Return the indexed attributes of a user as a dict, e.g. for typeahead results."""
+        return dict(zip(FIELDS, self.rows[uid]))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_user_search_index():
+    """Return the user search index of this process, rebuilding it if the directory mirror has
+    been synced since it was built, or if it is older than USER_SEARCH_INDEX_MAX_AGE."""
+    global _index
+
+    index = _index
+    if index is not None:
+        fresh = time.time() - index.built_time < settings.USER_SEARCH_INDEX_MAX_AGE
+        if fresh and index.version == UserDirectoryEntry.objects.version():
+            return index
+
+    with _index_lock:
+        if _index is index:
+            start = time.time()
+            _index = UserSearchIndex.build()
+            logger.info("Built user search index of {} users in {:.1f} ms".format(len(_index), (time.time() - start) * 1000))
+        return _index
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from intranet.apps.search.models import SearchDocument
+
+
+class Command(BaseCommand):
+    help = "Recreate the full-text search documents of all activities, announcements and events."
+
+    def handle(self, *args, **options):
+        created = SearchDocument.objects.rebuild()
+        self.stdout.write("Indexed {} documents.".format(created))
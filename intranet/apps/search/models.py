@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models, transaction
+from django.utils.html import strip_tags
+
+from .utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+def get_searchable_models():
+    """Return a dict mapping each searchable model to a function returning the (title, body) of an
+    instance."""
+    from ..announcements.models import Announcement
+    from ..eighth.models import EighthActivity
+    from ..events.models import Event
+
+    return {
+        EighthActivity: lambda a: (a.name, a.description),
+        Announcement: lambda a: (strip_tags(a.title), strip_tags(a.content)),
+        Event: lambda e: (strip_tags(e.title), strip_tags(e.description))
+    }
+
+
+class SimpleSearchBackend(object):
+    """Matches every search term against the title and body with LIKE, ranking title matches
+    higher.
+
+    Used with databases that have no full-text search support (e.g.
+    SQLite in tests).
+
+    """
+
+    def filter(self, queryset, terms):
+        table = SearchDocument._meta.db_table
+        where = []
+        params = []
+        rank = []
+        rank_params = []
+        for term in terms:
+            pattern = "%{}%".format(term.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"))
+            where.append("(LOWER({0}.title) LIKE %s ESCAPE '\\' OR LOWER({0}.body) LIKE %s ESCAPE '\\')".format(table))
+            params += [pattern, pattern]
+            rank.append("(CASE WHEN LOWER({}.title) LIKE %s ESCAPE '\\' THEN 2 ELSE 1 END)".format(table))
+            rank_params.append(pattern)
+        return where, params, " + ".join(rank), rank_params
+
+
+class PostgresSearchBackend(object):
+    """Matches a prefix tsquery of the search terms against the GIN-indexed tsvector column of
+    the search documents, ranked with ts_rank."""
+
+    def filter(self, queryset, terms):
+        table = SearchDocument._meta.db_table
+        words = [word for term in terms for word in re.split(r"\W+", term) if word]
+        tsquery = " & ".join("{}:*".format(word) for word in words)
+        where = ["{}.search_vector @@ to_tsquery('english', %s)".format(table)]
+        rank = "ts_rank({}.search_vector, to_tsquery('english', %s))".format(table)
+        return where, [tsquery], rank, [tsquery]
+
+
+def get_search_backend():
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    return SimpleSearchBackend()
+
+
+class SearchDocumentManager(models.Manager):
+
+    def search(self, queryset, q):
+        """Filter ``queryset`` to the objects whose search documents match the search query ``q``,
+        ordered by rank (best first).
+
+        This is one query; any other filters on ``queryset`` (e.g. "this
+        year" predicates) are applied in the same query.
+
+        """
+        terms = [term for term in normalize_query(q) if re.search(r"\w", term)]
+        if not terms:
+            return queryset.none()
+
+        table = SearchDocument._meta.db_table
+        model_table = queryset.model._meta.db_table
+        content_type = ContentType.objects.get_for_model(queryset.model)
+        where, params, rank, rank_params = get_search_backend().filter(queryset, terms)
+
+        where = ["{}.content_type_id = %s".format(table), "{}.object_id = {}.id".format(table, model_table)] + where
+        params = [content_type.id] + params
+
+        return queryset.extra(tables=[table], where=where, params=params, select={"search_rank": rank}, select_params=rank_params,
+                              order_by=["-search_rank", "-{}.id".format(model_table)])
+
+    def update_for(self, obj):
+        """Create or update the search document of ``obj``."""
+        title, body = get_searchable_models()[type(obj)](obj)
+        content_type = ContentType.objects.get_for_model(obj)
+        with transaction.atomic():
+            document, _ = self.update_or_create(content_type=content_type, object_id=obj.id, defaults={"title": title or "", "body": body or ""})
+            self.update_vectors([document.id])
+        return document
+
+    def remove_for(self, obj):
+        """Delete the search document of ``obj``."""
+        self.filter(content_type=ContentType.objects.get_for_model(obj), object_id=obj.id).delete()
+
+    def update_vectors(self, ids=None):
+        """Recompute the tsvector column of the documents with the given ids, or of every
+        document (PostgreSQL only)."""
+        if connection.vendor != "postgresql":
+            return
+        sql = ("UPDATE {} SET search_vector = setweight(to_tsvector('english', title), 'A') || "
+               "setweight(to_tsvector('english', body), 'B')").format(SearchDocument._meta.db_table)
+        params = []
+        if ids is not None:
+            sql += " WHERE id IN %s"
+            params.append(tuple(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def rebuild(self):
+        """Delete and recreate the search documents of every searchable object.
+
+        Returns:
+            The number of documents created.
+
+        """
+        created = 0
+        with transaction.atomic():
+            self.all().delete()
+            for model, get_text in get_searchable_models().items():
+                content_type = ContentType.objects.get_for_model(model)
+                documents = []
+                for obj in model.objects.all().iterator():
+                    title, body = get_text(obj)
+                    documents.append(SearchDocument(content_type=content_type, object_id=obj.id, title=title or "", body=body or ""))
+                self.bulk_create(documents, batch_size=500)
+                created += len(documents)
+            self.update_vectors()
+        return created
+
+
+class SearchDocument(models.Model):
+    """The searchable text of an activity, announcement or event.
+
+    Documents are kept current by the signal handlers in
+    :mod:`intranet.apps.search.signals`, and can be recreated with the
+    ``rebuild_search_index`` management command. On PostgreSQL, a
+    GIN-indexed ``search_vector`` tsvector column (added by a migration,
+    since Django has no field for it) holds the weighted title and body.
+
+    """
+
+    objects = SearchDocumentManager()
+
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    title = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = (("content_type", "object_id"),)
+
+    def __str__(self):
+        return "{} {}: {}".format(self.content_type, self.object_id, self.title)
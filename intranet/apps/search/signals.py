@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+from django.db.models.signals import post_delete, post_save
+
+from .models import SearchDocument, get_searchable_models
+
+
+def update_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        SearchDocument.objects.update_for(instance)
+
+
+def remove_search_document(sender, instance, **kwargs):
+    SearchDocument.objects.remove_for(instance)
+
+
+def connect_signals():
+    """Keep the search documents of every searchable model current."""
+    for model in get_searchable_models():
+        post_save.connect(update_search_document, sender=model, dispatch_uid="update_search_document_{}".format(model.__name__))
+        post_delete.connect(remove_search_document, sender=model, dispatch_uid="remove_search_document_{}".format(model.__name__))
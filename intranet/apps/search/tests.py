@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from .index import UserSearchIndex
+from .models import SearchDocument
+from .views import do_activities_search, do_announcements_search
+from ..announcements.models import Announcement
+from ..eighth.models import EighthActivity, EighthBlock, EighthScheduledActivity
+from ..users.models import Grade
+from ...test.ion_test import IonTestCase
+
+
+class UserSearchIndexTest(IonTestCase):
+    """Tests for the local user search index."""
+
+    def setUp(self):
+        year = Grade.year_from_grade(12)
+        self.index = UserSearchIndex([
+            (1, "awilliam", "Angela", "Marie", "William", "", year, "F", "tjhsstStudent"),
+            (2, "2016jwilliam", "John", "", "Williamson", "Jack", year - 1, "M", "tjhsstStudent"),
+            (3, "twilliam", "Tom", "", "Bill", "Will", None, "M", "tjhsstTeacher"),
+        ])
+
+    def test_simple_search(self):
+        self.assertEqual(self.index.search("william"), [1, 2, 3])
+        self.assertEqual(self.index.search("*liam"), [3, 1, 2])
+        self.assertEqual(self.index.search('"william"'), [1])
+        self.assertEqual(self.index.search("will jo"), [2])
+        self.assertEqual(self.index.search("marie"), [])
+        self.assertEqual(self.index.search("marie", admin=True), [1])
+
+    def test_advanced_search(self):
+        self.assertEqual(self.index.search("grade:12"), [1])
+        self.assertEqual(self.index.search("firstname:jack"), [2])
+        self.assertEqual(self.index.search("type:teacher"), [3])
+        self.assertEqual(self.index.search("sex:male william"), [2, 3])
+        self.assertEqual(self.index.search("id>3"), [3])
+        self.assertIsNone(self.index.search("city:alexandria"))
+        with self.assertRaises(ValueError):
+            self.index.search("a:b:c")
+
+
+class FullTextSearchTest(IonTestCase):
+    """Tests for searching activities, announcements and events."""
+
+    def test_search_ranking(self):
+        act1 = EighthActivity.objects.create(name="Chess Club", description="Play board games")
+        act2 = EighthActivity.objects.create(name="Board Games", description="Chess, checkers and more")
+        act3 = EighthActivity.objects.create(name="Old Chess", description="Not scheduled this year")
+        block = EighthBlock.objects.create(date=datetime.date.today(), block_letter="A")
+        EighthScheduledActivity.objects.create(activity=act1, block=block)
+        EighthScheduledActivity.objects.create(activity=act2, block=block)
+
+        self.assertEqual(list(do_activities_search("chess")), [act1, act2])
+        self.assertEqual(list(do_activities_search("board chess")), [act2, act1])
+        self.assertEqual(list(do_activities_search("\"checkers and\"")), [act2])
+        self.assertEqual(list(do_activities_search("%")), [])
+        # Activities that are indexed but not scheduled this year are left out
+        self.assertEqual(list(SearchDocument.objects.search(EighthActivity.objects.all(), "old")), [act3])
+        self.assertEqual(list(do_activities_search("old")), [])
+
+        act2.name = "Games"
+        act2.save()
+        self.assertEqual(list(do_activities_search("board")), [act1])
+        self.assertEqual(list(do_activities_search("games")), [act2, act1])
+        act1.delete()
+        self.assertEqual(list(do_activities_search("games")), [act2])
+
+        announcement = Announcement.objects.create(title="Chess tournament", content="<p>Sign up today</p>")
+        self.assertEqual(list(do_announcements_search("tournament")), [announcement])
+
+        SearchDocument.objects.all().delete()
+        self.assertEqual(SearchDocument.objects.rebuild(), 3)
+        self.assertEqual(list(do_activities_search("chess")), [act2])
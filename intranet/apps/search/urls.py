@@ -4,4 +4,4 @@ from django.conf.urls import url
 
 from . import views
 
-urlpatterns = [url(r"^$", views.search_view, name="search")]
+urlpatterns = [url(r"^$", views.search_view, name="search"), url(r"^/users$", views.user_typeahead_view, name="search_users")]
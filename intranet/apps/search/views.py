@@ -4,6 +4,8 @@ import logging
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.http import JsonResponse
 from django.shortcuts import redirect, render
 
 from intranet.db.ldap_db import LDAPConnection
@@ -11,11 +13,13 @@ from intranet.db.ldap_db import LDAPConnection
 from ldap3.utils.conv import escape_filter_chars
 
 from ..announcements.models import Announcement
-from ..eighth.models import EighthActivity
+from ..eighth.models import EighthActivity, EighthScheduledActivity
 from ..events.models import Event
-from ..search.utils import get_query
+from ..search.index import get_user_search_index
+from ..search.models import SearchDocument
 from ..users.models import Grade, User
 from ..users.views import profile_view
+from ...utils.date import get_date_range_this_year
 
 logger = logging.getLogger(__name__)
 
@@ -235,12 +239,13 @@ def do_ldap_query(q, admin=False):
 
             res = c.search(settings.USER_DN, query, ["dn"])
             new_dns = []
+            previous_dns = set(result_dns)
             # if multiple words, delete those that weren't in previous searches
             for row in res:
                 dn = row["dn"]
                 if i == 0:
                     new_dns.append(dn)
-                elif dn in result_dns:
+                elif dn in previous_dns:
                     new_dns.append(dn)
 
             result_dns = new_dns
@@ -256,13 +261,39 @@ def do_ldap_query(q, admin=False):
     return users
 
 
+def do_index_query(q, admin=False):
+    """Search for users with the local user search index instead of LDAP.
+
+    Returns:
+        A list of User objects, best matches first, or None if the index
+        can't answer the query (in which case LDAP should be searched).
+
+    """
+    if not settings.LDAP_DIRECTORY_MIRROR or q.isdigit():
+        return None
+
+    ids = get_user_search_index().search(q, admin)
+    if ids is None:
+        return None
+
+    users = User.objects.in_bulk(ids)
+    return [users[uid] for uid in ids if uid in users and users[uid].is_active]
+
+
+def do_user_query(q, admin=False):
+    users = do_index_query(q, admin)
+    if users is None:
+        users = do_ldap_query(q, admin)
+    return users
+
+
 def get_search_results(q, admin=False):
     q = q.replace("+", " ")
     users = []
 
     for qu in q.split(" OR "):
         try:
-            users += do_ldap_query(qu, admin)
+            users += do_user_query(qu, admin)
         except ValueError:
             raise Exception("Invalid query")
 
@@ -270,33 +301,31 @@ def get_search_results(q, admin=False):
 
 
 def do_activities_search(q):
-    filter_query = get_query(q, ["name", "description"])
-    entires = EighthActivity.objects.filter(filter_query).order_by("name")
-    final_entires = []
-    for e in entires:
-        if e.is_active:
-            final_entires.append(e)
-    return final_entires
+    """Search for activities that have been scheduled this year."""
+    date_start, date_end = get_date_range_this_year()
+    active = EighthScheduledActivity.objects.filter(block__date__gte=date_start, block__date__lte=date_end).values("activity_id")
+    return SearchDocument.objects.search(EighthActivity.objects.filter(id__in=active), q)
 
 
 def do_announcements_search(q):
-    filter_query = get_query(q, ["title"])
-    entires = Announcement.objects.filter(filter_query).order_by("title")
-    final_entires = []
-    for e in entires:
-        if e.is_this_year:
-            final_entires.append(e)
-    return final_entires
+    """Search for announcements posted this year."""
+    return SearchDocument.objects.search(Announcement.objects.filter(added__date__range=get_date_range_this_year()), q)
 
 
 def do_events_search(q):
-    filter_query = get_query(q, ["title"])
-    entires = Event.objects.filter(filter_query).order_by("title")
-    final_entires = []
-    for e in entires:
-        if e.is_this_year:
-            final_entires.append(e)
-    return final_entires
+    """Search for events posted this year."""
+    return SearchDocument.objects.search(Event.objects.filter(added__date__range=get_date_range_this_year()), q)
+
+
+def paginate_results(request, queryset, page_param):
+    """Return the page of ``queryset`` selected by the ``page_param`` GET parameter."""
+    paginator = Paginator(queryset, settings.SEARCH_RESULTS_PER_PAGE)
+    try:
+        return paginator.page(request.GET.get(page_param, 1))
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
 
 
 @login_required
@@ -321,16 +350,16 @@ def search_view(request):
         if is_admin:
             users = sorted(users, key=lambda u: (u.last_name, u.first_name))
 
-        activities = do_activities_search(q)
-        announcements = do_announcements_search(q)
-        events = do_events_search(q)
+        activities = paginate_results(request, do_activities_search(q), "activities_page")
+        announcements = paginate_results(request, do_announcements_search(q), "announcements_page")
+        events = paginate_results(request, do_events_search(q), "events_page")
 
         logger.debug(activities)
         logger.debug(announcements)
         logger.debug(events)
 
         if users and len(users) == 1:
-            no_other_results = (not activities and not announcements)
+            no_other_results = (not activities.paginator.count and not announcements.paginator.count)
             if request.user.is_eighthoffice or no_other_results:
                 user_id = users[0].id
                 return redirect("user_profile", user_id=user_id)
@@ -339,11 +368,53 @@ def search_view(request):
             "query_error": query_error,
             "search_query": q,
             "search_results": users,  # User objects
-            "announcements": announcements,  # Announcement objects
-            "events": events,  # Event objects
-            "activities": activities  # EighthActivity objects
+            "announcements": announcements,  # Page of Announcement objects
+            "events": events,  # Page of Event objects
+            "activities": activities  # Page of EighthActivity objects
         }
     else:
         context = {"search_results": None}
     context["is_admin"] = is_admin
     return render(request, "search/search_results.html", context)
+
+
+@login_required
+def user_typeahead_view(request):
+    """Return the users matching a (partial) search query as JSON, for autocompletion.
+
+    Answered from the user search index, so it is only available when the
+    directory mirror is enabled.
+
+    """
+    q = request.GET.get("q", "").strip().replace("+", " ")
+    try:
+        limit = min(int(request.GET.get("limit", 10)), 50)
+    except ValueError:
+        limit = 10
+
+    if not settings.LDAP_DIRECTORY_MIRROR:
+        return JsonResponse({"error": "User search index unavailable."}, status=503)
+
+    results = []
+    if q:
+        index = get_user_search_index()
+        try:
+            ids = index.search(q, request.user.is_eighthoffice)
+        except ValueError:
+            return JsonResponse({"error": "Invalid query"}, status=400)
+        if ids is None:
+            return JsonResponse({"error": "Query not supported for autocompletion."}, status=400)
+
+        for uid in ids[:limit]:
+            user = index.describe(uid)
+            results.append({
+                "id": uid,
+                "username": user["username"],
+                "first_name": user["first_name"],
+                "last_name": user["last_name"],
+                "nickname": user["nickname"],
+                "graduation_year": user["graduation_year"],
+                "user_type": "student" if user["user_type"] == settings.LDAP_OBJECT_CLASSES["student"] else "teacher"
+            })
+
+    return JsonResponse({"users": results})
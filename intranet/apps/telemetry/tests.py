@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from ..users.models import User
+from ...middleware.telemetry import TelemetryMiddleware
+from ...test.ion_test import IonTestCase
+from ...utils import telemetry
+
+
+class TelemetryTest(IonTestCase):
+    """Tests for counting the work done by a request."""
+
+    def test_middleware(self):
+        middleware = TelemetryMiddleware()
+        request = RequestFactory().get("/")
+        middleware.process_request(request)
+
+        User.objects.filter(username="awilliam").exists()
+        cache.set("telemetry_test", 1)
+        cache.get("telemetry_test")
+        cache.get_many(["telemetry_test", "telemetry_test_missing"])
+        stats = telemetry.current()
+        self.assertEqual(stats.sql_queries, 1)
+        self.assertEqual(stats.cache_gets, 3)
+        self.assertEqual(stats.cache_sets, 1)
+        self.assertIn("sql=1/", stats.summary())
+
+        response = middleware.process_response(request, HttpResponse())
+        self.assertIsNone(telemetry.current())
+        self.assertIn("db;dur=", response["Server-Timing"])
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+        self.assertTrue(telemetry.view_stats.samples["unresolved"])
+
+    def test_summarize(self):
+        samples = [(float(ms), 1, 1.0, 2, 2.0, 4, 3, 0.5) for ms in range(1, 101)]
+        summary = telemetry.summarize([{"views": {"index": {"requests": 150, "samples": samples}}}])[0]
+        self.assertEqual(summary["requests"], 150)
+        self.assertEqual(summary["p50_ms"], 51.0)
+        self.assertEqual(summary["p99_ms"], 100.0)
+        self.assertEqual(summary["sql_queries"], 2)
+        self.assertEqual(summary["cache_hit_ratio"], 0.75)
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+from django.conf.urls import url
+
+from . import views
+
+urlpatterns = [url(r"^$", views.telemetry_view, name="telemetry")]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from django.http import JsonResponse
+from django.shortcuts import render
+
+from ..auth.decorators import admin_required
+from ...utils.telemetry import get_snapshots, summarize
+
+
+@admin_required("all")
+def telemetry_view(request):
+    """Show the response time percentiles and average LDAP, SQL and cache work of each view.
+
+    Add ?format=json for a metrics endpoint.
+
+    """
+    snapshots = get_snapshots()
+    views = summarize(snapshots.values())
+    ldap_pools = {process: snapshot["ldap_pool"] for process, snapshot in snapshots.items()}
+
+    if request.GET.get("format") == "json":
+        return JsonResponse({"views": views, "ldap_pools": ldap_pools})
+
+    context = {"views": views, "ldap_pools": sorted(ldap_pools.items())}
+    return render(request, "telemetry/views.html", context)
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+
+default_app_config = "intranet.apps.users.apps.UsersConfig"
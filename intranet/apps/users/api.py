@@ -1,10 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import io
-import os
-
-from django.conf import settings
-
 from intranet.apps.search.views import get_search_results
 
 from rest_framework import generics
@@ -12,6 +7,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from .models import Class, Grade, User
+from .photos import auto_photo_years, get_user_photo, photo_response
 from .renderers import JPEGRenderer
 from .serializers import (ClassSerializer, CounselorTeacherSerializer, StudentSerializer, UserSerializer)
 
@@ -43,6 +39,8 @@ class ProfilePictureDetail(generics.RetrieveAPIView):
     /api/profile/<pk>/picture: retrieve default profile picture
     /api/profile/<pk>/picture/<photo_year>: retrieve profile picture for year <photo_year>
 
+    Add ?size=<size> for a resized copy (see settings.PHOTO_SIZES).
+
     """
     serializer_class = UserSerializer
     permission_classes = (IsAuthenticated,)
@@ -54,19 +52,16 @@ class ProfilePictureDetail(generics.RetrieveAPIView):
         else:
             user = request.user
 
-        binary = None
+        years = []
         if 'photo_year' in kwargs:
             photo_year = kwargs['photo_year']
             if photo_year in Grade.names:
-                binary = user.photo_binary(photo_year)
-        else:
-            binary = user.default_photo()
-        if not binary:
-            default_image_path = os.path.join(settings.PROJECT_ROOT, "static/img/default_profile_pic.png")
-            binary = io.open(default_image_path, mode="rb").read()
+                years = [photo_year]
+        elif user.preferred_photo in (None, "AUTO", "AUTOPhoto"):
+            years = auto_photo_years(user)
 
-        response = Response(binary, content_type='image/jpeg')
-        return response
+        photo = get_user_photo(user, years, request.GET.get("size"))
+        return photo_response(request, photo, "{}_{}".format(user.id, kwargs.get('photo_year', "default")))
 
 
 class ClassDetail(generics.RetrieveAPIView):
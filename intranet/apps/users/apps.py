@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from django.apps import AppConfig
+
+
+class UsersConfig(AppConfig):
+    name = "intranet.apps.users"
+
+    def ready(self):
+        from .signals import connect_signals
+        connect_signals()
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+
+from intranet.apps.users.models import DirectorySyncError, UserDirectoryEntry
+
+
+class Command(BaseCommand):
+    help = "Copy user attributes that changed in LDAP since the last run into the SQL directory mirror."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', dest='full', default=False,
+                            help='Sync every user entry and remove mirror entries of users no longer in LDAP.')
+
+        parser.add_argument('--force', action='store_true', dest='force', default=False,
+                            help='With --full, remove mirror entries even if LDAP returned far fewer entries than the mirror has.')
+
+    def handle(self, *args, **options):
+        try:
+            updated, deleted = UserDirectoryEntry.objects.sync(full=options["full"], force=options["force"])
+        except DirectorySyncError as e:
+            raise CommandError("{} (use --force to sync anyway)".format(e))
+        self.stdout.write("{} entries updated, {} deleted.".format(updated, deleted))
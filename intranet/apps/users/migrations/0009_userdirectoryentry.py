@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_user__student_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDirectoryEntry',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='directory_entry', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('dn', models.CharField(max_length=255, unique=True)),
+                ('modify_timestamp', models.CharField(db_index=True, max_length=20)),
+                ('ion_username', models.CharField(max_length=30)),
+                ('user_type', models.CharField(blank=True, max_length=30)),
+                ('graduation_year', models.PositiveIntegerField(db_index=True, null=True)),
+                ('first_name', models.CharField(blank=True, max_length=100)),
+                ('last_name', models.CharField(blank=True, max_length=100)),
+                ('nickname', models.CharField(blank=True, max_length=100)),
+                ('sex', models.CharField(blank=True, max_length=10)),
+                ('birthday', models.DateField(null=True)),
+                ('perm_showaddress', models.NullBooleanField()),
+                ('perm_showtelephone', models.NullBooleanField()),
+                ('perm_showbirthday', models.NullBooleanField()),
+                ('perm_showschedule', models.NullBooleanField()),
+                ('perm_showeighth', models.NullBooleanField()),
+                ('perm_showpictures', models.NullBooleanField()),
+                ('perm_showaddress_self', models.NullBooleanField()),
+                ('perm_showtelephone_self', models.NullBooleanField()),
+                ('perm_showbirthday_self', models.NullBooleanField()),
+                ('perm_showschedule_self', models.NullBooleanField()),
+                ('perm_showeighth_self', models.NullBooleanField()),
+                ('perm_showpictures_self', models.NullBooleanField()),
+            ],
+        ),
+    ]
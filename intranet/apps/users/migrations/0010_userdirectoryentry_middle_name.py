@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_userdirectoryentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userdirectoryentry',
+            name='middle_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
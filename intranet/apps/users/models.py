@@ -5,14 +5,16 @@ import logging
 import os
 from base64 import b64encode
 from datetime import datetime
+from typing import Any, Dict  # noqa
 
 from django.conf import settings
 from django.contrib.auth import BACKEND_SESSION_KEY
 from django.contrib.auth.models import AbstractBaseUser, AnonymousUser, PermissionsMixin, UserManager as DjangoUserManager
 from django.core import exceptions
+from django.core import signing
 from django.core.cache import cache
 from django.core.signing import Signer
-from django.db import models
+from django.db import models, transaction
 
 from intranet.db.ldap_db import LDAPConnection, LDAPFilter
 from intranet.middleware import threadlocals
@@ -20,6 +22,7 @@ from intranet.middleware import threadlocals
 import ldap3
 import ldap3.utils.dn
 
+from .photos import clear_photo_cache
 from ..groups.models import Group
 
 logger = logging.getLogger(__name__)
@@ -64,6 +67,9 @@ class UserManager(DjangoUserManager):
 
     def users_in_year(self, year):
         """Get a list of users in a specific graduation year."""
+        if settings.LDAP_DIRECTORY_MIRROR:
+            return list(User.objects.filter(directory_entry__graduation_year=year))
+
         c = LDAPConnection()
 
         results = c.search(settings.USER_DN, "graduationYear={}".format(year), ["dn"])
@@ -74,6 +80,168 @@ class UserManager(DjangoUserManager):
 
         return users
 
+    def prefetch_ldap(self, users, attrs):
+        """Load LDAP attributes for many users with as few LDAP searches as possible.
+
+        Attributes that are not already cached are fetched with one
+        OR-filtered search per chunk of ``LDAP_PREFETCH_CHUNK_SIZE`` users,
+        and the results are stored under the same cache keys that
+        :meth:`User.__getattr__` reads from, using a single
+        ``cache.set_many`` call. Visibility checks still happen when the
+        attributes are read.
+
+        Besides the names in :attr:`User.ldap_user_attributes`, ``attrs``
+        may contain "permissions" (see :attr:`User.permissions`). Fetching
+        "graduation_year" also primes the cached :attr:`User.grade`.
+
+        When ``LDAP_USER_ENTRY_CACHE`` is enabled, whole entries are
+        fetched and cached instead (see :meth:`User.get_ldap_entry`), and
+        are memoized on the given User objects.
+
+        Args:
+            users
+                An iterable of User objects.
+            attrs
+                A list of attribute names to load.
+
+        Returns:
+            The list of users.
+
+        """
+        users = list(users)
+        attrs = [a for a in attrs if a == "permissions" or User.ldap_user_attributes.get(a, {}).get("cache")]
+        if not users or not attrs:
+            return users
+
+        # Resolve DNs from the cache in one round trip
+        unresolved = [u for u in users if not u._dn and u.id]
+        if unresolved:
+            dn_keys = {":".join([str(u.id), "dn"]): u for u in unresolved}
+            for key, dn in cache.get_many(list(dn_keys.keys())).items():
+                if dn:
+                    dn_keys[key]._dn = dn
+
+        entry_mode = settings.LDAP_USER_ENTRY_CACHE
+
+        def cache_key(dn, name):
+            if name == "permissions":
+                return "{}:{}".format(dn, "user_info_permissions")
+            if entry_mode:
+                return User.ldap_entry_cache_key(dn)
+            return User.create_secure_cache_key(":".join((dn, name)))
+
+        users_by_dn = {}
+        keys = {}
+        for u in users:
+            dn = u.dn
+            if dn is None:
+                continue
+            users_by_dn.setdefault(dn, []).append(u)
+            for name in attrs:
+                keys[cache_key(dn, name)] = dn
+        cached = cache.get_many(list(keys.keys()))
+
+        def set_entry(dn, entry):
+            for u in users_by_dn.get(dn, []):
+                u._ldap_entry = entry
+
+        if entry_mode:
+            for key, blob in list(cached.items()):
+                dn = keys[key]
+                if key != User.ldap_entry_cache_key(dn):
+                    continue
+                entry = User.load_ldap_entry(blob)
+                if entry is None:
+                    del cached[key]
+                else:
+                    set_entry(dn, entry)
+
+        missing_dns = sorted(set(dn for key, dn in keys.items() if key not in cached))
+        if not missing_dns:
+            return users
+
+        ldap_names = set()
+        for name in attrs:
+            if name == "permissions":
+                ldap_names.update(User.ldap_permission_attributes)
+            elif entry_mode:
+                ldap_names.update(attr["ldap_name"] for attr in User.ldap_user_attributes.values() if attr["cache"])
+            else:
+                ldap_names.add(User.ldap_user_attributes[name]["ldap_name"])
+
+        c = LDAPConnection()
+        chunk_size = settings.LDAP_PREFETCH_CHUNK_SIZE
+        to_cache = {}
+        # Permissions and grades have a shorter timeout than other attributes
+        short_lived = {}
+        for i in range(0, len(missing_dns), chunk_size):
+            chunk = missing_dns[i:i + chunk_size]
+            chunk_dns = {dn.lower(): dn for dn in chunk}
+            usernames = [LDAPFilter.escape(User.username_from_dn(dn)) for dn in chunk]
+            results = c.search(settings.USER_DN, LDAPFilter.attribute_in_list("iodineUid", usernames), list(ldap_names))
+            for row in results:
+                dn = chunk_dns.get(row["dn"].lower(), row["dn"])
+                result = row["attributes"]
+                entry = User.build_ldap_entry(result)
+                for name in attrs:
+                    if name == "permissions":
+                        short_lived[cache_key(dn, name)] = User.parse_permissions(result)
+                    elif entry_mode:
+                        to_cache[cache_key(dn, name)] = User.dump_ldap_entry(entry)
+                        set_entry(dn, entry)
+                    elif name in entry:
+                        to_cache[cache_key(dn, name)] = entry[name]
+                if "graduation_year" in attrs and "graduation_year" in entry:
+                    short_lived[":".join([dn, "grade"])] = Grade(entry["graduation_year"])
+
+        if to_cache:
+            cache.set_many(to_cache, timeout=settings.CACHE_AGE["user_attribute"])
+        if short_lived:
+            cache.set_many(short_lived, timeout=settings.CACHE_AGE["ldap_permissions"])
+        logger.debug("Prefetched LDAP attributes {} for {} users".format(attrs, len(missing_dns)))
+        return users
+
+    def prefetch_counselors(self, users):
+        """Load the counselors of many users, like :attr:`User.counselor` does for one, with one
+        LDAP search per chunk of users.
+
+        Returns:
+            A dict mapping the id of each user to their counselor (with
+            their last name prefetched), or None.
+
+        """
+        users = [u for u in users if u.dn]
+        keys = {":".join([u.dn, "counselor"]): u for u in users}
+        counselor_ids = {keys[key].id: value for key, value in cache.get_many(list(keys)).items() if value}
+
+        missing = [u for u in users if u.id not in counselor_ids]
+        if missing:
+            c = LDAPConnection()
+            chunk_size = settings.LDAP_PREFETCH_CHUNK_SIZE
+            to_cache = {}
+            for i in range(0, len(missing), chunk_size):
+                chunk = {u.dn.lower(): u for u in missing[i:i + chunk_size]}
+                usernames = [LDAPFilter.escape(User.username_from_dn(u.dn)) for u in chunk.values()]
+                results = c.search(settings.USER_DN, LDAPFilter.attribute_in_list("iodineUid", usernames), ["counselor"])
+                for row in results:
+                    user = chunk.get(row["dn"].lower())
+                    counselor = row["attributes"].get("counselor")
+                    if user is not None and counselor:
+                        counselor_ids[user.id] = counselor[0] if isinstance(counselor, (list, tuple)) else counselor
+                        to_cache[":".join([user.dn, "counselor"])] = counselor_ids[user.id]
+            if to_cache:
+                cache.set_many(to_cache, timeout=settings.CACHE_AGE["user_attribute"])
+
+        counselors = User.objects.in_bulk([int(counselor_id) for counselor_id in set(counselor_ids.values())])
+        for counselor_id in set(int(counselor_id) for counselor_id in counselor_ids.values()) - set(counselors):
+            # There are only a few counselors, who are almost always already in the database
+            try:
+                counselors[counselor_id] = User.get_user(id=counselor_id)
+            except User.DoesNotExist:
+                pass
+        self.prefetch_ldap(counselors.values(), ["last_name"])
+        return {u.id: counselors.get(int(counselor_ids[u.id])) if u.id in counselor_ids else None for u in users}
+
     def _ldap_and_string(self, opts):
         """Combine LDAP queries with AND.
 
@@ -112,6 +280,13 @@ class UserManager(DjangoUserManager):
 
     def users_with_birthday(self, month, day):
         """Return a list of user objects who have a birthday on a given date."""
+        if settings.LDAP_DIRECTORY_MIRROR:
+            visible = UserDirectoryEntry.objects.visible_q("showbirthday", prefix="directory_entry__")
+            request = threadlocals.request()
+            if request and request.user.is_authenticated():
+                visible |= models.Q(id=request.user.id)
+            return list(User.objects.filter(visible, directory_entry__birthday__month=month, directory_entry__birthday__day=day))
+
         c = LDAPConnection()
 
         month = int(month)
@@ -228,6 +403,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     # Private dn cache
     _dn = None  # type: str
 
+    # Private memo of all cacheable LDAP attributes (see get_ldap_entry())
+    _ldap_entry = None  # type: Dict[str,Any]
+
     _student_id = models.PositiveIntegerField(null=True)
 
     @property
@@ -262,8 +440,17 @@ class User(AbstractBaseUser, PermissionsMixin):
             The User object if the user could be found in LDAP,
             otherwise User.DoesNotExist is raised.
 
+        Within a request, the same User object is returned for repeated
+        lookups of the same user.
+
         """
 
+        memo = threadlocals.memo()
+        if memo is not None:
+            user = memo.get_user(dn=dn, id=id, username=username)
+            if user is not None:
+                return user
+
         if id is not None:
             try:
                 user = User.objects.get(id=id)
@@ -302,6 +489,8 @@ class User(AbstractBaseUser, PermissionsMixin):
         else:
             raise TypeError("get_user() requires at least one argument.")
 
+        if memo is not None:
+            memo.add_user(user, dn=dn)
         return user
 
     @staticmethod
@@ -316,6 +505,10 @@ class User(AbstractBaseUser, PermissionsMixin):
             String if dn was found, otherwise None
 
         """
+        return threadlocals.memoize(("dn_from_id", id), lambda: User._dn_from_id(id))
+
+    @staticmethod
+    def _dn_from_id(id):
         logger.debug("Fetching DN of User with ID {}.".format(id))
         key = ":".join([str(id), 'dn'])
         cached = cache.get(key)
@@ -396,7 +589,7 @@ class User(AbstractBaseUser, PermissionsMixin):
 
         """
         if not hasattr(self, "_groups_cache"):
-            self._groups_cache = self.groups.values_list("name", flat=True)
+            self._groups_cache = threadlocals.memoize(("groups", self.id), lambda: list(self.groups.values_list("name", flat=True)))
 
         if isinstance(group, Group):
             group = group.name
@@ -754,6 +947,47 @@ class User(AbstractBaseUser, PermissionsMixin):
 
         return None
 
+    def photo_is_visible(self, photo_year):
+        """Returns whether the current user may see a user's picture from the given year.
+
+        Returns:
+            Boolean
+
+        """
+        if self.is_http_request_sender():
+            return True
+        elif self._current_user_override():
+            return True
+
+        perms = self.photo_permissions
+
+        if perms["self"][photo_year] is None:
+            visible_self = perms["self"]["default"]
+        else:
+            visible_self = perms["self"][photo_year]
+        visible_parent = perms["parent"]
+
+        return visible_self and visible_parent
+
+    def load_photo_binary(self, photo_year):
+        """Loads the binary data for a user's picture from LDAP, without checking permissions or
+        the cache.
+
+        Returns:
+            Binary data, or None
+
+        """
+        c = LDAPConnection()
+        dn = "cn={}Photo,{}".format(photo_year, self.dn)
+        try:
+            results = c.search(dn, "(objectClass=iodinePhoto)", ['jpegPhoto'])
+            if len(results) == 1:
+                logger.debug("{} photo of user {} loaded from LDAP.".format(photo_year.title(), self.id))
+                return results[0]['attributes']['jpegPhoto'][0]
+        except (ldap3.LDAPNoSuchObjectResult, KeyError):
+            pass
+        return None
+
     def photo_binary(self, photo_year):
         """Returns the binary data for a user's picture.
 
@@ -765,38 +999,13 @@ class User(AbstractBaseUser, PermissionsMixin):
         key = identifier  # User.create_secure_cache_key(identifier)
 
         cached = cache.get(key)
-
-        if self.is_http_request_sender():
-            visible = True
-        elif self._current_user_override():
-            visible = True
-        else:
-            perms = self.photo_permissions
-
-            if perms["self"][photo_year] is None:
-                visible_self = perms["self"]["default"]
-            else:
-                visible_self = perms["self"][photo_year]
-            visible_parent = perms["parent"]
-
-            visible = visible_self and visible_parent
+        visible = self.photo_is_visible(photo_year)
 
         if cached and visible:
             logger.debug("{} photo of user {} loaded from cache.".format(photo_year.title(), self.id))
             return cached
         elif not cached and visible:
-            c = LDAPConnection()
-            dn = "cn={}Photo,{}".format(photo_year, self.dn)
-            try:
-                results = c.search(dn, "(objectClass=iodinePhoto)", ['jpegPhoto'])
-                if len(results) == 1:
-                    data = results[0]['attributes']['jpegPhoto'][0]
-                    logger.debug("{} photo of user {} loaded from LDAP.".format(photo_year.title(), self.id))
-                else:
-                    data = None
-            except (ldap3.LDAPNoSuchObjectResult, KeyError):
-                data = None
-
+            data = self.load_photo_binary(photo_year)
             cache.set(key, data, timeout=settings.CACHE_AGE['ldap_permissions'])
             return data
         else:
@@ -844,6 +1053,7 @@ class User(AbstractBaseUser, PermissionsMixin):
         return None
 
     @property
+    @threadlocals.request_memoized(lambda self: (self.dn, "photo_permissions"))
     def photo_permissions(self):
         """Fetches the LDAP permissions for a user's photos.
 
@@ -892,6 +1102,7 @@ class User(AbstractBaseUser, PermissionsMixin):
             return perms
 
     @property
+    @threadlocals.request_memoized(lambda self: (self.dn, "user_info_permissions"))
     def permissions(self):
         """Fetches the LDAP permissions for a user.
 
@@ -912,24 +1123,43 @@ class User(AbstractBaseUser, PermissionsMixin):
             return cached
         else:
             c = LDAPConnection()
-            results = c.user_attributes(self.dn,
-                                        ["perm-showaddress", "perm-showtelephone", "perm-showbirthday", "perm-showschedule", "perm-showeighth",
-                                         "perm-showpictures", "perm-showaddress-self", "perm-showtelephone-self", "perm-showbirthday-self",
-                                         "perm-showschedule-self", "perm-showeighth-self", "perm-showpictures-self"])
-            result = results.first_result()
-            perms = {"parent": {}, "self": {}}
-            for perm, value in result.items():
-                bool_value = True if (value[0] == 'TRUE') else False
-                if perm.endswith("-self"):
-                    perm_name = perm[5:-5]
-                    perms["self"][perm_name] = bool_value
-                else:
-                    perm_name = perm[5:]
-                    perms["parent"][perm_name] = bool_value
+            results = c.user_attributes(self.dn, User.ldap_permission_attributes)
+            perms = User.parse_permissions(results.first_result())
 
             cache.set(key, perms, timeout=settings.CACHE_AGE['ldap_permissions'])
             return perms
 
+    # The LDAP attributes that make up User.permissions
+    ldap_permission_attributes = ["perm-showaddress", "perm-showtelephone", "perm-showbirthday", "perm-showschedule", "perm-showeighth",
+                                  "perm-showpictures", "perm-showaddress-self", "perm-showtelephone-self", "perm-showbirthday-self",
+                                  "perm-showschedule-self", "perm-showeighth-self", "perm-showpictures-self"]
+
+    @staticmethod
+    def parse_permissions(result):
+        """Build the permissions dictionary from the raw perm-* attributes of an LDAP entry.
+
+        Args:
+            result
+                A dictionary of LDAP attributes (only the perm-* attributes
+                are used).
+
+        Returns:
+            Dictionary with keys "parent" and "self".
+
+        """
+        perms = {"parent": {}, "self": {}}
+        for perm, value in result.items():
+            if perm not in User.ldap_permission_attributes or not value:
+                continue
+            bool_value = True if (value[0] == 'TRUE') else False
+            if perm.endswith("-self"):
+                perm_name = perm[5:-5]
+                perms["self"][perm_name] = bool_value
+            else:
+                perm_name = perm[5:]
+                perms["parent"][perm_name] = bool_value
+        return perms
+
     @property
     def can_view_eighth(self):
         """Checks if a user has the showeighth permission.
@@ -1374,13 +1604,6 @@ class User(AbstractBaseUser, PermissionsMixin):
 
         attr = User.ldap_user_attributes[name]
         should_cache = attr["cache"]
-        if should_cache:
-            identifier = ":".join((self.dn, name))
-            key = User.create_secure_cache_key(identifier)
-
-            cached = cache.get(key)
-        else:
-            cached = False
 
         if attr["perm"] is None:
             visible = True
@@ -1390,34 +1613,120 @@ class User(AbstractBaseUser, PermissionsMixin):
         if name not in ["ion_id", "ion_username", "user_type"]:
             visible = self._current_user_override() or visible
 
-        if cached and visible:
-            logger.debug("Attribute '{}' of user {} loaded " "from cache.".format(name, self.id or self.dn))
-            return cached
-        elif not cached and visible:
-            c = LDAPConnection()
-            field_name = attr["ldap_name"]
+        if not visible:
+            return None
+
+        if should_cache and settings.LDAP_USER_ENTRY_CACHE:
+            return self.get_ldap_entry().get(name)
+
+        if should_cache:
+            return threadlocals.memoize((self.dn, name), lambda: self._fetch_ldap_attribute(name))
+        return self._fetch_ldap_attribute(name)
+
+    def _fetch_ldap_attribute(self, name):
+        """Load a single attribute from the cache, or from LDAP (caching it) on a miss, without
+        checking its visibility."""
+        attr = User.ldap_user_attributes[name]
+        should_cache = attr["cache"]
+
+        if should_cache:
+            identifier = ":".join((self.dn, name))
+            key = User.create_secure_cache_key(identifier)
+
+            cached = cache.get(key)
+            if cached:
+                logger.debug("Attribute '{}' of user {} loaded " "from cache.".format(name, self.id or self.dn))
+                return cached
+
+        c = LDAPConnection()
+        field_name = attr["ldap_name"]
+        try:
+            results = c.user_attributes(self.dn, [field_name])
             try:
-                results = c.user_attributes(self.dn, [field_name])
-                try:
-                    result = results.first_result()[field_name]
-                except TypeError:
-                    result = None
+                result = results.first_result()[field_name]
+            except TypeError:
+                result = None
+
+            if attr["is_list"]:
+                value = result
+            elif result:
+                value = result[0]
+            else:
+                value = None
+                should_cache = False
 
-                if attr["is_list"]:
-                    value = result
-                elif result:
-                    value = result[0]
-                else:
-                    value = None
-                    should_cache = False
+            if should_cache:
+                cache.set(key, value, timeout=settings.CACHE_AGE["user_attribute"])
+            return value
+        except KeyError:
+            return None
 
-                if should_cache:
-                    cache.set(key, value, timeout=settings.CACHE_AGE["user_attribute"])
-                return value
-            except KeyError:
-                return None
-        else:
+    @staticmethod
+    def ldap_entry_cache_key(dn):
+        """Return the cache key of the whole-entry attribute blob for a DN."""
+        return User.create_secure_cache_key(":".join((dn, "ldap_entry")))
+
+    @staticmethod
+    def build_ldap_entry(result):
+        """Convert the raw attributes of an LDAP entry to a dictionary of cacheable
+        :attr:`ldap_user_attributes` values, keyed by their Python names."""
+        entry = {}
+        for name, attr in User.ldap_user_attributes.items():
+            if not attr["cache"]:
+                continue
+            value = result.get(attr["ldap_name"])
+            if not attr["is_list"]:
+                value = value[0] if value else None
+            if value:
+                entry[name] = value
+        return entry
+
+    @staticmethod
+    def dump_ldap_entry(entry):
+        """Serialize an entry dictionary into a signed, compressed string for the cache."""
+        return signing.dumps(entry, salt="intranet.users.ldap_entry", compress=True)
+
+    @staticmethod
+    def load_ldap_entry(blob):
+        """Deserialize a cached entry blob, returning None if it is missing or has been tampered with."""
+        if not blob:
             return None
+        try:
+            return signing.loads(blob, salt="intranet.users.ldap_entry")
+        except signing.BadSignature:
+            logger.warning("Discarding cached LDAP entry with a bad signature")
+            return None
+
+    def get_ldap_entry(self):
+        """Return all cacheable LDAP attributes of the user as a dictionary.
+
+        Only used when ``LDAP_USER_ENTRY_CACHE`` is enabled. The first
+        call on an instance reads a single signed blob from the cache
+        (or, on a miss, fetches every cacheable attribute with one LDAP
+        search and caches the blob); later calls are answered from a memo
+        on the instance, which is shared by every instance of the same
+        user within a request.
+
+        Returns:
+            Dictionary mapping names in :attr:`ldap_user_attributes` to
+            their values. Attributes that are not set are omitted.
+
+        """
+        if self._ldap_entry is None:
+            self._ldap_entry = threadlocals.memoize((self.dn, "ldap_entry"), self._load_ldap_entry)
+        return self._ldap_entry
+
+    def _load_ldap_entry(self):
+        key = User.ldap_entry_cache_key(self.dn)
+        entry = User.load_ldap_entry(cache.get(key))
+        if entry is not None:
+            logger.debug("LDAP entry of user {} loaded from cache.".format(self.id or self.dn))
+        else:
+            c = LDAPConnection()
+            field_names = [attr["ldap_name"] for attr in User.ldap_user_attributes.values() if attr["cache"]]
+            entry = User.build_ldap_entry(c.user_attributes(self.dn, field_names).first_result() or {})
+            cache.set(key, User.dump_ldap_entry(entry), timeout=settings.CACHE_AGE["user_attribute"])
+        return entry
 
     def set_ldap_attribute(self, name, value, override_set=False):
         """Set a user attribute in LDAP."""
@@ -1443,12 +1752,17 @@ class User(AbstractBaseUser, PermissionsMixin):
 
         field_name = attr["ldap_name"]
         self.set_raw_ldap_attribute(field_name, value)
+        threadlocals.forget(self.dn)
 
         if should_cache:
             identifier = ":".join((self.dn, name))
             key = User.create_secure_cache_key(identifier)
             cache.set(key, value, timeout=settings.CACHE_AGE["user_attribute"])
 
+            cache.delete(User.ldap_entry_cache_key(self.dn))
+            if self._ldap_entry is not None:
+                self._ldap_entry[name] = value
+
     def set_ldap_preference(self, item_name, value, is_admin=False):
         logger.debug("Pref: {} {}".format(item_name, value))
 
@@ -1478,16 +1792,20 @@ class User(AbstractBaseUser, PermissionsMixin):
             grade = field_name.split("photoperm-")[1]
             self.set_raw_ldap_photoperm(field_type, grade, value)
             cache.delete(":".join([self.dn, "photo_permissions"]))
+            clear_photo_cache(self)
         else:
             logger.debug("Setting raw LDAP: {} = {}".format(ldap_name, value))
             self.set_raw_ldap_attribute(ldap_name, value)
 
         if field_name == "showpictures":
             cache.delete(":".join([self.dn, "photo_permissions"]))
+            clear_photo_cache(self)
 
         if field_name in ["showschedule", "showaddress", "showphone", "showbirthday", "showpictures", "showeighth"]:
             cache.delete(":".join([self.dn, "user_info_permissions"]))
 
+        threadlocals.forget(self.dn)
+
     def set_raw_ldap_photoperm(self, field_type, grade, value):
         if self.dn is None:
             raise Exception("Could not determine DN of User")
@@ -1516,6 +1834,9 @@ class User(AbstractBaseUser, PermissionsMixin):
         for attr in User.ldap_user_attributes:
             cache.delete(":".join((self.dn, attr)))
             cache.delete(User.create_secure_cache_key(":".join((self.dn, attr))))
+        cache.delete(User.ldap_entry_cache_key(self.dn))
+        self._ldap_entry = None
+        threadlocals.forget(self.dn)
 
     @property
     def is_eighth_sponsor(self):
@@ -1571,6 +1892,230 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.id
 
 
+class DirectorySyncError(Exception):
+    """Raised when a sync of the directory mirror looks unsafe, e.g. LDAP returned far fewer
+    entries than the mirror has."""
+
+
+class UserDirectoryEntryManager(models.Manager):
+
+    # Mirror field names of the LDAP attributes in User.ldap_user_attributes that are synced
+    synced_attributes = ["ion_id", "ion_username", "user_type", "graduation_year", "first_name", "middle_name", "last_name", "nickname", "sex"]
+
+    version_cache_key = "users:directory_version"
+
+    # Number of entries written with each set of bulk queries
+    sync_batch_size = 500
+
+    # A full sync that finds fewer entries than this fraction of the mirror
+    # (e.g. because an LDAP search was truncated) is refused unless forced,
+    # since it would delete the rest
+    min_full_sync_fraction = 0.9
+
+    def latest_modify_timestamp(self):
+        """Return the newest LDAP modifyTimestamp that has been synced, or None if the mirror is
+        empty."""
+        return self.aggregate(latest=models.Max("modify_timestamp"))["latest"]
+
+    def sync(self, full=False, force=False):
+        """Copy user entries from LDAP into the mirror table.
+
+        Unless ``full`` is set, only entries modified since the newest
+        synced ``modifyTimestamp`` are fetched. Users that are missing from
+        the SQL database are created the same way :meth:`User.get_user`
+        creates them. A full sync also removes mirror entries of users that
+        are no longer in LDAP, but raises DirectorySyncError without
+        changing anything if LDAP returned fewer than
+        ``min_full_sync_fraction`` of the mirror's entries, unless ``force``
+        is set.
+
+        Entries are written in batches of ``sync_batch_size``, and entries
+        that did not change are not written at all.
+
+        Returns:
+            A tuple of the number of entries updated and deleted.
+
+        """
+        query = LDAPFilter.all_users()
+        latest = None if full else self.latest_modify_timestamp()
+        if latest:
+            query = "(&{}(modifyTimestamp>={}))".format(query, LDAPFilter.escape(latest))
+
+        attrs = [User.ldap_user_attributes[name]["ldap_name"] for name in self.synced_attributes]
+        attrs += ["birthday", "modifyTimestamp"] + User.ldap_permission_attributes
+
+        c = LDAPConnection()
+        results = c.search(settings.USER_DN, query, attrs)
+
+        entries = []
+        for result in results:
+            entry = UserDirectoryEntry(dn=result["dn"])
+            entry.update_from_ldap(result["attributes"])
+            if entry.ion_id is not None and entry.ion_username:
+                entries.append(entry)
+
+        if full and not force:
+            mirrored = self.count()
+            if len(entries) < mirrored * self.min_full_sync_fraction:
+                raise DirectorySyncError("LDAP returned {} user entries, but the mirror has {}; not removing the others".format(
+                    len(entries), mirrored))
+
+        written = 0
+        seen = set()
+        with transaction.atomic():
+            for i in range(0, len(entries), self.sync_batch_size):
+                batch = entries[i:i + self.sync_batch_size]
+                written += self._sync_batch(batch)
+                seen.update(entry.ion_id for entry in batch)
+
+            deleted = 0
+            if full:
+                deleted, _ = self.exclude(user_id__in=seen).delete()
+
+        if written or deleted:
+            self.mark_changed()
+
+        return written, deleted
+
+    def _sync_batch(self, entries):
+        """Write a batch of entries loaded from LDAP, with a fixed number of queries.
+
+        Missing users and entries are bulk created. Entries that changed
+        are deleted and bulk created again, since nothing refers to them.
+
+        Returns:
+            The number of entries that were created or changed.
+
+        """
+        ids = [entry.ion_id for entry in entries]
+        users = User.objects.in_bulk(ids)
+        existing = self.in_bulk(ids)
+        fields = [field.attname for field in UserDirectoryEntry._meta.concrete_fields]
+
+        new_users = []
+        written = {}
+        for entry in entries:
+            entry.user_id = entry.ion_id
+            if entry.ion_id not in users and entry.ion_id not in written:
+                user = User(id=entry.ion_id, username=entry.ion_username)
+                user.set_unusable_password()
+                user.last_login = datetime(9999, 1, 1)
+                new_users.append(user)
+            old = existing.get(entry.ion_id)
+            if old is None or any(getattr(old, name) != getattr(entry, name) for name in fields):
+                written[entry.ion_id] = entry
+
+        User.objects.bulk_create(new_users)
+        self.filter(user_id__in=[user_id for user_id in written if user_id in existing]).delete()
+        self.bulk_create(written.values())
+        return len(written)
+
+    def mark_changed(self):
+        """Record that the mirror changed, so that data derived from it (e.g. the user search
+        index) is rebuilt."""
+        cache.set(self.version_cache_key, datetime.now().timestamp(), None)
+
+    def version(self):
+        """Return a value that changes whenever the mirror is synced with changes, or None if it
+        is not known."""
+        return cache.get(self.version_cache_key)
+
+    def visible_q(self, perm, prefix=""):
+        """Return a Q object matching users whose ``perm`` attribute (e.g. "showbirthday") is
+        visible to the public, following the same rules as :meth:`User.attribute_is_visible`.
+
+        ``prefix`` is prepended to the field names, e.g. "directory_entry__"
+        when filtering User objects.
+
+        """
+        parent = "{}perm_{}".format(prefix, perm)
+        return ~models.Q(**{parent: False}) & ~models.Q(**{parent + "_self": False})
+
+
+class UserDirectoryEntry(models.Model):
+    """A SQL mirror of the LDAP attributes of a user that hot paths filter and aggregate on.
+
+    Entries are written by the ``sync_ldap_directory`` management
+    command. LDAP remains the source of truth and all writes still go
+    through :meth:`User.set_ldap_attribute`, so the mirror can lag behind
+    LDAP until the next sync. It is only used when
+    ``LDAP_DIRECTORY_MIRROR`` is enabled.
+
+    """
+
+    objects = UserDirectoryEntryManager()
+
+    user = models.OneToOneField(User, primary_key=True, related_name="directory_entry")
+    dn = models.CharField(max_length=255, unique=True)
+    modify_timestamp = models.CharField(max_length=20, db_index=True)
+
+    ion_username = models.CharField(max_length=30)
+    user_type = models.CharField(max_length=30, blank=True)
+    graduation_year = models.PositiveIntegerField(null=True, db_index=True)
+    first_name = models.CharField(max_length=100, blank=True)
+    middle_name = models.CharField(max_length=100, blank=True)
+    last_name = models.CharField(max_length=100, blank=True)
+    nickname = models.CharField(max_length=100, blank=True)
+    sex = models.CharField(max_length=10, blank=True)
+    birthday = models.DateField(null=True)
+
+    # One field per attribute in User.ldap_permission_attributes; None means the attribute is not set
+    perm_showaddress = models.NullBooleanField()
+    perm_showtelephone = models.NullBooleanField()
+    perm_showbirthday = models.NullBooleanField()
+    perm_showschedule = models.NullBooleanField()
+    perm_showeighth = models.NullBooleanField()
+    perm_showpictures = models.NullBooleanField()
+    perm_showaddress_self = models.NullBooleanField()
+    perm_showtelephone_self = models.NullBooleanField()
+    perm_showbirthday_self = models.NullBooleanField()
+    perm_showschedule_self = models.NullBooleanField()
+    perm_showeighth_self = models.NullBooleanField()
+    perm_showpictures_self = models.NullBooleanField()
+
+    @property
+    def ion_id(self):
+        return self.user_id
+
+    @ion_id.setter
+    def ion_id(self, value):
+        self.user_id = value
+
+    def update_from_ldap(self, result):
+        """Set the mirrored fields from the raw attributes of an LDAP user entry."""
+
+        def first(ldap_name):
+            value = result.get(ldap_name)
+            if isinstance(value, (list, tuple)):
+                value = value[0] if value else None
+            return value
+
+        for name in UserDirectoryEntry.objects.synced_attributes:
+            value = first(User.ldap_user_attributes[name]["ldap_name"])
+            if name in ("ion_id", "graduation_year"):
+                value = int(value) if value else None
+            elif value is None:
+                value = ""
+            setattr(self, name, value)
+
+        birthday = first("birthday")
+        self.birthday = datetime.strptime(birthday, "%Y%m%d").date() if birthday else None
+
+        timestamp = first("modifyTimestamp")
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.strftime("%Y%m%d%H%M%SZ")
+        self.modify_timestamp = timestamp or ""
+
+        perms = User.parse_permissions(result)
+        for perm in User.ldap_permission_attributes:
+            name = perm[5:-5] if perm.endswith("-self") else perm[5:]
+            value = perms["self" if perm.endswith("-self") else "parent"].get(name)
+            setattr(self, perm.replace("-", "_"), value)
+
+    def __str__(self):
+        return self.dn
+
+
 class Class(object):
     """Represents a tjhsstClass LDAP object in which a user is enrolled.
 
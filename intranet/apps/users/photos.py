@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Profile pictures served from a local, content-addressed photo store."""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, quote_etag
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+PHOTO_YEARS = ["freshman", "sophomore", "junior", "senior"]
+
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png"}
+
+
+class StoredPhoto(object):
+    """A photo file in the photo store.
+
+    Originals are written to PHOTO_STORE_ROOT/originals under the SHA-256
+    of their contents, and resized copies to PHOTO_STORE_ROOT/<size>.
+
+    Attributes:
+        digest
+            The SHA-256 of the original photo.
+        size
+            The name of the size in PHOTO_SIZES, or None for the original.
+        path
+            The path of the file, relative to PHOTO_STORE_ROOT.
+
+    """
+
+    def __init__(self, digest, extension, size=None):
+        self.digest = digest
+        self.extension = extension
+        self.size = size
+        self.path = os.path.join(size or "originals", digest[:2], "{}.{}".format(digest, extension))
+
+    @property
+    def full_path(self):
+        return os.path.join(settings.PHOTO_STORE_ROOT, self.path)
+
+    @property
+    def content_type(self):
+        return CONTENT_TYPES[self.extension]
+
+    @property
+    def etag(self):
+        return "{}-{}".format(self.digest, self.size or "original")
+
+    def exists(self):
+        return os.path.exists(self.full_path)
+
+    def write(self, data):
+        """Atomically write the file, so other processes never see a partial photo."""
+        directory = os.path.dirname(self.full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, self.full_path)
+
+    def read(self):
+        with io.open(self.full_path, mode="rb") as f:
+            return f.read()
+
+    def __repr__(self):
+        return "<StoredPhoto {}>".format(self.path)
+
+
+def photo_extension(data):
+    return "png" if data.startswith(b"\x89PNG") else "jpg"
+
+
+def store_original(data):
+    """Add a photo to the store (if it isn't already there) and return it."""
+    original = StoredPhoto(hashlib.sha256(data).hexdigest(), photo_extension(data))
+    if not original.exists():
+        original.write(data)
+    return original
+
+
+def get_derivative(original, size):
+    """Return the copy of ``original`` resized to fit PHOTO_SIZES[size], creating it if needed."""
+    derivative = StoredPhoto(original.digest, "jpg", size)
+    if not derivative.exists():
+        image = Image.open(original.full_path)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail(settings.PHOTO_SIZES[size], Image.ANTIALIAS)
+        buf = io.BytesIO()
+        image.save(buf, "JPEG", quality=settings.PHOTO_JPEG_QUALITY, optimize=True, progressive=True)
+        derivative.write(buf.getvalue())
+        logger.debug("Created {} photo {}".format(size, derivative.path))
+    return derivative
+
+
+_default_original = None
+
+
+def get_default_original():
+    """Return the default profile picture, copied into the store the first time it is needed."""
+    global _default_original
+    if _default_original is None or not _default_original.exists():
+        with io.open(os.path.join(settings.PROJECT_ROOT, "static/img/default_profile_pic.png"), mode="rb") as f:
+            _default_original = store_original(f.read())
+    return _default_original
+
+
+def photo_digest_cache_key(user, photo_year):
+    return ":".join([user.dn, "photo_digest", photo_year])
+
+
+def get_original(user, photo_year):
+    """Return a user's picture from the given year, or None if it doesn't exist or can't be
+    seen by the current user."""
+    if not user.dn or not user.photo_is_visible(photo_year):
+        return None
+
+    key = photo_digest_cache_key(user, photo_year)
+    cached = cache.get(key)
+    if cached == "":
+        # The user has no picture for this year
+        return None
+    elif cached:
+        digest, extension = cached.split(".")
+        original = StoredPhoto(digest, extension)
+        if original.exists():
+            return original
+
+    data = user.load_photo_binary(photo_year)
+    if not data:
+        cache.set(key, "", timeout=settings.CACHE_AGE["ldap_permissions"])
+        return None
+
+    original = store_original(data)
+    cache.set(key, "{}.{}".format(original.digest, original.extension), timeout=settings.CACHE_AGE["ldap_permissions"])
+    return original
+
+
+def auto_photo_years(user):
+    """Return the photo years to try, in order, for the most recent picture of a user."""
+    if user.is_teacher:
+        current_grade = 12
+    elif user.grade is not None and user.grade.number:
+        current_grade = min(int(user.grade), 12)
+    else:
+        return []
+    return [PHOTO_YEARS[i - 9] for i in reversed(range(9, current_grade + 1))]
+
+
+def preferred_photo_years(user):
+    """Return the photo years to try, in order, for a user's preferred picture."""
+    preferred = user.preferred_photo
+    if preferred is not None and preferred.endswith("Photo"):
+        preferred = preferred[:-len("Photo")]
+
+    if preferred == "AUTO":
+        return auto_photo_years(user)
+    elif preferred in PHOTO_YEARS:
+        return [preferred]
+    return []
+
+
+def get_user_photo(user, years, size=None):
+    """Return the StoredPhoto to show for a user.
+
+    Only the digest of each of a user's pictures is cached, so this
+    normally needs no LDAP query; permissions are still checked every
+    time.
+
+    Args:
+        years: The years of the pictures to try ("freshman", ...,
+            "senior"), in order.
+        size: The name of a size in PHOTO_SIZES, or None for the original.
+
+    Returns:
+        The StoredPhoto of the first visible picture, or of the default
+        profile picture if there is none.
+
+    """
+    original = None
+    for year in years:
+        original = get_original(user, year)
+        if original is not None:
+            break
+
+    if original is None:
+        original = get_default_original()
+
+    if size in settings.PHOTO_SIZES:
+        return get_derivative(original, size)
+    return original
+
+
+def clear_photo_cache(user):
+    """Forget which pictures a user has, e.g. after their photo permissions change."""
+    for year in PHOTO_YEARS:
+        cache.delete(photo_digest_cache_key(user, year))
+        cache.delete(":".join([user.dn, "photo", year]))
+
+
+def photo_response(request, photo, filename):
+    """Return a response serving ``photo``, or a 304 if the client's copy is current.
+
+    Responses have a strong ETag and a Last-Modified date, and may be
+    cached privately for PHOTO_CACHE_MAX_AGE seconds. If
+    PHOTO_X_ACCEL_REDIRECT is set, the file itself is sent by nginx from
+    that internal location.
+
+    """
+    last_modified = int(os.path.getmtime(photo.full_path))
+
+    # Only the ETag is compared: after a permission change, a different
+    # (possibly older) file may be served for the same URL
+    etags = [etag.strip('"') for etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))]
+
+    if photo.etag in etags:
+        response = HttpResponseNotModified()
+    else:
+        if settings.PHOTO_X_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=photo.content_type)
+            response["X-Accel-Redirect"] = settings.PHOTO_X_ACCEL_REDIRECT + photo.path
+        else:
+            response = HttpResponse(photo.read(), content_type=photo.content_type)
+        response["Content-Disposition"] = "filename={}.{}".format(filename, photo.extension)
+
+    response["ETag"] = quote_etag(photo.etag)
+    response["Last-Modified"] = http_date(last_modified)
+    # Private, since whether a picture is shown depends on who is asking
+    response["Cache-Control"] = "private, max-age={}".format(settings.PHOTO_CACHE_MAX_AGE)
+    response["Vary"] = "Cookie, Authorization"
+    return response
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from django.db.models.signals import m2m_changed
+
+from .models import User
+from ...middleware import threadlocals
+
+
+def groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Forget the group memberships memoized by :meth:`User.member_of` for the current request
+    once they change."""
+    if not action.startswith("post_"):
+        return
+
+    threadlocals.forget("groups")
+    users = [] if reverse else [instance]
+    m = threadlocals.memo()
+    if m is not None:
+        users += m.users.values()
+    for user in users:
+        user.__dict__.pop("_groups_cache", None)
+
+
+def connect_signals():
+    m2m_changed.connect(groups_changed, sender=User.groups.through, dispatch_uid="user_groups_changed")
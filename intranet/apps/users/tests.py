@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import shutil
+import tempfile
 from io import StringIO
+from unittest.mock import patch
 
+from django.conf import settings
 from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory
 
+from .models import DirectorySyncError, User, UserDirectoryEntry
+from ..groups.models import Group
+from .photos import get_default_original, get_derivative, photo_response
+from ...db.ldap_db import LDAPConnection
+from ...middleware import threadlocals
+from ...middleware.threadlocals import ThreadLocalsMiddleware
 from ...test.ion_test import IonTestCase
 
 
@@ -17,3 +29,101 @@ class DynamicGroupTest(IonTestCase):
         output = ["9000: 0 users", "9000: Processed", "9001: 1 users", "9001: Processed", "9002: 0 users", "9002: Processed", "9003: 0 users",
                   "9003: Processed", "Done."]
         self.assertEqual(out.getvalue().splitlines(), output)
+
+
+class PrefetchLdapTest(IonTestCase):
+    """Tests batch-loading LDAP attributes."""
+
+    def test_prefetch_ldap(self):
+        user = User.get_user(username='awilliam')
+        users = User.objects.prefetch_ldap([user], ["last_name", "graduation_year", "permissions", "not_an_attribute"])
+        self.assertEqual(users, [user])
+        self.assertEqual(users[0].last_name, "Williams")
+        self.assertEqual(users[0].grade.number, 12 + settings.SENIOR_GRADUATION_YEAR - 9001)
+        self.assertEqual(User.objects.prefetch_ldap([], ["last_name"]), [])
+
+
+class RequestMemoTest(IonTestCase):
+    """Tests the per-request identity map of User objects."""
+
+    def test_get_user_identity_map(self):
+        middleware = ThreadLocalsMiddleware()
+        request = RequestFactory().get("/")
+        middleware.process_request(request)
+        user = User.get_user(username='awilliam')
+        self.assertIs(User.get_user(id=user.id), user)
+        self.assertIs(User.get_user(username='awilliam'), user)
+        self.assertEqual(User.dn_from_id(user.id), User.dn_from_id(user.id))
+        self.assertGreater(threadlocals.memo().avoided["cache"], 0)
+        middleware.process_response(request, HttpResponse())
+        self.assertIsNone(threadlocals.memo())
+        self.assertIsNot(User.get_user(username='awilliam'), user)
+
+    def test_member_of_after_group_change(self):
+        middleware = ThreadLocalsMiddleware()
+        request = RequestFactory().get("/")
+        middleware.process_request(request)
+        user = User.get_user(username='awilliam')
+        group = Group.objects.get_or_create(name="admin_all")[0]
+        self.assertFalse(user.has_admin_permission("eighth"))
+        user.groups.add(group)
+        self.assertTrue(user.has_admin_permission("eighth"))
+        group.user_set.remove(user)
+        self.assertFalse(User.get_user(username='awilliam').member_of("admin_all"))
+        middleware.process_response(request, HttpResponse())
+
+
+class DirectoryMirrorTest(IonTestCase):
+    """Tests syncing LDAP into the SQL directory mirror."""
+
+    def test_sync_ldap_directory(self):
+        out = StringIO()
+        call_command('sync_ldap_directory', '--full', stdout=out)
+        entry = UserDirectoryEntry.objects.get(ion_username='awilliam')
+        self.assertEqual(entry.last_name, "Williams")
+        self.assertEqual(entry.graduation_year, 9001)
+        # Unchanged entries are not written again
+        self.assertEqual(UserDirectoryEntry.objects.sync(full=True)[0], 0)
+
+        # An empty (e.g. failed) search does not wipe the mirror unless forced
+        with patch.object(LDAPConnection, "search", return_value=[]):
+            with self.assertRaises(DirectorySyncError):
+                UserDirectoryEntry.objects.sync(full=True)
+            mirrored = UserDirectoryEntry.objects.count()
+            self.assertGreater(mirrored, 0)
+            self.assertEqual(UserDirectoryEntry.objects.sync(full=True, force=True), (0, mirrored))
+        with self.settings(LDAP_DIRECTORY_MIRROR=True):
+            self.assertEqual([u.username for u in User.objects.users_in_year(9001)], ['awilliam'])
+
+
+class PhotoStoreTest(IonTestCase):
+    """Tests storing, resizing and serving profile pictures."""
+
+    def setUp(self):
+        self.store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store)
+
+    def test_photo_response(self):
+        with self.settings(PHOTO_STORE_ROOT=self.store, PHOTO_X_ACCEL_REDIRECT=None):
+            original = get_default_original()
+            self.assertTrue(original.exists())
+            roster = get_derivative(original, "roster")
+            self.assertEqual(roster.digest, original.digest)
+            self.assertTrue(roster.path.startswith("roster/"))
+            self.assertEqual(roster.content_type, "image/jpeg")
+
+            factory = RequestFactory()
+            response = photo_response(factory.get("/"), roster, "test")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, roster.read())
+            self.assertIn("private", response["Cache-Control"])
+
+            response = photo_response(factory.get("/", HTTP_IF_NONE_MATCH=response["ETag"]), roster, "test")
+            self.assertEqual(response.status_code, 304)
+            response = photo_response(factory.get("/", HTTP_IF_NONE_MATCH=response["ETag"]), original, "test")
+            self.assertEqual(response.status_code, 200)
+
+        with self.settings(PHOTO_STORE_ROOT=self.store, PHOTO_X_ACCEL_REDIRECT="/photos/"):
+            response = photo_response(RequestFactory().get("/"), roster, "test")
+            self.assertEqual(response["X-Accel-Redirect"], "/photos/" + roster.path)
+            self.assertEqual(response.content, b"")
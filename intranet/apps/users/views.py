@@ -1,11 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import csv
-import io
 import logging
-import os
 
-from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.http import Http404, HttpResponse
@@ -13,7 +10,8 @@ from django.shortcuts import redirect, render
 
 from intranet.db.ldap_db import LDAPConnection, LDAPFilter
 
-from .models import Class, Grade, User
+from .models import Class, User
+from .photos import get_user_photo, photo_response, preferred_photo_years
 from ..eighth.models import (EighthBlock, EighthScheduledActivity, EighthSignup, EighthSponsor)
 from ..eighth.utils import get_start_date
 
@@ -117,57 +115,20 @@ def picture_view(request, user_id, year=None):
             The user's picture from this year is fetched. If not
             specified, use the preferred picture.
 
+    The "size" GET parameter selects one of settings.PHOTO_SIZES.
+
     """
     try:
         user = User.get_user(id=user_id)
     except User.DoesNotExist:
         raise Http404
-    default_image_path = os.path.join(settings.PROJECT_ROOT, "static/img/default_profile_pic.png")
 
     if user is None:
         raise Http404
-    else:
-        if year is None:
-            preferred = user.preferred_photo
-            if preferred is not None:
-                if preferred.endswith("Photo"):
-                    preferred = preferred[:-len("Photo")]
-
-            if preferred == "AUTO":
-                data = user.default_photo()
-                if data is None:
-                    image_buffer = io.open(default_image_path, mode="rb")
-                else:
-                    image_buffer = io.BytesIO(data)
-
-            # Exclude 'graduate' from names array
-            elif preferred in Grade.names:
-                data = user.photo_binary(preferred)
-
-                if data:
-                    image_buffer = io.BytesIO(data)
-                else:
-                    image_buffer = io.open(default_image_path, mode="rb")
-            else:
-                image_buffer = io.open(default_image_path, mode="rb")
-        else:
-            data = user.photo_binary(year)
-            if data:
-                image_buffer = io.BytesIO(data)
-            else:
-                image_buffer = io.open(default_image_path, mode="rb")
-
-        response = HttpResponse(content_type="image/jpeg")
-        response["Content-Disposition"] = "filename={}_{}.jpg".format(user_id, year or preferred)
-        try:
-            img = image_buffer.read()
-        except UnicodeDecodeError:
-            img = io.open(default_image_path, mode="rb").read()
 
-        image_buffer.close()
-        response.write(img)
-
-        return response
+    years = [year] if year else preferred_photo_years(user)
+    photo = get_user_photo(user, years, request.GET.get("size"))
+    return photo_response(request, photo, "{}_{}".format(user_id, year or "preferred"))
 
 
 @login_required
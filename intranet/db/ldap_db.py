@@ -2,7 +2,9 @@
 
 import logging
 import sys
-from threading import local
+import time
+from collections import defaultdict
+from threading import Condition, local
 
 from django.conf import settings
 from django.core.handlers.wsgi import WSGIHandler
@@ -55,9 +57,210 @@ class LDAPFilter(object):
         return LDAPFilter.attribute_in_list("objectclass", user_object_classes)
 
 
+class LDAPConnectionPool(object):
+    """A bounded, per-worker pool of bound LDAP connections.
+
+    Connections are keyed by bind identity (server URL and bind DN), so
+    only binds that can be shared between requests should be pooled.
+    GSSAPI binds are made with the requesting user's Kerberos ticket and
+    are never pooled.
+
+    Idle connections are unbound once they have been idle for longer
+    than ``LDAP_POOL_MAX_IDLE`` seconds, and connections that have been
+    idle for longer than ``LDAP_POOL_CHECK_INTERVAL`` seconds are health
+    checked with a rootDSE read before they are handed out. At most
+    ``LDAP_POOL_SIZE`` connections per bind identity are open at once;
+    a checkout waits up to ``LDAP_POOL_TIMEOUT`` seconds for one to be
+    returned before falling back to an unpooled connection.
+
+    Attributes:
+        stats
+            A dictionary of counters (hits, misses, waits, wait_time,
+            timeouts, evictions, discards).
+
+    """
+
+    def __init__(self):
+        self._lock = Condition()
+        self._idle = defaultdict(list)  # key -> [(connection, time returned)]
+        self._open = defaultdict(int)  # key -> connections checked out or idle
+        self._keys = {}  # id(connection) -> key
+        self.stats = defaultdict(int)
+
+    def _evict_idle(self, key, now):
+        """Unbind connections that have been idle for too long.
+
+        Must be called with the lock held.
+
+        """
+        max_idle = settings.LDAP_POOL_MAX_IDLE
+        fresh = []
+        for conn, returned in self._idle[key]:
+            if now - returned > max_idle:
+                self._discard(key, conn)
+                self.stats["evictions"] += 1
+            else:
+                fresh.append((conn, returned))
+        self._idle[key] = fresh
+
+    def _is_healthy(self, conn, idle_time):
+        if conn.closed or not conn.bound:
+            return False
+        if idle_time < settings.LDAP_POOL_CHECK_INTERVAL:
+            return True
+        try:
+            return conn.search("", "(objectClass=*)", search_scope=ldap3.BASE, attributes=["objectClass"])
+        except (ldap3.LDAPExceptionError, ldap3.LDAPSocketOpenError) as e:
+            logger.info("Discarding unhealthy pooled LDAP connection: {}".format(e))
+            return False
+
+    def _discard(self, key, conn):
+        """Close a pooled connection and stop tracking it.
+
+        Must be called with the lock held.
+
+        """
+        self._keys.pop(id(conn), None)
+        self._open[key] -= 1
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            if conn.bound:
+                conn.unbind()
+        except (ldap3.LDAPExceptionError, ldap3.LDAPSocketOpenError):
+            pass
+
+    def checkout(self, server_url, user, password):
+        """Return a bound connection for the given identity, creating one if necessary.
+
+        Returns:
+            A bound :class:`ldap3.Connection`, or None if the server is unreachable.
+
+        """
+        key = (server_url, user)
+        size = settings.LDAP_POOL_SIZE
+        deadline = None
+        while True:
+            conn = None
+            with self._lock:
+                while True:
+                    now = time.time()
+                    self._evict_idle(key, now)
+                    if self._idle[key]:
+                        conn, returned = self._idle[key].pop()
+                        break
+
+                    if self._open[key] < size:
+                        self._open[key] += 1
+                        break
+
+                    if deadline is None:
+                        deadline = now + settings.LDAP_POOL_TIMEOUT
+                        self.stats["waits"] += 1
+                    if now >= deadline:
+                        self.stats["timeouts"] += 1
+                        logger.warning("LDAP connection pool exhausted for {}; using an unpooled connection".format(user))
+                        return self._connect(server_url, user, password)
+                    self._lock.wait(deadline - now)
+                    self.stats["wait_time"] += time.time() - now
+
+            if conn is None:
+                break
+
+            # The connection is checked out, so it can be health checked
+            # without holding up other threads waiting on the pool
+            if self._is_healthy(conn, now - returned):
+                self.stats["hits"] += 1
+                return conn
+            with self._lock:
+                self._keys.pop(id(conn), None)
+                self._open[key] -= 1
+                self.stats["discards"] += 1
+                self._lock.notify()
+            self._close(conn)
+
+        self.stats["misses"] += 1
+        conn = self._connect(server_url, user, password)
+        with self._lock:
+            if conn is None:
+                self._open[key] -= 1
+                self._lock.notify()
+            else:
+                self._keys[id(conn)] = key
+        return conn
+
+    @staticmethod
+    def _connect(server_url, user, password):
+        conn = ldap3.Connection(ldap3.Server(server_url), user, password)
+        try:
+            conn.bind()
+        except ldap3.LDAPSocketOpenError as e:
+            logger.critical("Failed to connect to ldap server: %s", e)
+            return None
+        return conn
+
+    def checkin(self, conn):
+        """Return a connection to the pool.
+
+        Connections that were not checked out of the pool (because it
+        was exhausted) or that are no longer bound are closed instead.
+
+        """
+        with self._lock:
+            key = self._keys.get(id(conn))
+            if key is None:
+                self._close(conn)
+                return
+            if conn.closed or not conn.bound:
+                self._discard(key, conn)
+                self.stats["discards"] += 1
+            else:
+                self._idle[key].append((conn, time.time()))
+            self._lock.notify()
+
+    def clear(self):
+        """Unbind all idle connections."""
+        with self._lock:
+            for key, idle in self._idle.items():
+                for conn, returned in idle:
+                    self._discard(key, conn)
+                idle.clear()
+            self._lock.notify_all()
+
+    def get_stats(self):
+        """Return a snapshot of the pool counters and sizes."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["idle"] = sum(len(idle) for idle in self._idle.values())
+            stats["open"] = sum(self._open.values())
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        stats["hit_ratio"] = stats.get("hits", 0) / lookups if lookups else None
+        return stats
+
+
+ldap_pool = LDAPConnectionPool()
+
+
+def search_count():
+    """Return the number of LDAP searches made so far by the current thread."""
+    return getattr(_thread_locals, "search_count", 0)
+
+
+def search_time():
+    """Return the number of seconds spent on LDAP searches so far by the current thread."""
+    return getattr(_thread_locals, "search_time", 0.0)
+
+
 class LDAPConnection(object):
     """Represents an LDAP connection with wrappers for the raw ldap queries.
 
+    Simple (service account) binds are checked out of :data:`ldap_pool`
+    and returned to it when the request finishes. GSSAPI binds use the
+    requesting user's credentials, so a new connection is bound for
+    every request.
+
     Attributes:
         conn
             The singleton LDAP connection.
@@ -65,12 +268,8 @@ class LDAPConnection(object):
     """
 
     def simple_bind(self, server):
-        _thread_locals.ldap_conn = ldap3.Connection(server, settings.AUTHUSER_DN, settings.AUTHUSER_PASSWORD)
-        try:
-            _thread_locals.ldap_conn.bind()
-        except ldap3.LDAPSocketOpenError as e:
-            logging.critical("Failed to connect to ldap server: %s", e)
-            _thread_locals.ldap_conn = None
+        _thread_locals.ldap_conn = ldap_pool.checkout(server.name, settings.AUTHUSER_DN, settings.AUTHUSER_PASSWORD)
+        _thread_locals.pooled = _thread_locals.ldap_conn is not None
         _thread_locals.simple_bind = True
 
     @property
@@ -95,6 +294,7 @@ class LDAPConnection(object):
                     _thread_locals.ldap_conn = ldap3.Connection(server, authentication=ldap3.SASL, sasl_mechanism='GSSAPI')
                     _thread_locals.ldap_conn.bind()
                     _thread_locals.simple_bind = False
+                    _thread_locals.pooled = False
                     logger.info("Successfully connected to LDAP.")
                 except ldap_exceptions as e:
                     logger.warning("SASL bind failed - using simple bind")
@@ -139,8 +339,13 @@ class LDAPConnection(object):
         if not filter.endswith(')'):
             filter = "(%s)" % filter
 
-        self.conn.search(dn, filter, attributes=attributes)
-        return self.conn.response
+        _thread_locals.search_count = search_count() + 1
+        start = time.time()
+        try:
+            self.conn.search(dn, filter, attributes=attributes)
+            return self.conn.response
+        finally:
+            _thread_locals.search_time = search_time() + time.time() - start
 
     def user_attributes(self, dn, attributes):
         """Fetch a list of attributes of the specified user.
@@ -267,16 +472,22 @@ def close_ldap_connection(sender, **kwargs):
     receipt, unbinds from the directory, terminates the current
     association, and frees resources.
 
-    It would be nice if we could leave the connections open in a pool,
-    but it looks like rebinding on an open connection isn't possible
-    with GSSAPI binds.
+    Simple bind connections are returned to the pool instead. GSSAPI
+    connections can't be pooled, since rebinding on an open connection
+    isn't possible with GSSAPI binds.
 
     """
     if hasattr(_thread_locals, "ldap_conn"):
         if _thread_locals.ldap_conn is not None:
-            if _thread_locals.ldap_conn.bound:
-                _thread_locals.ldap_conn.unbind()
+            if getattr(_thread_locals, "pooled", False):
+                ldap_pool.checkin(_thread_locals.ldap_conn)
+                logger.debug("LDAP connection returned to pool: {}".format(ldap_pool.get_stats()))
+            else:
+                if _thread_locals.ldap_conn.bound:
+                    _thread_locals.ldap_conn.unbind()
+                logger.info("LDAP connection closed.")
             _thread_locals.ldap_conn = None
-            logger.info("LDAP connection closed.")
+    if hasattr(_thread_locals, "pooled"):
+        del _thread_locals.pooled
     if hasattr(_thread_locals, "simple_bind"):
         del _thread_locals.simple_bind
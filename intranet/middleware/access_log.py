@@ -2,6 +2,8 @@
 import logging
 from datetime import datetime
 
+from ..utils import telemetry
+
 logger = logging.getLogger("intranet_access")
 
 
@@ -24,6 +26,10 @@ class AccessLogMiddleWare(object):
         log_line = "{} - {} - [{}] \"{}\" \"{}\"".format(ip, username, datetime.now(), request.get_full_path(), request.META.get("HTTP_USER_AGENT",
                                                                                                                                  ""))
 
+        stats = telemetry.current()
+        if stats is not None:
+            log_line += " {} {}".format(response.status_code, stats.summary())
+
         logger.info(log_line)
 
         return response
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from ..utils import telemetry
+
+
+class TelemetryMiddleware(object):
+    """Counts the LDAP searches, SQL queries and cache calls of each request.
+
+    The counts are added to the access log and a Server-Timing header,
+    and recorded for each view in :data:`intranet.utils.telemetry.view_stats`.
+    This should be the first middleware, so that it times the rest.
+
+    """
+
+    def process_request(self, request):
+        for connection in connections.all():
+            telemetry.instrument_connection(connection)
+        telemetry.instrument_cache(caches["default"])
+        telemetry.start_request()
+
+    def process_response(self, request, response):
+        stats = telemetry.end_request()
+        if stats is None:
+            return response
+
+        if settings.TELEMETRY_SERVER_TIMING:
+            response["Server-Timing"] = stats.server_timing()
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        telemetry.view_stats.record(view, stats.sample())
+
+        return response
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from collections import defaultdict
 from threading import local
 
+from django.conf import settings
+
+from ..db.ldap_db import search_count
+
 logger = logging.getLogger(__name__)
 _thread_locals = local()
 
@@ -17,11 +22,117 @@ def request():
     return getattr(_thread_locals, "request", None)
 
 
+class RequestMemo(object):
+    """An identity map of User objects and a memo of values loaded from LDAP or the cache, both
+    scoped to a single request.
+
+    Attributes:
+        users
+            Maps ("id", id), ("username", username) and ("dn", dn) to
+            the User object that was returned for it.
+        values
+            Maps memo keys to tuples of the memoized value and the number
+            of LDAP searches it took to compute it.
+        avoided
+            Approximate counts of the "cache" and "ldap" calls that were
+            skipped because of the memo.
+
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.values = {}
+        self.avoided = defaultdict(int)
+
+    def get_user(self, dn=None, id=None, username=None):
+        for key in (("id", id), ("username", username), ("dn", dn)):
+            if key[1] is not None and key in self.users:
+                self.avoided["cache"] += 1
+                return self.users[key]
+        return None
+
+    def add_user(self, user, dn=None):
+        for key in (("id", user.id), ("username", user.username), ("dn", dn or user._dn)):
+            if key[1] is not None:
+                self.users[key] = user
+
+    def forget(self, first):
+        """Drop every memoized value whose key starts with ``first``."""
+        for key in [k for k in self.values if k[0] == first]:
+            del self.values[key]
+
+
+def memo():
+    """Return the :class:`RequestMemo` of the current request, or None outside of a request."""
+    return getattr(_thread_locals, "memo", None)
+
+
+def memoize(key, func):
+    """Return the value memoized under ``key`` for the current request, calling ``func`` to compute
+    it the first time.
+
+    Outside of a request (or if any part of ``key`` is None), ``func`` is
+    always called.
+
+    """
+    m = memo()
+    if m is None or None in key:
+        return func()
+
+    if key in m.values:
+        value, searches = m.values[key]
+        m.avoided["cache"] += 1
+        m.avoided["ldap"] += searches
+        return value
+
+    before = search_count()
+    value = func()
+    m.values[key] = (value, search_count() - before)
+    return value
+
+
+def request_memoized(key_func):
+    """Decorator that memoizes a method for the rest of the request under the key returned by
+    ``key_func(self)``."""
+
+    def decorator(func):
+
+        def wrapped(self):
+            return memoize(key_func(self), lambda: func(self))
+
+        wrapped.__name__ = func.__name__
+        wrapped.__doc__ = func.__doc__
+        return wrapped
+
+    return decorator
+
+
+def forget(first):
+    """Drop memoized values of the current request whose key starts with ``first``."""
+    m = memo()
+    if m is not None:
+        m.forget(first)
+
+
 class ThreadLocalsMiddleware(object):
     """Stores the current authorized User object in thread locals for access in models (and
     elsewhere) without passing the user around as an argument."""
 
     def process_request(self, request):
-        """Adds the request to thread locals."""
+        """Adds the request and an empty :class:`RequestMemo` to thread locals."""
 
         _thread_locals.request = request
+        _thread_locals.memo = RequestMemo()
+
+    def process_response(self, request, response):
+        """Reports and discards the request's :class:`RequestMemo`."""
+
+        m = memo()
+        if m is not None:
+            avoided = "cache={}, ldap={}".format(m.avoided["cache"], m.avoided["ldap"])
+            logger.debug("Request memo for {} avoided {}".format(request.path, avoided))
+            if settings.DEBUG:
+                response["X-Ion-Memo-Avoided"] = avoided
+            del _thread_locals.memo
+
+        return response
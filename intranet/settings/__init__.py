@@ -83,6 +83,21 @@ EMAIL_SUBJECT_PREFIX = "[Ion] "
 EMAIL_ANNOUNCEMENTS = True
 
 EMAIL_FROM = "ion-noreply@tjhsst.edu"
+EMAIL_BCC_BATCH_SIZE = 100  # addresses per message when emailing many users at once
+EMAIL_SEND_BATCH_SIZE = 50  # messages per SMTP connection when emailing many users individually
+EMAIL_SEND_THREADS = 4  # SMTP connections used at once when emailing many users individually
+
+# Background jobs (see intranet.apps.notifications.jobs). Without
+# JOB_QUEUE_ASYNC, jobs run inline when they are enqueued; with it, they are
+# run by "manage.py run_jobs" workers.
+JOB_QUEUE_ASYNC = os.getenv("JOB_QUEUE_ASYNC", "NO") == "YES"
+JOB_QUEUE_CONCURRENCY = 4  # worker threads per run_jobs process
+JOB_QUEUE_MAX_ATTEMPTS = 5
+JOB_QUEUE_RETRY_DELAY = 30  # seconds before the first retry, doubled after each failure
+JOB_QUEUE_POLL_INTERVAL = 5  # seconds
+JOB_QUEUE_HEARTBEAT_INTERVAL = 30  # seconds between the heartbeats of a running job
+JOB_QUEUE_TIMEOUT = 60 * 5  # seconds without a heartbeat before a running job is assumed lost and requeued
+JOB_QUEUE_KEEP_DAYS = 30
 
 # Address to send production error messages
 # define in secret.py
@@ -192,6 +207,21 @@ MEDIA_ROOT = os.path.join(os.path.dirname(PROJECT_ROOT), 'uploads')
 # Not used.
 MEDIA_URL = ""
 
+# Local store of profile pictures and their resized copies (see intranet.apps.users.photos)
+PHOTO_STORE_ROOT = os.path.join(os.path.dirname(PROJECT_ROOT), 'photos')
+
+# Sizes (width, height) that profile pictures can be requested in with ?size=
+PHOTO_SIZES = {"roster": (86, 108), "profile": (172, 215), "signage": (344, 430)}
+PHOTO_JPEG_QUALITY = 85
+
+# Seconds browsers may reuse a picture before revalidating it. This bounds how long a picture can
+# remain visible to someone after its owner hides it.
+PHOTO_CACHE_MAX_AGE = 60 * 60
+
+# If set (e.g. "/photos-internal/"), pictures are sent by nginx from this internal location, which
+# must alias PHOTO_STORE_ROOT, using X-Accel-Redirect
+PHOTO_X_ACCEL_REDIRECT = None
+
 TEST_RUNNER = "django.test.runner.DiscoverRunner"
 
 # Absolute path to the directory static files should be collected to.
@@ -308,6 +338,7 @@ if not PRODUCTION and os.getenv("WARN_INVALID_TEMPLATE_VARS", "NO") == "YES":
     TEMPLATES[0]["OPTIONS"]["string_if_invalid"] = helpers.InvalidString("%s")
 
 MIDDLEWARE_CLASSES = [
+    "intranet.middleware.telemetry.TelemetryMiddleware",  # LDAP, SQL and cache counters for each request
     "intranet.middleware.url_slashes.FixSlashes",  # Remove slashes in URLs
     "django.middleware.common.CommonMiddleware",  # Django default
     "django.contrib.sessions.middleware.SessionMiddleware",  # Django sessions
@@ -331,6 +362,17 @@ MIDDLEWARE_CLASSES = [
     "simple_history.middleware.HistoryRequestMiddleware"
 ]
 
+# Per-request telemetry (see intranet.utils.telemetry). Whether to send a
+# Server-Timing header with the time spent on LDAP, SQL and the cache.
+TELEMETRY_SERVER_TIMING = True
+
+# Number of recent requests of each view that percentiles are computed from
+TELEMETRY_SAMPLES = 200
+
+# Seconds between copies of each process's samples to the cache, where the
+# telemetry page reads them from
+TELEMETRY_PUBLISH_INTERVAL = 30
+
 # URLconf at urls.py
 ROOT_URLCONF = "intranet.urls"
 
@@ -356,7 +398,13 @@ CACHE_AGE = {
     "bell_schedule": int(datetime.timedelta(weeks=1).total_seconds()),
     "ldap_permissions": int(datetime.timedelta(hours=24).total_seconds()),
     "users_list": int(datetime.timedelta(hours=24).total_seconds()),
-    "emerg": int(datetime.timedelta(minutes=5).total_seconds())
+    "eighth_block_payload": int(datetime.timedelta(hours=1).total_seconds()),
+    "emerg": int(datetime.timedelta(minutes=5).total_seconds()),
+    "dashboard_feed": int(datetime.timedelta(hours=1).total_seconds()),
+    "poll_results": int(datetime.timedelta(hours=24).total_seconds()),
+    "block_rosters": int(datetime.timedelta(hours=24).total_seconds()),
+    "eighth_signup_summary": int(datetime.timedelta(hours=24).total_seconds()),
+    "eighth_activity_statistics": int(datetime.timedelta(hours=24).total_seconds())
 }
 
 if not PRODUCTION and os.getenv("SHORT_CACHE", "NO") == "YES":
@@ -424,6 +472,30 @@ LDAP_REALM = CSL_REALM
 LDAP_SERVER = "ldap://iodine-ldap.tjhsst.edu"
 KINIT_TIMEOUT = 15  # seconds before pexpect timeouts
 
+# Pool of simple bind LDAP connections (per worker process)
+LDAP_POOL_SIZE = 4  # maximum open connections per bind identity
+LDAP_POOL_MAX_IDLE = 300  # seconds before an idle connection is unbound
+LDAP_POOL_CHECK_INTERVAL = 60  # seconds idle before a connection is health checked
+LDAP_POOL_TIMEOUT = 5  # seconds to wait for a free connection
+
+# Maximum number of users fetched per search by User.objects.prefetch_ldap()
+LDAP_PREFETCH_CHUNK_SIZE = 100
+
+# Cache all of a user's LDAP attributes as one signed entry instead of one
+# cache key per attribute (see User.get_ldap_entry())
+LDAP_USER_ENTRY_CACHE = os.getenv("LDAP_USER_ENTRY_CACHE", "NO") == "YES"
+
+# Answer bulk user queries (e.g. User.objects.users_in_year()) from the SQL
+# mirror of LDAP kept up to date by the sync_ldap_directory command
+LDAP_DIRECTORY_MIRROR = os.getenv("LDAP_DIRECTORY_MIRROR", "NO") == "YES"
+
+# Seconds before the in-process user search index (built from the directory
+# mirror) is rebuilt even if no sync has been recorded
+USER_SEARCH_INDEX_MAX_AGE = 60 * 15
+
+# Number of activities, announcements and events shown per page of search results
+SEARCH_RESULTS_PER_PAGE = 25
+
 AUTHUSER_DN = "cn=authuser,dc=tjhsst,dc=edu"
 
 # LDAP schema config
@@ -483,6 +555,7 @@ INSTALLED_APPS = [
     "intranet.apps.api",
     "intranet.apps.auth",
     "intranet.apps.board",
+    "intranet.apps.dashboard",
     "intranet.apps.eighth",
     "intranet.apps.events",
     "intranet.apps.groups",
@@ -516,6 +589,14 @@ INSTALLED_APPS = [
 # Post Django 1.8.7, this can no longer be used in templates.
 EIGHTH_BLOCK_DATE_FORMAT = "D, N j, Y"
 
+# Number of processes that render the PDF rosters of a block, each rendering at
+# least ROSTER_RENDER_CHUNK_SIZE rosters (see intranet.apps.eighth.rosters). If
+# this is more than 1, every web worker starts this many processes when it starts,
+# and they stay resident (e.g. 9 gunicorn workers with 4 processes each are 36
+# extra copies of Django), so rosters are rendered in the worker by default.
+ROSTER_RENDER_PROCESSES = 1
+ROSTER_RENDER_CHUNK_SIZE = 25
+
 # See http://docs.djangoproject.com/en/dev/topics/logging for
 # more details on how to customize your logging configuration.
 LOG_LEVEL = "DEBUG" if LOGGING_VERBOSE else "INFO"
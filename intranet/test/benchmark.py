@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""Seed a realistic school into a test database and an in-memory LDAP server, and measure how
+the busiest pages perform under concurrent clients.
+
+Used by ``./manage.py benchmark``.
+
+"""
+
+import datetime
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from os.path import abspath, dirname, join
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.db import connections
+from django.db.models import Count
+from django.test import Client
+
+from ..apps.eighth.models import (EighthActivity, EighthBlock, EighthRoom, EighthScheduledActivity, EighthSignup, EighthSponsor)
+from ..apps.users.models import Grade, User
+from ..utils import telemetry
+
+logger = logging.getLogger(__name__)
+
+LDAP_DIR = join(dirname(abspath(__file__)), "..", "static", "ldap")
+
+FIRST_NAMES = ["Aaron", "Aisha", "Alex", "Ananya", "Ben", "Chen", "Daniel", "Divya", "Emily", "Ethan", "Grace", "Hannah", "Isaac", "Jacob",
+               "Jasmine", "Kevin", "Lily", "Maya", "Michael", "Nathan", "Olivia", "Priya", "Rahul", "Sarah", "Sophia", "Tyler", "William", "Zoe"]
+
+LAST_NAMES = ["Anderson", "Brown", "Chen", "Davis", "Garcia", "Gupta", "Johnson", "Kim", "Lee", "Lopez", "Martin", "Miller", "Nguyen",
+              "Patel", "Rodriguez", "Shah", "Smith", "Taylor", "Thomas", "Wang", "Williams", "Wilson", "Wu", "Zhang"]
+
+STUDENT_ID_START = 10000
+TEACHER_ID_START = 5000
+ADMIN_ID = 4999
+
+
+class School(object):
+    """The users, activities and blocks seeded for a benchmark.
+
+    Attributes:
+        students
+            A list of (id, username, first name, last name, graduation year) tuples.
+        teachers
+            A list of (id, username, first name, last name) tuples.
+        blocks
+            The EighthBlocks, in order. Every student is signed up for every
+            block but the last, which is left empty for the signup rush.
+
+    """
+
+    def __init__(self, num_students=2000, num_activities=200, num_days=5, seed=0):
+        self.rng = random.Random(seed)
+        self.num_students = num_students
+        self.num_activities = num_activities
+        self.num_days = num_days
+        self.students = []
+        self.teachers = []
+        self.blocks = []
+        self.activity_ids = []
+        self.attendance = {}
+        self.admin = None
+
+    def generate_users(self):
+        used = set()
+        for i in range(self.num_students):
+            first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+            year = Grade.year_from_grade(self.rng.randint(9, 12))
+            username = "{}{}{}".format(year, first[0], last).lower()
+            if username in used:
+                username += str(i)
+            used.add(username)
+            self.students.append((STUDENT_ID_START + i, username, first, last, year))
+
+        for i in range(max(self.num_activities * 3 // 4, 1)):
+            first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+            self.teachers.append((TEACHER_ID_START + i, "{}{}{}".format(first[0], last, i).lower(), first, last))
+
+    def ldif(self):
+        """Return LDIF entries for every seeded user."""
+        entries = []
+        for uid, username, first, last, year in self.students:
+            entries.append(ldif_entry("tjhsstStudent", uid, username, first, last, graduationYear=year))
+        for uid, username, first, last in self.teachers:
+            entries.append(ldif_entry("tjhsstTeacher", uid, username, first, last))
+        entries.append(ldif_entry("tjhsstTeacher", ADMIN_ID, "benchadmin", "Eighth", "Admin"))
+        return "\n".join(entries)
+
+    def write_ldif(self):
+        """Write the LDIF to a temporary file and return its path."""
+        fd, path = tempfile.mkstemp(suffix=".ldif")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.ldif())
+        return path
+
+    def seed_database(self):
+        """Create the users, rooms, activities, blocks and existing signups."""
+        User.objects.bulk_create([User(id=uid, username=username) for uid, username, _, _, _ in self.students], batch_size=500)
+        User.objects.bulk_create([User(id=uid, username=username) for uid, username, _, _ in self.teachers], batch_size=500)
+        self.admin = User.objects.create(id=ADMIN_ID, username="benchadmin")
+        self.admin.groups.add(Group.objects.get_or_create(name="admin_eighth")[0])
+
+        EighthSponsor.objects.bulk_create(
+            [EighthSponsor(first_name=first, last_name=last, user_id=uid) for uid, _, first, last in self.teachers])
+        sponsors = list(EighthSponsor.objects.all())
+
+        EighthRoom.objects.bulk_create([EighthRoom(name="Room {}".format(100 + i), capacity=self.rng.choice([20, 25, 30, 40]))
+                                        for i in range(max(self.num_activities // 2, 1))])
+        rooms = list(EighthRoom.objects.all())
+
+        EighthActivity.objects.bulk_create([EighthActivity(name="Activity {}".format(i), description="Benchmark activity {}".format(i))
+                                            for i in range(self.num_activities)])
+        activities = list(EighthActivity.objects.all())
+        self.activity_ids = [activity.id for activity in activities]
+        for activity in activities:
+            activity.sponsors.add(self.rng.choice(sponsors))
+            activity.rooms.add(self.rng.choice(rooms))
+
+        day = datetime.date.today() + datetime.timedelta(days=1)
+        while len(self.blocks) < self.num_days * 2:
+            if day.weekday() < 5:
+                for letter in ("A", "B"):
+                    self.blocks.append(EighthBlock.objects.create(date=day, block_letter=letter))
+            day += datetime.timedelta(days=1)
+
+        EighthScheduledActivity.objects.bulk_create([EighthScheduledActivity(block=block, activity=activity)
+                                                     for block in self.blocks for activity in activities], batch_size=500)
+
+        scheduled = defaultdict(list)
+        for sa in EighthScheduledActivity.objects.all():
+            scheduled[sa.block_id].append(sa.id)
+
+        signups = []
+        for block in self.blocks[:-1]:
+            for uid, _, _, _, _ in self.students:
+                signups.append(EighthSignup(user_id=uid, scheduled_activity_id=self.rng.choice(scheduled[block.id])))
+        EighthSignup.objects.bulk_create(signups, batch_size=1000)
+
+        for sa_id, count in EighthSignup.objects.values_list("scheduled_activity").annotate(Count("id")):
+            EighthScheduledActivity.objects.filter(id=sa_id).update(member_count=count)
+
+        # Attendance is taken for the first block, for the activities that have members
+        self.attendance = defaultdict(list)
+        for sa_id, user_id in EighthSignup.objects.filter(scheduled_activity__block=self.blocks[0]).values_list("scheduled_activity", "user"):
+            self.attendance[sa_id].append(user_id)
+
+    @property
+    def rush_block(self):
+        return self.blocks[-1]
+
+
+def ldif_entry(object_class, uid, username, first, last, **attributes):
+    lines = ["dn: iodineUid={},ou=people,dc=tjhsst,dc=edu".format(username), "changetype: add", "objectClass: {}".format(object_class),
+             "iodineUid: {}".format(username), "iodineUidNumber: {}".format(uid), "cn: {} {}".format(first, last),
+             "givenName: {}".format(first), "sn: {}".format(last), "style: default", "header: TRUE", "chrome: TRUE"]
+    lines += ["{}: {}".format(name, value) for name, value in attributes.items()]
+    return "\n".join(lines) + "\n"
+
+
+def start_ldap_server(ldif_path):
+    """Start an in-memory LDAP server (from the python-ldap-test package) with the base entries
+    and the given LDIF file, and return it."""
+    from ldap_test import LdapServer
+
+    server = LdapServer({"base": {"objectclass": "organization", "dn": "dc=tjhsst,dc=edu"}, "ldifs": [join(LDAP_DIR, "base.ldif"), ldif_path]})
+    server.start()
+    return server
+
+
+class Scenario(object):
+    """A scripted request made repeatedly by each benchmark client.
+
+    Attributes:
+        name
+            The name used to select the scenario and in the report.
+        admin
+            Whether clients log in as the eighth period admin rather than
+            as a student.
+
+    """
+
+    def __init__(self, name, request, admin=False):
+        self.name = name
+        self.request = request
+        self.admin = admin
+
+
+def dashboard_request(client, school, student, rng):
+    return client.get("/")
+
+
+def block_request(client, school, student, rng):
+    return client.get("/eighth/signup/{}".format(rng.choice(school.blocks).id))
+
+
+def signup_request(client, school, student, rng):
+    return client.post("/eighth/signup", {"uid": student[0], "bid": school.rush_block.id, "aid": rng.choice(school.activity_ids)})
+
+
+def attendance_request(client, school, student, rng):
+    sa_id = rng.choice(sorted(school.attendance))
+    present = {str(uid): "on" for uid in school.attendance[sa_id] if rng.random() < 0.9}
+    return client.post("/eighth/attendance/{}".format(sa_id), present)
+
+
+def search_request(client, school, student, rng):
+    return client.get("/search", {"q": rng.choice(LAST_NAMES)[:rng.randint(3, 6)]})
+
+
+SCENARIOS = [
+    Scenario("dashboard", dashboard_request),
+    Scenario("block", block_request),
+    Scenario("signup", signup_request),
+    Scenario("attendance", attendance_request, admin=True),
+    Scenario("search", search_request),
+]
+
+
+def run_client(scenario, school, student, requests, warmup, seed, samples, lock):
+    rng = random.Random(seed)
+    client = Client()
+    client.force_login(school.admin if scenario.admin else User.objects.get(id=student[0]))
+    try:
+        for i in range(warmup + requests):
+            start = time.time()
+            try:
+                status_code = scenario.request(client, school, student, rng).status_code
+            except Exception:
+                # The test client re-raises exceptions from views, which would be a 500
+                logger.exception("{} request failed".format(scenario.name))
+                status_code = 500
+            elapsed = time.time() - start
+            stats = telemetry.last_request()
+            if i >= warmup:
+                sample = (elapsed * 1000, status_code, stats.sql_queries if stats else None, stats.ldap_searches if stats else None)
+                with lock:
+                    samples.append(sample)
+    finally:
+        for connection in connections.all():
+            connection.close()
+
+
+def run_scenario(scenario, school, clients=10, requests=20, warmup=2, seed=0):
+    """Run ``scenario`` with ``clients`` concurrent clients making ``requests`` requests each, and
+    return a dict of the results."""
+    samples = []
+    lock = threading.Lock()
+    students = school.rng.sample(school.students, clients)
+    threads = [threading.Thread(target=run_client, args=(scenario, school, student, requests, warmup, seed + i, samples, lock))
+               for i, student in enumerate(students)]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+
+    return summarize_samples(samples, duration)
+
+
+def distribution(values, *fractions):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    result = {"mean": round(sum(values) / len(values), 2), "max": values[-1]}
+    for fraction in fractions:
+        result["p{}".format(int(fraction * 100))] = telemetry.percentile(values, fraction)
+    return result
+
+
+def summarize_samples(samples, duration):
+    status_codes = defaultdict(int)
+    for sample in samples:
+        status_codes[str(sample[1])] += 1
+
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample[1] >= 500),
+        "status_codes": dict(status_codes),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(samples) / duration, 2) if duration else None,
+        "latency_ms": distribution([round(sample[0], 2) for sample in samples], 0.5, 0.95, 0.99),
+        "queries_per_request": distribution([sample[2] for sample in samples], 0.5, 0.95),
+        "ldap_per_request": distribution([sample[3] for sample in samples], 0.5, 0.95)
+    }
+
+
+# Metrics compared against a baseline report, as (name, path) pairs. Higher is worse for all of them.
+COMPARED_METRICS = [("p50_ms", ("latency_ms", "p50")), ("p95_ms", ("latency_ms", "p95")), ("p99_ms", ("latency_ms", "p99")),
+                    ("queries", ("queries_per_request", "mean")), ("ldap", ("ldap_per_request", "mean"))]
+
+
+def compare_reports(report, baseline):
+    """Return the relative change of each compared metric of each scenario from ``baseline``,
+    e.g. 0.1 for 10% slower."""
+    changes = {}
+    for name, results in report["scenarios"].items():
+        if name not in baseline.get("scenarios", {}):
+            continue
+        changes[name] = {}
+        for metric, (group, key) in COMPARED_METRICS:
+            old = (baseline["scenarios"][name].get(group) or {}).get(key)
+            new = (results.get(group) or {}).get(key)
+            if old and new is not None:
+                changes[name][metric] = round((new - old) / old, 3)
+            elif old == 0 and new is not None:
+                changes[name][metric] = 0.0 if new == 0 else None
+    return changes
+
+
+def benchmark_settings(ldap_port):
+    """Return the settings to override while benchmarking."""
+    caches = {alias: dict(config, KEY_PREFIX="benchmark") for alias, config in settings.CACHES.items()}
+    return {"LDAP_SERVER": "ldap://localhost:{}".format(ldap_port), "USE_SASL": False, "FCPS_EMERGENCY_PAGE": None, "CACHES": caches}
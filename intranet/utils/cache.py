@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from django.core.cache import cache
+
+
+def get_version(key):
+    """Return the version stored in the cache at ``key``, which can be put in other cache
+    keys so that changing it (with mark_changed) invalidates all of them at once."""
+    version = cache.get(key)
+    if version is None:
+        version = datetime.now().timestamp()
+        cache.add(key, version, None)
+    return version
+
+
+def mark_changed(key):
+    """Change the version stored in the cache at ``key``."""
+    cache.set(key, datetime.now().timestamp(), None)
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import csv
+
+from django.http import StreamingHttpResponse
+
+
+class Echo(object):
+    """A file-like object whose write() returns what is written, so that csv.writer can produce
+    the lines of a streamed response."""
+
+    def write(self, value):
+        return value
+
+
+def streaming_csv_response(rows, filename):
+    """Return a response that streams the rows (lists of values) from an iterable as a CSV
+    attachment, without building the file in memory."""
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type="text/csv")
+    response["Content-Disposition"] = "attachment; filename=\"{}\"".format(filename)
+    return response
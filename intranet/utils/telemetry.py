@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""Low-overhead counters of the LDAP, SQL and cache work done by each request, and per-view
+aggregates of them."""
+
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ..db.ldap_db import ldap_pool, search_count, search_time
+
+logger = logging.getLogger(__name__)
+_thread_locals = threading.local()
+
+_MISSING = object()
+
+PROCESSES_CACHE_KEY = "telemetry:processes"
+
+# The fields of each per-view sample
+SAMPLE_FIELDS = ("total_ms", "ldap_searches", "ldap_ms", "sql_queries", "sql_ms", "cache_gets", "cache_hits", "cache_ms")
+
+
+class RequestStats(object):
+    """The work done so far by the current request.
+
+    LDAP searches are counted by :class:`intranet.db.ldap_db.LDAPConnection`
+    itself, so only the counts at the start of the request are kept.
+
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.ldap_start = (search_count(), search_time())
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.cache_gets = 0
+        self.cache_hits = 0
+        self.cache_sets = 0
+        self.cache_time = 0.0
+        # Cache calls made by other cache calls (e.g. get_many calling get) aren't counted twice
+        self.cache_depth = 0
+
+    @property
+    def ldap_searches(self):
+        return search_count() - self.ldap_start[0]
+
+    @property
+    def ldap_time(self):
+        return search_time() - self.ldap_start[1]
+
+    @property
+    def total_time(self):
+        return time.time() - self.start
+
+    def sample(self):
+        """Return a tuple of the values of SAMPLE_FIELDS, with times in milliseconds."""
+        return (round(self.total_time * 1000, 1), self.ldap_searches, round(self.ldap_time * 1000, 1), self.sql_queries,
+                round(self.sql_time * 1000, 1), self.cache_gets, self.cache_hits, round(self.cache_time * 1000, 1))
+
+    def summary(self):
+        """Return the stats in the format used in the access log."""
+        return "time={:.0f}ms ldap={}/{:.0f}ms sql={}/{:.0f}ms cache={}/{}/{}/{:.0f}ms".format(
+            self.total_time * 1000, self.ldap_searches, self.ldap_time * 1000, self.sql_queries, self.sql_time * 1000, self.cache_hits,
+            self.cache_gets, self.cache_sets, self.cache_time * 1000)
+
+    def server_timing(self):
+        """Return the value of a Server-Timing header describing the stats."""
+        metrics = [("ldap", self.ldap_time, "{} searches".format(self.ldap_searches)),
+                   ("db", self.sql_time, "{} queries".format(self.sql_queries)),
+                   ("cache", self.cache_time, "{} of {} gets hit".format(self.cache_hits, self.cache_gets)),
+                   ("total", self.total_time, None)]
+        return ", ".join("{};dur={:.1f}".format(name, duration * 1000) + ('; desc="{}"'.format(desc) if desc else "")
+                         for name, duration, desc in metrics)
+
+
+def start_request():
+    _thread_locals.stats = RequestStats()
+    return _thread_locals.stats
+
+
+def end_request():
+    stats = current()
+    _thread_locals.stats = None
+    _thread_locals.last_stats = stats
+    return stats
+
+
+def current():
+    """Return the :class:`RequestStats` of the current request, or None outside of a request."""
+    return getattr(_thread_locals, "stats", None)
+
+
+def last_request():
+    """Return the :class:`RequestStats` of the last request this thread finished (e.g. in a test
+    client), or None."""
+    return getattr(_thread_locals, "last_stats", None)
+
+
+class TimedCursorWrapper(object):
+    """Wraps a database cursor to count and time the queries it runs."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def _timed(self, method, *args):
+        stats = current()
+        if stats is None:
+            return method(*args)
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            stats.sql_queries += 1
+            stats.sql_time += time.time() - start
+
+    def execute(self, sql, params=None):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def callproc(self, procname, params=None):
+        return self._timed(self.cursor.callproc, procname, params)
+
+
+def instrument_connection(connection):
+    """Make the cursors of a database connection count their queries.
+
+    Connections belong to a single thread, so this is done for each
+    thread the first time it handles a request.
+
+    """
+    if getattr(connection, "telemetry_instrumented", False):
+        return
+    make_cursor = connection.make_cursor
+    make_debug_cursor = connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(make_cursor(cursor))
+    connection.make_debug_cursor = lambda cursor: TimedCursorWrapper(make_debug_cursor(cursor))
+    connection.telemetry_instrumented = True
+
+
+def _timed_cache_method(method, counter):
+
+    @wraps(method)
+    def wrapped(*args, **kwargs):
+        stats = current()
+        if stats is None or stats.cache_depth:
+            return method(*args, **kwargs)
+        stats.cache_depth += 1
+        start = time.time()
+        try:
+            result = method(*args, **kwargs)
+            counter(stats, args, kwargs, result)
+            return result
+        finally:
+            stats.cache_depth -= 1
+            stats.cache_time += time.time() - start
+
+    return wrapped
+
+
+def _count_set(stats, args, kwargs, result):
+    data = args[0] if args else kwargs.get("data")
+    stats.cache_sets += len(data) if isinstance(data, dict) else 1
+
+
+def _count_get_many(stats, args, kwargs, result):
+    stats.cache_gets += len(args[0] if args else kwargs["keys"])
+    stats.cache_hits += len(result)
+
+
+def _count_other(stats, args, kwargs, result):
+    pass
+
+
+def instrument_cache(backend):
+    """Make a cache backend count its gets, hits and sets.
+
+    Like database connections, cache backends belong to a single thread.
+
+    """
+    if getattr(backend, "telemetry_instrumented", False):
+        return
+
+    timed_get = _timed_cache_method(backend.get, _count_other)
+
+    def get(key, default=None, version=None):
+        value = timed_get(key, _MISSING, version)
+        stats = current()
+        if stats is not None and not stats.cache_depth:
+            stats.cache_gets += 1
+            if value is not _MISSING:
+                stats.cache_hits += 1
+        return default if value is _MISSING else value
+
+    backend.get = get
+    backend.get_many = _timed_cache_method(backend.get_many, _count_get_many)
+    for name in ("set", "add", "set_many"):
+        setattr(backend, name, _timed_cache_method(getattr(backend, name), _count_set))
+    for name in ("delete", "delete_many", "incr", "decr"):
+        setattr(backend, name, _timed_cache_method(getattr(backend, name), _count_other))
+    backend.telemetry_instrumented = True
+
+
+class ViewStats(object):
+    """The recent samples of each view served by this process.
+
+    Samples are published to the cache every
+    TELEMETRY_PUBLISH_INTERVAL seconds, so that the stats of every
+    process can be read from any of them.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=settings.TELEMETRY_SAMPLES))
+        self.requests = defaultdict(int)
+        self.process = "{}:{}".format(socket.gethostname(), os.getpid())
+        self.published = time.time()
+
+    def record(self, view, sample):
+        with self.lock:
+            self.samples[view].append(sample)
+            self.requests[view] += 1
+            publish = time.time() - self.published > settings.TELEMETRY_PUBLISH_INTERVAL
+            if publish:
+                self.published = time.time()
+        if publish:
+            self.publish()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "views": {view: {"requests": self.requests[view], "samples": list(samples)} for view, samples in self.samples.items()},
+                "ldap_pool": ldap_pool.get_stats(),
+                "time": time.time()
+            }
+
+    def publish(self):
+        timeout = settings.TELEMETRY_PUBLISH_INTERVAL * 10
+        try:
+            cache.set(self.process_cache_key(self.process), self.snapshot(), timeout)
+            processes = cache.get(PROCESSES_CACHE_KEY) or set()
+            if self.process not in processes:
+                cache.set(PROCESSES_CACHE_KEY, processes | {self.process}, None)
+        except Exception:
+            logger.exception("Could not publish telemetry")
+
+    @staticmethod
+    def process_cache_key(process):
+        return "telemetry:process:{}".format(process)
+
+
+view_stats = ViewStats()
+
+
+def percentile(values, fraction):
+    """Return the value at ``fraction`` (from 0 to 1) of the sorted list ``values``."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(snapshots):
+    """Merge the snapshots of several processes into per-view percentiles and averages.
+
+    Returns:
+        A list of dicts, one for each view, slowest (by 90th percentile)
+        first.
+
+    """
+    merged = defaultdict(lambda: {"requests": 0, "samples": []})
+    for snapshot in snapshots:
+        for view, data in snapshot["views"].items():
+            merged[view]["requests"] += data["requests"]
+            merged[view]["samples"] += data["samples"]
+
+    summaries = []
+    for view, data in merged.items():
+        samples = data["samples"]
+        if not samples:
+            continue
+        columns = dict(zip(SAMPLE_FIELDS, zip(*samples)))
+        total_ms = sorted(columns["total_ms"])
+        gets = sum(columns["cache_gets"])
+        summaries.append({
+            "view": view,
+            "requests": data["requests"],
+            "samples": len(samples),
+            "p50_ms": percentile(total_ms, 0.5),
+            "p90_ms": percentile(total_ms, 0.9),
+            "p99_ms": percentile(total_ms, 0.99),
+            "max_ms": total_ms[-1],
+            "ldap_searches": sum(columns["ldap_searches"]) / len(samples),
+            "ldap_ms": sum(columns["ldap_ms"]) / len(samples),
+            "sql_queries": sum(columns["sql_queries"]) / len(samples),
+            "sql_ms": sum(columns["sql_ms"]) / len(samples),
+            "cache_hit_ratio": sum(columns["cache_hits"]) / gets if gets else None
+        })
+    return sorted(summaries, key=lambda s: s["p90_ms"], reverse=True)
+
+
+def get_snapshots():
+    """Return the published snapshots of every process, including an up to date one of this
+    process."""
+    processes = (cache.get(PROCESSES_CACHE_KEY) or set()) - {view_stats.process}
+    published = cache.get_many([ViewStats.process_cache_key(process) for process in processes])
+    snapshots = {process: published[ViewStats.process_cache_key(process)] for process in processes
+                 if ViewStats.process_cache_key(process) in published}
+    if len(snapshots) < len(processes):
+        # Forget processes that have stopped publishing
+        cache.set(PROCESSES_CACHE_KEY, set(snapshots) | {view_stats.process}, None)
+    snapshots[view_stats.process] = view_stats.snapshot()
+    return snapshots
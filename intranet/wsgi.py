@@ -23,6 +23,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "intranet.settings")
 application = get_wsgi_application()
 
+from intranet.apps.eighth.rosters import start_render_pool  # noqa
+start_render_pool()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)